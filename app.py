@@ -1,9 +1,70 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, g
-from init_db import get_filtered_parking_spots, initialize_db, get_next_available_date, get_minimum_price, get_maximum_price
+from flask import Flask, render_template, request, redirect, url_for, jsonify, g, stream_with_context
+from init_db import DATABASE, get_data_version, migrate_shards, get_price_stats, from_epoch, to_epoch
+from clusters import CLUSTER_MAX_ZOOM, get_clusters, merge_clusters
+from db import get_db, init_app
+from bookings import BookingConflict, booking_window, create_booking
+from nearby import MAX_RADIUS_KM, bounding_box, nearest_available_spots
+from shards import load_router
+from timeline import DAY, HORIZON_DAYS, format_interval, free_intervals, is_free, next_free_window
+from responses import RenderCache, cacheable, cacheable_json, columnar_spots, make_etag, not_modified
+import availability
+import bulk
+import metrics
 from datetime import datetime, timedelta
-import sqlite3
+import functools
+import hmac
+import json
+import logging
+import math
+import os
+import uuid
+
+# Does nothing when a server such as gunicorn already configured logging
+logging.basicConfig(
+    level=os.environ.get('CARSPOT_LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+)
 
 app = Flask(__name__)
+init_app(app)
+metrics.init_app(app)
+
+# Maps spot ids, cities and viewports to the shard databases this node serves, see shards.py
+ROUTER = load_router(DATABASE)
+
+
+def spot_db(spot_id):
+    """
+    Return the connection to the shard holding a spot.
+    :raises LookupError: If no shard served by this node holds the spot.
+    """
+    return get_db(ROUTER.for_spot(spot_id).path)
+
+
+def region_dbs(bounds=None, city=None):
+    """
+    Return the connections to the shards that may hold spots of a viewport or a city.
+    """
+    return [get_db(shard.path) for shard in ROUTER.for_region(bounds, city)]
+
+
+def data_versions(conns):
+    return [get_data_version(conn) for conn in conns]
+
+
+# Bearer token of the operator endpoints; they are disabled without it
+ADMIN_TOKEN = os.environ.get('CARSPOT_ADMIN_TOKEN')
+
+
+def admin_only(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify(error="Set CARSPOT_ADMIN_TOKEN to enable this endpoint"), 403
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {ADMIN_TOKEN}'):
+            return jsonify(error="A valid bearer token is required"), 401
+        return view(*args, **kwargs)
+    return wrapper
 
 
 def get_fontawesome_class(spot_type):
@@ -22,10 +83,15 @@ def get_spot_details(spot_id):
     :param spot_id: The ID of the parking spot to retrieve.
     :return: A dictionary containing the details of the parking spot.
     """
-    conn = get_db_connection()
+    try:
+        conn = spot_db(int(spot_id))
+    except (LookupError, TypeError, ValueError):
+        return None
     try:
         # Fetch the spot details from the database
-        spot_row = conn.execute('SELECT id, location, type, price, lat, lng FROM parking_spots WHERE id = ?', (spot_id,)).fetchone()
+        spot_row = conn.execute(
+            '-- name: spot_details\nSELECT id, location, type, price, lat, lng FROM parking_spots WHERE id = ?', (spot_id,)
+        ).fetchone()
         if spot_row:
             # Convert the row to a dictionary
             spot_details = {key: spot_row[key] for key in spot_row.keys()}
@@ -33,19 +99,57 @@ def get_spot_details(spot_id):
         else:
             # If no spot is found, return None or raise an exception as needed
             return None
-    except Exception as e:
+    except Exception:
         # Handle any exceptions, such as database errors
-        print(f"An error occurred while fetching spot details: {e}")
+        app.logger.exception("Fetching the details of spot %s failed", spot_id)
         return None
-    finally:
-        # Ensure the database connection is closed
-        conn.close()
 
 
-def get_db_connection():
-    conn = sqlite3.connect('parking.db')
-    conn.row_factory = sqlite3.Row  # This enables column access by name: row['column_name']
-    return conn
+def parse_bounds(raw_bounds):
+    """
+    Parse the map viewport sent by the client.
+    :param raw_bounds: A dict with 'south', 'west', 'north' and 'east' keys, or None.
+    :return: A (south, west, north, east) tuple of floats, or None when no viewport was sent.
+    """
+    if raw_bounds is None:
+        return None
+    try:
+        south, west, north, east = (float(raw_bounds[key]) for key in ('south', 'west', 'north', 'east'))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("bounds must contain numeric 'south', 'west', 'north' and 'east' values")
+    if south > north:
+        raise ValueError("bounds 'south' must not be greater than 'north'")
+    # Leaflet reports longitudes outside [-180, 180] after panning across the antimeridian
+    west, east = max(west, -180.0), min(east, 180.0)
+    return south, west, north, east
+
+
+def parse_zoom(raw_zoom):
+    if raw_zoom is None:
+        return None
+    try:
+        zoom = int(raw_zoom)
+    except (TypeError, ValueError):
+        raise ValueError("zoom must be an integer")
+    if not 0 <= zoom <= 22:
+        raise ValueError("zoom must be between 0 and 22")
+    return zoom
+
+
+def parse_price(raw_price):
+    """
+    :return: The maximum price as a float, or 'No Max' when there is none.
+    """
+    if raw_price in (None, '', 'No Max'):
+        return 'No Max'
+    try:
+        price = float(raw_price)
+    except (TypeError, ValueError):
+        raise ValueError("price must be a number or 'No Max'")
+    if not math.isfinite(price) or price < 0:
+        raise ValueError("price must be a non-negative number")
+    return price
+
 
 @app.route('/')
 @app.route('/index')
@@ -54,72 +158,255 @@ def index():
 
 @app.route('/map')
 def show_map():
-    conn = get_db_connection()
+    conns = region_dbs()
     today = datetime.now().strftime('%Y-%m-%d')
-    start_of_day = f"{today} 00:00:00"
-    end_of_day = f"{today} 23:59:59"
-
-    # Get minimum and maximum price from the database
-    min_price = get_minimum_price(conn)
-    max_price = get_maximum_price(conn)
-
-    default_filters = {
-        'type': 'All',
-        'price': 'No Max',
-        'startDate': start_of_day,
-        'endDate': end_of_day
-    }
 
-    spots_with_availability = get_filtered_parking_spots(
-        conn,
-        default_filters['type'],
-        default_filters['price'],
-        default_filters['startDate'],
-        default_filters['endDate']
-    )
-    
-    conn.close()
+    # The page only changes with the date and with writes, so visitors share one render
+    etag, body = MAP_PAGE_CACHE.get((today, tuple(data_versions(conns))), lambda: render_map(conns, today))
+    return not_modified(etag) or cacheable(body, 'text/html', etag)
+
 
-    # Pass the min_price and max_price to the template
+# Rendered map pages by (date, data versions of the shards)
+MAP_PAGE_CACHE = RenderCache()
+
+
+def render_map(conns, today):
+    # The price statistics of all shards, combined per type
+    price_stats = {}
+    for conn in conns:
+        for spot_type, stats in get_price_stats(conn).items():
+            combined = price_stats.setdefault(spot_type, dict(stats))
+            if combined is not stats:
+                combined['count'] += stats['count']
+                combined['min_price'] = min(combined['min_price'], stats['min_price'])
+                combined['max_price'] = max(combined['max_price'], stats['max_price'])
+    price_stats = dict(sorted(price_stats.items()))
+
+    # The spots themselves are loaded per viewport from /api/clusters once the map is shown
     return render_template(
         'map.html',
-        parking_spots=spots_with_availability,
-        min_price=min_price,
-        max_price=max_price,
+        cluster_max_zoom=CLUSTER_MAX_ZOOM,
+        min_price=min((stats['min_price'] for stats in price_stats.values()), default=0.00),
+        max_price=max((stats['max_price'] for stats in price_stats.values()), default=0.00),
+        price_stats=price_stats,
         today=today
     )
 
 
+def read_filters():
+    """
+    Read the filter parameters from the JSON body of a POST, or from the query string of a GET.
+    :return: A dictionary of normalized filters.
+    """
+    if request.method == 'POST':
+        filters = request.json
+        raw_bounds = filters.get('bounds')
+        only_available = bool(filters.get('onlyAvailable', False))
+    else:
+        filters = request.args
+        raw_bounds = None
+        if any(key in filters for key in ('south', 'west', 'north', 'east')):
+            raw_bounds = {key: filters.get(key) for key in ('south', 'west', 'north', 'east')}
+        only_available = filters.get('onlyAvailable', 'false').lower() in ('1', 'true', 'yes')
+
+    if not filters.get('startDate') or not filters.get('endDate'):
+        raise ValueError("startDate and endDate are required")
+    try:
+        start_ts, end_ts = to_epoch(filters['startDate']), to_epoch(filters['endDate'])
+    except (TypeError, ValueError):
+        raise ValueError("startDate and endDate must be 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS' dates")
+    if end_ts < start_ts:
+        raise ValueError("endDate must not be before startDate")
+
+    return {
+        'type': filters.get('type', 'All'),
+        'price': parse_price(filters.get('price')),
+        'startDate': filters['startDate'],
+        'endDate': filters['endDate'],
+        'onlyAvailable': only_available,
+        'bounds': parse_bounds(raw_bounds),
+        'city': filters.get('city') or None,
+        'zoom': parse_zoom(filters.get('zoom')),
+        'format': filters.get('format', 'rows')
+    }
 
 
-# Corrected function without double jsonify
-@app.route('/api/filter_parking_spots', methods=['POST'])
+@app.route('/api/filter_parking_spots', methods=['GET', 'POST'])
 def filter_parking_spots():
-    print("filter_parking_spots route called")  # Debug print
-    filters = request.json
-    conn = get_db_connection()
-    only_available = filters.get('onlyAvailable', False)
-    filtered_spots = get_filtered_parking_spots(
-        conn,
-        filters['type'],
-        filters['price'],
-        filters['startDate'],
-        filters['endDate'],
-        only_available
-    )
-    print(f"onlyAvailable filter received: {only_available}")  # Debug print
-    print(f"Filters received: {filters}")  # Debug print
-    conn.close()
-    print("Sending filtered spots:", filtered_spots)
+    """
+    Return the spots matching the filters. The GET variant takes the same parameters in the query
+    string and can be cached by browsers and proxies. format=columnar sends column arrays instead
+    of one object per spot.
+    """
+    try:
+        filters = read_filters()
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    if filters['format'] not in ('rows', 'columnar'):
+        return jsonify(error="format must be 'rows' or 'columnar'"), 400
+
+    conns = region_dbs(filters['bounds'], filters['city'])
+    etag = make_etag(data_versions(conns), filters)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    filtered_spots = []
+    for conn in conns:
+        filtered_spots.extend(availability.filter_spots(
+            conn,
+            filters['type'],
+            filters['price'],
+            filters['startDate'],
+            filters['endDate'],
+            filters['onlyAvailable'],
+            filters['bounds'],
+            filters['city']
+        ))
+
+    if filters['format'] == 'columnar':
+        payload = columnar_spots(filtered_spots)
+    else:
+        payload = {'filteredSpots': [dict(spot) for spot in filtered_spots]}
+
+    if filters['bounds'] is not None:
+        # Echo the viewport so the client can drop responses for a view it has already left
+        south, west, north, east = filters['bounds']
+        payload['viewport'] = {'south': south, 'west': west, 'north': north, 'east': east, 'zoom': filters['zoom']}
 
-    return jsonify(filteredSpots=[dict(spot) for spot in filtered_spots])
+    return cacheable_json(payload, etag)
 
 
 
+@app.route('/api/clusters', methods=['GET'])
+def spot_clusters():
+    """
+    Return the spots of the viewport pre-aggregated per map tile, or the individual spots
+    once the map is zoomed in past CLUSTER_MAX_ZOOM.
+    """
+    try:
+        bounds = parse_bounds({key: request.args.get(key) for key in ('south', 'west', 'north', 'east')})
+        zoom = parse_zoom(request.args.get('zoom'))
+        day = datetime.strptime(request.args.get('date', datetime.now().strftime('%Y-%m-%d')), '%Y-%m-%d')
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    if zoom is None:
+        return jsonify(error="zoom is required"), 400
+
+    day = day.strftime('%Y-%m-%d')
+    conns = region_dbs(bounds)
+    if zoom > CLUSTER_MAX_ZOOM:
+        spots = []
+        for conn in conns:
+            spots.extend(availability.filter_spots(
+                conn, 'All', 'No Max', f"{day} 00:00:00", f"{day} 23:59:59", bounds=bounds
+            ))
+        return jsonify(zoom=zoom, spots=spots)
+    return jsonify(zoom=zoom, clusters=merge_clusters(get_clusters(conn, zoom, bounds, day) for conn in conns))
+
+
+@app.route('/api/nearest_spots', methods=['GET'])
+def nearest_spots():
+    """
+    Return the k spots nearest to lat/lng that are free for the whole window, nearest first.
+    Dates without a time cover whole days, as in the booking form.
+    """
+    try:
+        lat = float(request.args['lat'])
+        lng = float(request.args['lng'])
+    except (KeyError, ValueError):
+        return jsonify(error="lat and lng are required numbers"), 400
+    if not -90 <= lat <= 90 or not -180 <= lng <= 180:
+        return jsonify(error="lat or lng out of range"), 400
+
+    try:
+        k = int(request.args.get('k', 10))
+        max_distance = float(request.args.get('maxDistance', MAX_RADIUS_KM))
+    except ValueError:
+        return jsonify(error="k must be an integer and maxDistance a number"), 400
+    try:
+        max_price = parse_price(request.args.get('price'))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    if not 1 <= k <= 100:
+        return jsonify(error="k must be between 1 and 100"), 400
+    if not 0 < max_distance <= 100:
+        return jsonify(error="maxDistance must be between 0 and 100 km"), 400
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    start_date, end_date = booking_window(request.args.get('startDate', today), request.args.get('endDate', today))
+    try:
+        start_ts, end_ts = to_epoch(start_date), to_epoch(end_date)
+    except ValueError:
+        return jsonify(error="startDate and endDate must be dates"), 400
+    if end_ts < start_ts:
+        return jsonify(error="endDate must not be before startDate"), 400
+
+    spots = []
+    for conn in region_dbs(bounding_box(lat, lng, max_distance)):
+        spots.extend(nearest_available_spots(
+            conn, lat, lng, start_date, end_date, k, request.args.get('type', 'All'), max_price, max_distance
+        ))
+    # Each shard returned its k nearest; keep the k nearest overall
+    spots = sorted(spots, key=lambda spot: (spot['distance_km'], spot['id']))[:k]
+    return jsonify(origin={'lat': lat, 'lng': lng}, startDate=start_date, endDate=end_date, spots=spots)
+
+
+@app.route('/api/availability', methods=['GET', 'POST'])
+def spot_availability():
+    """
+    Return the free intervals of many spots at once, plus each spot's next free window of at
+    least minHours. Takes ids as a comma-separated query parameter, or a JSON body with the same
+    keys and 'ids' as a list. The window runs from 'from' (default now) to 'until' (default
+    HORIZON_DAYS later); wholeDays=true only offers windows made of whole days.
+    """
+    params = (request.get_json(silent=True) or {}) if request.method == 'POST' else request.args
+    try:
+        ids = params.get('ids', [])
+        if isinstance(ids, str):
+            ids = [spot_id for spot_id in ids.split(',') if spot_id.strip()]
+        ids = [int(spot_id) for spot_id in ids]
+        start_ts = to_epoch(params['from']) if params.get('from') else to_epoch(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        end_ts = to_epoch(booking_window(params['until'], params['until'])[1]) if params.get('until') \
+            else start_ts + HORIZON_DAYS * DAY - 1
+        min_seconds = int(float(params.get('minHours', 1)) * 3600)
+    except (TypeError, ValueError, OverflowError):
+        return jsonify(error="ids must be integers, from and until dates, minHours a number"), 400
+    whole_days = str(params.get('wholeDays', 'false')).lower() in ('1', 'true', 'yes')
+
+    if not ids or len(ids) > 1000:
+        return jsonify(error="between 1 and 1000 ids are required"), 400
+    if end_ts < start_ts or end_ts - start_ts > 366 * DAY:
+        return jsonify(error="until must be after from and at most a year later"), 400
+    if min_seconds <= 0:
+        return jsonify(error="minHours must be positive"), 400
+
+    groups, _ = ROUTER.group_ids(ids)
+    timelines = {}
+    for shard, shard_ids in groups.items():
+        timelines.update(free_intervals(get_db(shard.path), shard_ids, start_ts, end_ts))
+    spots = {}
+    for spot_id, intervals in timelines.items():
+        window = next_free_window(intervals, min_seconds, whole_days=whole_days)
+        spots[str(spot_id)] = {
+            'free': [format_interval(interval) for interval in intervals],
+            'next_free': format_interval(window) if window else None
+        }
+    return jsonify(
+        window=format_interval((start_ts, end_ts)), spots=spots,
+        unknown=sorted(set(ids) - set(timelines))
+    )
+
+
 @app.route('/book/<int:spot_id>', methods=['GET'])
 def book(spot_id):
-    conn = get_db_connection()
-    spot_row = conn.execute('SELECT id, location, type, price FROM parking_spots WHERE id = ?', (spot_id,)).fetchone()
+    try:
+        conn = spot_db(spot_id)
+    except LookupError:
+        return "Spot not found", 404
+    spot_row = conn.execute(
+        '-- name: spot_details\nSELECT id, location, type, price FROM parking_spots WHERE id = ?', (spot_id,)
+    ).fetchone()
     
     if not spot_row:
         return "Spot not found", 404
@@ -128,10 +415,6 @@ def book(spot_id):
     spot_details = {key: spot_row[key] for key in spot_row.keys()}
     spot_details['price'] = "{:.2f}".format(spot_details['price'])
 
-    # Check for booking details and next available date
-    available, next_available_date = get_next_available_date(conn, spot_id)
-    conn.close()
-
     # Format dates to pass to the template
     now = datetime.now()
     today = datetime.today().strftime('%Y-%m-%d')
@@ -141,18 +424,35 @@ def book(spot_id):
     formatted_max_date = (now + timedelta(days=3)).strftime('%Y-%m-%d')
     start_date = request.args.get('start_date', formatted_default_start_date)
     end_date = request.args.get('end_date', formatted_default_end_date)
-    
-        # You would need to calculate the minimum end date in Python
+
+    # The requested days are available if they lie inside one free interval of the spot.
+    # Otherwise offer the first free window of as many whole days after the requested start.
+    try:
+        window_start, window_end = (to_epoch(date) for date in booking_window(start_date, end_date))
+    except ValueError:
+        return "start_date and end_date must be dates", 400
+    horizon_start = to_epoch(today)
+    horizon_end = max(horizon_start + HORIZON_DAYS * DAY, window_end)
+    intervals = free_intervals(conn, [spot_id], horizon_start, horizon_end).get(spot_id, [])
+    available = is_free(intervals, window_start, window_end)
+
+    next_available_date = next_available_end_date = None
     if not available:
+        window = next_free_window(intervals, window_end - window_start + 1,
+                                  not_before=max(window_start, horizon_start), whole_days=True)
+        if window:
+            next_available_date = from_epoch(window[0]).strftime('%Y-%m-%d')
+            next_available_end_date = from_epoch(window[1]).strftime('%Y-%m-%d')
+
+    # You would need to calculate the minimum end date in Python
+    if next_available_date:
         min_end_date = datetime.strptime(next_available_date, '%Y-%m-%d') + timedelta(days=1)
     else:
-        min_end_date = datetime.strptime(start_date, '%Y-%m-%d') + timedelta(days=1)
+        min_end_date = datetime.strptime(start_date[:10], '%Y-%m-%d') + timedelta(days=1)
     
     formatted_min_end_date = min_end_date.strftime('%Y-%m-%d')
     
 
-    conn.close()
-
     return render_template(
         'book.html',
         spot=spot_details,
@@ -162,24 +462,101 @@ def book(spot_id):
         default_end_date=formatted_default_end_date,
         min_end_date=formatted_min_end_date,
         max_date=formatted_max_date,
-        next_available_date=next_available_date, 
+        next_available_date=next_available_date,
+        next_available_end_date=next_available_end_date,
+        horizon_days=HORIZON_DAYS,
         start_date=start_date,  
-        end_date=end_date  
+        end_date=end_date,
+        idempotency_key=uuid.uuid4().hex
     )
 
 @app.route('/confirm_booking', methods=['POST'])
 def confirm_booking():
     # Get the form data
-    spot_id = request.form.get('spot_id')
+    spot_id = request.form.get('spot_id', type=int)
     start_date = request.form.get('start_date')
     end_date = request.form.get('end_date')
+    idempotency_key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
 
-    # Perform your booking logic here, like saving the booking to the database.
-    # ...
+    # The booking page posts a plain form and expects a page back; scripted clients get JSON
+    wants_json = request.accept_mimetypes.best_match(['application/json', 'text/html']) == 'application/json'
 
-    # Assuming the booking was successful, redirect to the confirmation page.
+    def failure(message, status):
+        if wants_json:
+            return jsonify(success=False, message=message), status
+        return message, status
+
+    if spot_id is None or not start_date or not end_date:
+        return failure("spot_id, start_date and end_date are required", 400)
+
+    try:
+        conn = spot_db(spot_id)
+        booking, created = create_booking(conn, spot_id, start_date, end_date, idempotency_key)
+    except BookingConflict as e:
+        return failure(str(e), 409)
+    except LookupError as e:
+        return failure(str(e), 404)
+    except ValueError as e:
+        # create_booking words these itself, parser errors never reach the client
+        return failure(str(e), 400)
+
+    if created:
+        availability.booking_added(conn, booking)
+
+    if wants_json:
+        return jsonify(
+            success=True, created=created, booking_id=booking['id'],
+            spot_id=spot_id, start_date=start_date, end_date=end_date
+        ), 201 if created else 200
+
+    # The booking is saved, redirect to the confirmation page.
     return redirect(url_for('confirmation', spot_id=spot_id, start_date=start_date, end_date=end_date))
 
+@app.route('/api/import/<kind>', methods=['POST'])
+@admin_only
+def bulk_import(kind):
+    """
+    Import spots or bookings from an NDJSON or CSV request body, see bulk.py. The body is parsed
+    while it arrives and the response streams one NDJSON report per committed batch, the last
+    one with done set, so a long import shows its progress.
+    """
+    fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+    if kind not in bulk.COLUMNS or fmt not in bulk.FORMATS:
+        return jsonify(error="kind must be spots or bookings, format ndjson or csv"), 400
+    batch_size = request.args.get('batchSize', bulk.BATCH_SIZE, type=int)
+    if not 1 <= batch_size <= 100000:
+        return jsonify(error="batchSize must be between 1 and 100000"), 400
+
+    def reports():
+        records = bulk.read_records(bulk.text_lines(request.stream), fmt)
+        report = None
+        try:
+            for report in bulk.import_records(ROUTER, get_db, kind, records, batch_size):
+                yield json.dumps(report) + '\n'
+        except Exception:
+            app.logger.exception("Importing %s failed", kind)
+            yield json.dumps(dict(report or {}, done=True, error="The import failed, rows after the last report were not imported")) + '\n'
+
+    return app.response_class(stream_with_context(reports()), mimetype=bulk.MIMETYPES['ndjson'])
+
+
+@app.route('/api/export/<kind>', methods=['GET'])
+@admin_only
+def bulk_export(kind):
+    """
+    Stream all spots or bookings, optionally of one city, as NDJSON or CSV, see bulk.py.
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if kind not in bulk.COLUMNS or fmt not in bulk.FORMATS:
+        return jsonify(error="kind must be spots or bookings, format ndjson or csv"), 400
+    city = request.args.get('city') or None
+
+    chunks = bulk.export_records(region_dbs(city=city), kind, fmt, city)
+    response = app.response_class(stream_with_context(chunks), mimetype=bulk.MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={kind}.{fmt}'
+    return response
+
+
 @app.route('/confirmation')
 def confirmation():
     spot_id = request.args.get('spot_id')
@@ -208,7 +585,9 @@ def confirmation():
 
 
 
-initialize_db()
+# Only migrates when the schema is out of date; seeding is a separate step (python init_db.py seed)
+migrate_shards(ROUTER)
+availability.warm_up([shard.path for shard in ROUTER.shards])
 
 if __name__ == '__main__':
     app.run(debug=True)
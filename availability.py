@@ -0,0 +1,278 @@
+# In-process availability index: the spots and an hourly booking bitmap for the bookable
+# horizon, kept in NumPy arrays so the map filters are answered with vectorized operations instead
+# of a SQL join over bookings. It is optional: without NumPy, or with CARSPOT_AVAILABILITY_INDEX=0,
+# everything goes through SQL. Each worker process holds one index per database, i.e. per shard,
+# and uses the data version to notice writes made by other processes.
+import calendar
+import os
+import threading
+from datetime import datetime, timedelta
+
+from db import connect
+from init_db import DATABASE, get_data_version, get_filtered_parking_spots, get_rewrite_count, to_epoch
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+SLOT_SECONDS = 3600
+# The horizon starts a day back so that windows starting earlier today are still covered
+HORIZON_DAYS_BEFORE = 1
+HORIZON_DAYS = 32
+
+ENABLED = np is not None and os.environ.get('CARSPOT_AVAILABILITY_INDEX', '1') != '0'
+
+
+class AvailabilityIndex:
+    """
+    Spot attributes as column arrays plus one bit per spot and hourly slot, set when a booking
+    touches that slot.
+    """
+
+    def __init__(self, conn):
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.horizon_start = calendar.timegm((today - timedelta(days=HORIZON_DAYS_BEFORE)).timetuple())
+        self.slot_count = HORIZON_DAYS * 24
+        self.horizon_end = self.horizon_start + self.slot_count * SLOT_SECONDS - 1
+
+        # Read everything in one transaction so the version matches the rows
+        conn.execute('BEGIN')
+        try:
+            self.version = get_data_version(conn)
+            self.rewrites = get_rewrite_count(conn)
+            spots = conn.execute(
+                'SELECT id, location, lat, lng, type, price, city FROM parking_spots ORDER BY id').fetchall()
+            bookings = conn.execute(
+                'SELECT spot_id, start_ts, end_ts FROM bookings WHERE end_ts >= ? AND start_ts <= ?',
+                (self.horizon_start, self.horizon_end)
+            ).fetchall()
+            self.booking_watermark = conn.execute('SELECT COALESCE(MAX(id), 0) FROM bookings').fetchone()[0]
+            self.spot_watermark = spots[-1][0] if spots else 0
+        finally:
+            conn.rollback()
+
+        # Guards the bitmap, which catch_up and booking_added update in place while queries read it
+        self.lock = threading.Lock()
+
+        self.ids = np.array([spot[0] for spot in spots], dtype=np.int64)
+        self.locations = [spot[1] for spot in spots]
+        self.lat = np.array([spot[2] if spot[2] is not None else np.nan for spot in spots], dtype=np.float64)
+        self.lng = np.array([spot[3] if spot[3] is not None else np.nan for spot in spots], dtype=np.float64)
+        self.types = sorted({spot[4] for spot in spots if spot[4] is not None})
+        type_codes = {spot_type: code for code, spot_type in enumerate(self.types)}
+        self.type_codes = np.array([type_codes.get(spot[4], -1) for spot in spots], dtype=np.int16)
+        self.prices = np.array([spot[5] if spot[5] is not None else np.nan for spot in spots], dtype=np.float64)
+        self.cities = sorted({spot[6] for spot in spots if spot[6] is not None})
+        city_codes = {city: code for code, city in enumerate(self.cities)}
+        self.city_codes = np.array([city_codes.get(spot[6], -1) for spot in spots], dtype=np.int32)
+
+        # One row of packed bits per spot; bit k of a row is slot k
+        self.bits = np.zeros((len(spots), (self.slot_count + 7) // 8), dtype=np.uint8)
+        for spot_id, start_ts, end_ts in bookings:
+            self._mark(spot_id, start_ts, end_ts)
+
+    def _row(self, spot_id):
+        row = int(np.searchsorted(self.ids, spot_id))
+        if row < len(self.ids) and self.ids[row] == spot_id:
+            return row
+        return None
+
+    def _mark(self, spot_id, start_ts, end_ts):
+        row = self._row(spot_id)
+        if row is None or end_ts < self.horizon_start or start_ts > self.horizon_end:
+            return
+        first = (max(start_ts, self.horizon_start) - self.horizon_start) // SLOT_SECONDS
+        last = (min(end_ts, self.horizon_end) - self.horizon_start) // SLOT_SECONDS
+        slots = np.unpackbits(self.bits[row], bitorder='little')
+        slots[first:last + 1] = 1
+        self.bits[row] = np.packbits(slots, bitorder='little')
+
+    def covers(self, start_ts, end_ts):
+        return self.horizon_start <= start_ts <= end_ts <= self.horizon_end
+
+    def catch_up(self, conn):
+        """
+        Apply the bookings added by other processes since this index was built.
+        Reads only the rows appended since, so the cost does not grow with the booking history.
+        :return: False if something else changed, in which case the index must be rebuilt.
+        """
+        conn.execute('BEGIN')
+        try:
+            version = get_data_version(conn)
+            rewrites = get_rewrite_count(conn)
+            spot_watermark = conn.execute('SELECT COALESCE(MAX(id), 0) FROM parking_spots').fetchone()[0]
+            new_bookings = conn.execute(
+                'SELECT id, spot_id, start_ts, end_ts FROM bookings WHERE id > ?', (self.booking_watermark,)
+            ).fetchall()
+        finally:
+            conn.rollback()
+
+        # Only appended bookings can be applied in place; an updated or deleted row of either
+        # table, or a new spot, needs a rebuild. Every insert bumps the version once, so a version
+        # that moved further than the appended bookings account for means some other insert, e.g.
+        # a spot or a booking with an id below the watermark.
+        if rewrites != self.rewrites or spot_watermark != self.spot_watermark:
+            return False
+        if version - self.version != len(new_bookings):
+            return False
+
+        with self.lock:
+            for _, spot_id, start_ts, end_ts in new_bookings:
+                self._mark(spot_id, start_ts, end_ts)
+        if new_bookings:
+            self.booking_watermark = new_bookings[-1][0]
+        self.version = version
+        return True
+
+    def booking_added(self, booking):
+        """
+        Write-through update for a booking created by this process.
+        Only applied when it is the very next write; otherwise the next query catches up.
+        """
+        if booking['data_version'] != self.version + 1:
+            return
+        with self.lock:
+            self._mark(booking['spot_id'], booking['start_ts'], booking['end_ts'])
+        self.booking_watermark = max(self.booking_watermark, booking['id'])
+        self.version = booking['data_version']
+
+    def query(self, conn, spot_type, max_price, start_ts, end_ts, only_available=False, bounds=None, city=None):
+        """
+        Same result as get_filtered_parking_spots, answered from the arrays.
+        """
+        mask = np.ones(len(self.ids), dtype=bool)
+        if bounds is not None:
+            south, west, north, east = bounds
+            mask &= (self.lat >= south) & (self.lat <= north) & (self.lng >= west) & (self.lng <= east)
+        if spot_type and spot_type != 'All':
+            code = self.types.index(spot_type) if spot_type in self.types else -2
+            mask &= self.type_codes == code
+        if max_price and max_price != 'No Max':
+            mask &= self.prices <= float(max_price)
+        if city:
+            code = self.cities.index(city.lower()) if city.lower() in self.cities else -2
+            mask &= self.city_codes == code
+        rows = np.flatnonzero(mask)
+
+        # Slots lying entirely inside the window decide on their own: any booking touching one
+        # overlaps the window. A partially covered first or last slot only flags a candidate,
+        # which is checked against the bookings table.
+        first = (start_ts - self.horizon_start) // SLOT_SECONDS
+        last = (end_ts - self.horizon_start) // SLOT_SECONDS
+        # Unpacking copies the slots out, so the lock is released before the SQL edge check
+        with self.lock:
+            slots = np.unpackbits(self.bits[rows, first // 8:last // 8 + 1], axis=1, bitorder='little')
+        slots = slots[:, first % 8:first % 8 + last - first + 1]
+
+        full_first = first if start_ts == self.horizon_start + first * SLOT_SECONDS else first + 1
+        full_last = last if end_ts == self.horizon_start + (last + 1) * SLOT_SECONDS - 1 else last - 1
+        booked = slots[:, full_first - first:full_last - first + 1].any(axis=1) if full_first <= full_last \
+            else np.zeros(len(rows), dtype=bool)
+
+        edge = slots[:, [0, -1]].any(axis=1) & ~booked
+        if edge.any():
+            booked[edge] = _overlapping(conn, self.ids[rows[edge]], start_ts, end_ts)
+
+        if only_available:
+            rows, booked = rows[~booked], booked[~booked]
+
+        types = self.types + [None]  # code -1 maps to None
+        return [
+            {'id': spot_id, 'location': location, 'lat': lat, 'lng': lng, 'type': types[code], 'price': price,
+             'available': 0 if is_booked else 1}
+            for spot_id, location, lat, lng, code, price, is_booked in zip(
+                self.ids[rows].tolist(), [self.locations[row] for row in rows.tolist()],
+                self.lat[rows].tolist(), self.lng[rows].tolist(), self.type_codes[rows].tolist(),
+                self.prices[rows].tolist(), booked.tolist()
+            )
+        ]
+
+
+def _overlapping(conn, spot_ids, start_ts, end_ts):
+    """
+    Return a boolean array telling which of the spots have a booking overlapping the window.
+    """
+    booked = set()
+    spot_ids = spot_ids.tolist()
+    for i in range(0, len(spot_ids), 500):
+        chunk = spot_ids[i:i + 500]
+        placeholders = ','.join('?' * len(chunk))
+        booked.update(row[0] for row in conn.execute(f'''-- name: edge_overlaps
+            SELECT DISTINCT spot_id FROM bookings
+            WHERE spot_id IN ({placeholders}) AND end_ts >= ? AND start_ts <= ?
+        ''', chunk + [start_ts, end_ts]))
+    return np.array([spot_id in booked for spot_id in spot_ids], dtype=bool)
+
+
+# Indexes by database path, each built and caught up under a lock of its own, so a rebuild of
+# one shard's index does not hold up the queries of the others
+_indexes = {}
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def _path_lock(path):
+    with _locks_lock:
+        return _locks.setdefault(path, threading.Lock())
+
+
+def get_index(conn):
+    """
+    Return this process's index of the connection's database, up to date with it, or None when
+    indexes are disabled.
+    """
+    if not ENABLED:
+        return None
+    path = getattr(conn, 'path', DATABASE)
+    with _path_lock(path):
+        index = _indexes.get(path)
+        today = calendar.timegm(datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timetuple())
+        if index is not None and index.horizon_start + HORIZON_DAYS_BEFORE * 86400 != today:
+            index = None  # A new day started, move the horizon along
+        if index is not None and get_data_version(conn) != index.version and not index.catch_up(conn):
+            index = None
+        if index is None:
+            index = AvailabilityIndex(conn)
+        _indexes[path] = index
+        return index
+
+
+def warm_up(paths=(DATABASE,)):
+    """
+    Build the indexes at startup so the first map request does not pay for them.
+    """
+    if ENABLED:
+        for path in paths:
+            conn = connect(path)
+            try:
+                get_index(conn)
+            finally:
+                conn.close()
+
+
+def booking_added(conn, booking):
+    """
+    Write-through hook for bookings created by this process through conn.
+    """
+    path = getattr(conn, 'path', DATABASE)
+    with _path_lock(path):
+        index = _indexes.get(path)
+        if index is not None:
+            index.booking_added(booking)
+
+
+def filter_spots(conn, spot_type, max_price, start_date, end_date, only_available=False, bounds=None, city=None):
+    """
+    get_filtered_parking_spots, answered from the availability index when the window is inside
+    its horizon.
+    """
+    index = get_index(conn)
+    if index is not None:
+        try:
+            start_ts, end_ts = to_epoch(start_date), to_epoch(end_date)
+        except ValueError:
+            start_ts = end_ts = None
+        if start_ts is not None and start_ts <= end_ts and index.covers(start_ts, end_ts):
+            return index.query(conn, spot_type, max_price, start_ts, end_ts, only_available, bounds, city)
+    return get_filtered_parking_spots(conn, spot_type, max_price, start_date, end_date, only_available, bounds, city)
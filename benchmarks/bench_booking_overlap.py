@@ -0,0 +1,116 @@
+"""
+Before/after benchmark of the availability check in get_filtered_parking_spots.
+
+"Before" is the original LEFT JOIN on a GROUP BY subquery comparing the TEXT dates, which has
+no index to use. "After" is the current query: an EXISTS probe on the epoch columns served by
+idx_bookings_spot_time.
+
+    python -m benchmarks.bench_booking_overlap --spots 2000 --bookings 2000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from init_db import get_filtered_parking_spots, migrate_booking_times
+
+LEGACY_QUERY = '''
+    SELECT ps.id, ps.location, ps.lat, ps.lng, ps.type, ps.price,
+    CASE WHEN b.spot_id IS NULL THEN 1 ELSE 0 END AS available
+    FROM parking_spots ps
+    LEFT JOIN (
+        SELECT spot_id
+        FROM bookings
+        WHERE end_date >= ? AND start_date <= ?
+        GROUP BY spot_id
+    ) b ON ps.id = b.spot_id
+'''
+
+
+def build_database(path, spot_count, booking_count, history_days, seed):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('CREATE TABLE parking_spots (id INTEGER PRIMARY KEY AUTOINCREMENT, location TEXT, type TEXT, price REAL, lat REAL, lng REAL)')
+    conn.execute('CREATE TABLE bookings (id INTEGER PRIMARY KEY AUTOINCREMENT, spot_id INTEGER, start_date TEXT, end_date TEXT)')
+    conn.executemany(
+        'INSERT INTO parking_spots (location, type, price, lat, lng) VALUES (?, ?, ?, ?, ?)',
+        (('Benchmark Location', rng.choice(['Standard', 'Electric', 'Handicap']), rng.uniform(1, 10),
+          51.2277 + rng.uniform(-0.1, 0.1), 6.7735 + rng.uniform(-0.1, 0.1)) for _ in range(spot_count))
+    )
+
+    # Bookings spread over the past history_days, as an old production table would be
+    now = datetime.now()
+
+    def bookings():
+        for _ in range(booking_count):
+            start = now - timedelta(minutes=rng.randint(0, history_days * 24 * 60))
+            end = start + timedelta(hours=rng.randint(1, 72))
+            yield rng.randint(1, spot_count), start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S')
+
+    conn.executemany('INSERT INTO bookings (spot_id, start_date, end_date) VALUES (?, ?, ?)', bookings())
+    conn.commit()
+    return conn
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--spots', type=int, default=2000)
+    parser.add_argument('--bookings', type=int, default=2000000)
+    parser.add_argument('--history-days', type=int, default=730)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        started = time.perf_counter()
+        conn = build_database(path, args.spots, args.bookings, args.history_days, args.seed)
+        print(f"Built {args.spots} spots / {args.bookings} bookings in {time.perf_counter() - started:.1f}s")
+
+        today = datetime.now().strftime('%Y-%m-%d')
+        window = (f"{today} 00:00:00", f"{today} 23:59:59")
+
+        before = best_of(args.repeat, lambda: conn.execute(LEGACY_QUERY, window).fetchall())
+        before_rows = conn.execute(LEGACY_QUERY, window).fetchall()
+
+        started = time.perf_counter()
+        migrate_booking_times(conn.cursor())
+        conn.commit()
+        print(f"Migration (epoch columns + indexes) took {time.perf_counter() - started:.1f}s")
+
+        def after_query():
+            return get_filtered_parking_spots(conn, 'All', 'No Max', *window)
+
+        after = best_of(args.repeat, after_query)
+        after_rows = after_query()
+
+        assert [row[6] for row in before_rows] == [spot['available'] for spot in after_rows], 'availability differs'
+        print(f"Legacy LEFT JOIN on TEXT dates: {before * 1000:8.1f} ms")
+        print(f"Indexed EXISTS on epoch dates:  {after * 1000:8.1f} ms")
+        print(f"Speed-up: {before / after:.1f}x")
+
+        spot_id = args.spots // 2
+        legacy_next = best_of(args.repeat, lambda: conn.execute(
+            'SELECT end_date FROM bookings NOT INDEXED WHERE spot_id = ? ORDER BY end_date DESC LIMIT 1', (spot_id,)).fetchone())
+        indexed_next = best_of(args.repeat, lambda: conn.execute(
+            'SELECT MAX(end_ts) FROM bookings WHERE spot_id = ?', (spot_id,)).fetchone())
+        print(f"Next available date, unindexed: {legacy_next * 1000:8.3f} ms, indexed: {indexed_next * 1000:8.3f} ms")
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Throughput and memory of the streaming bulk import and export, see bulk.py.
+
+For each size, spots and then one booking per spot are imported into a fresh database from CSV
+and NDJSON lines generated on the fly, and the spots are exported again. Reports rows/s and the
+per-batch latencies of every step, and the peak RSS of the process after it; the sizes run in
+increasing order, so a flat peak RSS shows that memory does not grow with the input.
+
+The RSS includes SQLite's page cache and memory-mapped pages, which connect() lets grow to
+64 MiB and 256 MiB as the database grows. --small-cache turns both down, so the peak RSS only
+shows the memory of the import and export themselves.
+
+    python -m benchmarks.bulk_import --sizes 10000,100000,1000000 --output bulk.json
+    python -m benchmarks.bulk_import --sizes 10000,1000000,10000000 --small-cache
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import bulk
+from benchmarks.common import quiet_slow_query_log, summarize, write_results
+from db import connect
+from init_db import migrate_shards
+from shards import Shard, ShardRouter
+
+
+def spot_lines(count, rng):
+    yield 'location,type,price,lat,lng,city\n'
+    for i in range(count):
+        yield (f"Garage {i},{rng.choice(['Standard', 'Electric', 'Handicap'])},{rng.uniform(1, 10):.2f},"
+               f"{51.2277 + rng.uniform(-0.1, 0.1):.6f},{6.7735 + rng.uniform(-0.1, 0.1):.6f},dusseldorf\n")
+
+
+def booking_lines(count, rng):
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    for spot_id in range(1, count + 1):
+        start = today + timedelta(days=rng.randint(0, 20), hours=rng.randint(0, 23))
+        end = start + timedelta(hours=rng.randint(1, 48))
+        yield json.dumps({'spot_id': spot_id, 'start_date': start.strftime('%Y-%m-%d %H:%M:%S'),
+                          'end_date': end.strftime('%Y-%m-%d %H:%M:%S')}) + '\n'
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def timed_import(router, get_conn, kind, lines, fmt, batch_size):
+    timings = []
+    started = last = time.perf_counter()
+    for report in bulk.import_records(router, get_conn, kind, bulk.read_records(lines, fmt), batch_size):
+        now = time.perf_counter()
+        timings.append(now - last)
+        last = now
+    elapsed = time.perf_counter() - started
+    return dict(summarize(timings), rows=report['rows'], imported=report['imported'],
+                rejected=report['rejected'], rows_per_s=report['rows'] / elapsed, peak_rss_mb=peak_rss_mb())
+
+
+def timed_export(conn, rows):
+    timings = []
+    started = last = time.perf_counter()
+    size = 0
+    for chunk in bulk.export_records([conn], 'spots', 'csv'):
+        size += len(chunk)
+        now = time.perf_counter()
+        timings.append(now - last)
+        last = now
+    elapsed = time.perf_counter() - started
+    return dict(summarize(timings), rows=rows, bytes=size, rows_per_s=rows / elapsed, peak_rss_mb=peak_rss_mb())
+
+
+def run(sizes, batch_size, seed, small_cache=False):
+    results = {}
+    for size in sizes:
+        rng = random.Random(seed)
+        with tempfile.TemporaryDirectory() as tmp:
+            router = ShardRouter([Shard('bench', 0, os.path.join(tmp, 'bulk.db'))])
+            migrate_shards(router)
+            conn = connect(router.shards[0].path)
+            if small_cache:
+                conn.execute('PRAGMA mmap_size = 0')
+                conn.execute('PRAGMA cache_size = -2048')  # 2 MiB
+            get_conn = lambda path: conn
+            try:
+                results[f'import_spots_{size}'] = timed_import(
+                    router, get_conn, 'spots', spot_lines(size, rng), 'csv', batch_size)
+                results[f'import_bookings_{size}'] = timed_import(
+                    router, get_conn, 'bookings', booking_lines(size, rng), 'ndjson', batch_size)
+                results[f'export_spots_{size}'] = timed_export(conn, size)
+            finally:
+                conn.close()
+        for name in (f'import_spots_{size}', f'import_bookings_{size}', f'export_spots_{size}'):
+            print(f"{name:28} {results[name]['rows_per_s']:10.0f} rows/s   "
+                  f"peak RSS {results[name]['peak_rss_mb']:7.1f} MiB", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,100000',
+                        help='comma-separated row counts, run in increasing order (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=bulk.BATCH_SIZE,
+                        help='rows per transaction (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed (default: %(default)s)')
+    parser.add_argument('--small-cache', action='store_true',
+                        help="turn SQLite's memory map off and its page cache down to 2 MiB")
+    parser.add_argument('--output', help='JSON result file (default: stdout)')
+    args = parser.parse_args()
+    quiet_slow_query_log()
+
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+    results = run(sizes, args.batch_size, args.seed, args.small_cache)
+    write_results('bulk_import', {'sizes': sizes, 'batch_size': args.batch_size, 'small_cache': args.small_cache},
+                  results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Helpers shared by the benchmark scripts: timing statistics and the JSON result files.
+
+Every script writes a document of the form
+
+    {"benchmark": "micro", "environment": {...}, "parameters": {...}, "results": {name: stats}}
+
+where stats holds the latencies in milliseconds. benchmarks.compare diffs two such files.
+"""
+import json
+import logging
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+
+def quiet_slow_query_log():
+    """
+    The benchmarks run slow queries on purpose; keep the slow query log out of their output.
+    """
+    logging.getLogger('db').setLevel(logging.ERROR)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def summarize(timings):
+    """
+    Summarize latencies given in seconds.
+    :return: A dictionary of statistics in milliseconds, plus the sample count and the throughput.
+    """
+    timings = sorted(timings)
+    total = sum(timings)
+    return {
+        'samples': len(timings),
+        'min_ms': timings[0] * 1000,
+        'median_ms': percentile(timings, 0.50) * 1000,
+        'p95_ms': percentile(timings, 0.95) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'max_ms': timings[-1] * 1000,
+        'mean_ms': total / len(timings) * 1000,
+        'ops_per_s': len(timings) / total if total else None,
+    }
+
+
+def measure(fn, repeat, warmup=1):
+    """
+    Call fn warmup times untimed, then repeat times timed.
+    :return: The summary of the timed calls and the result of the last call.
+    """
+    result = None
+    for _ in range(warmup):
+        result = fn()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return summarize(timings), result
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+    }
+
+
+def database_stats(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {
+            'spots': conn.execute('SELECT COUNT(*) FROM parking_spots').fetchone()[0],
+            'bookings': conn.execute('SELECT COUNT(*) FROM bookings').fetchone()[0],
+        }
+    finally:
+        conn.close()
+
+
+def write_results(benchmark, parameters, results, output=None):
+    """
+    Write the result document to output, or to stdout when output is None or '-'.
+    """
+    document = {
+        'benchmark': benchmark,
+        'environment': environment(),
+        'parameters': parameters,
+        'results': results,
+    }
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if output in (None, '-'):
+        sys.stdout.write(text + '\n')
+    else:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    return document
@@ -0,0 +1,59 @@
+"""
+Compare two benchmark result files written by benchmarks.micro or benchmarks.load_test.
+
+Prints the median and p95 latency of every benchmark found in both files and the relative
+change. With --fail-above, exits with status 1 when a median got slower by more than that
+percentage, so a run can be used as a gate.
+
+    python -m benchmarks.compare before.json after.json --fail-above 10
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def change(before, after):
+    return (after - before) / before * 100 if before else float('inf')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--fail-above', type=float, metavar='PERCENT',
+                        help='exit with status 1 if a median regressed by more than this')
+    args = parser.parse_args()
+
+    before, after = load(args.before), load(args.after)
+    if before['benchmark'] != after['benchmark']:
+        parser.error(f"cannot compare a {before['benchmark']} run with a {after['benchmark']} run")
+
+    print(f"{before['environment']['git_revision']} -> {after['environment']['git_revision']}")
+    print(f"{'benchmark':24} {'median before':>14} {'after':>10} {'change':>8}   {'p95 before':>11} {'after':>10} {'change':>8}")
+    regressions = []
+    for name, old in before['results'].items():
+        new = after['results'].get(name)
+        if new is None:
+            continue
+        median_change = change(old['median_ms'], new['median_ms'])
+        p95_change = change(old['p95_ms'], new['p95_ms'])
+        print(f"{name:24} {old['median_ms']:11.3f} ms {new['median_ms']:7.3f} ms {median_change:+7.1f}%   "
+              f"{old['p95_ms']:8.3f} ms {new['p95_ms']:7.3f} ms {p95_change:+7.1f}%")
+        if args.fail_above is not None and median_change > args.fail_above:
+            regressions.append(name)
+
+    missing = sorted(set(before['results']) ^ set(after['results']))
+    if missing:
+        print(f"Only in one of the runs: {', '.join(missing)}")
+    if regressions:
+        print(f"Slower by more than {args.fail_above}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""
+Synthetic data generator for benchmarks and load tests.
+
+Spots are spread over several cities, denser towards each city centre, with prices that rise
+towards the centre. Each spot gets a non-overlapping sequence of bookings over a window around
+today. Booking kinds, start hours and durations follow a simple model of real parking demand:
+short errands during the day, weekday commuters, overnight stays and multi-day bookings. Central
+spots are booked more often than outlying ones. --occupancy is the targeted average share of the
+window a spot is booked; waiting for the start hours of a booking kind leaves some extra gaps, so
+the achieved share is somewhat lower and reported at the end.
+
+    python -m benchmarks.generate bench.db --spots 100000 --cities dusseldorf,cologne --occupancy 0.3
+"""
+import argparse
+import calendar
+import math
+import random
+import sqlite3
+import time
+from datetime import datetime
+
+from clusters import sync_clusters
+from init_db import bump_data_version, from_epoch, migrate_db
+
+# name: (centre latitude, centre longitude, radius in km, base price per hour, relative size)
+CITIES = {
+    'dusseldorf': (51.2277, 6.7735, 8, 3.0, 1.0),
+    'cologne': (50.9375, 6.9603, 10, 3.0, 1.6),
+    'berlin': (52.5200, 13.4050, 18, 3.5, 5.0),
+    'munich': (48.1351, 11.5820, 12, 4.5, 2.2),
+    'hamburg': (53.5511, 9.9937, 14, 3.5, 2.6),
+    'frankfurt': (50.1109, 8.6821, 9, 4.0, 1.1),
+}
+
+TYPES = [('Standard', 0.80, 1.0), ('Electric', 0.15, 1.3), ('Handicap', 0.05, 0.8)]
+
+STREETS = ['Hauptstrasse', 'Bahnhofstrasse', 'Marktplatz', 'Schulstrasse', 'Gartenstrasse',
+           'Parkallee', 'Ringstrasse', 'Kirchweg', 'Lindenallee', 'Rheinufer']
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# Booking kinds: (weight, start hours, (shortest, longest) duration in seconds, weekdays only)
+BOOKING_KINDS = [
+    (0.50, range(9, 19), (1 * HOUR, 4 * HOUR), False),   # errands and shopping
+    (0.25, range(6, 10), (8 * HOUR, 10 * HOUR), True),   # commuters
+    (0.15, range(17, 22), (10 * HOUR, 14 * HOUR), False),  # overnight
+    (0.10, range(6, 21), (1 * DAY, 14 * DAY), False),  # trips
+]
+# Durations are drawn as shortest + (longest - shortest) * U², whose mean is a third of the way up
+MEAN_BOOKING_SECONDS = sum(weight * (low + (high - low) / 3) for weight, _, (low, high), _ in BOOKING_KINDS)
+
+
+def city_spots(rng, city, count):
+    """
+    Yield (location, type, price, lat, lng, centrality) for count spots of a city, centrality
+    being 1 at the centre and 0 at the edge.
+    """
+    lat0, lng0, radius_km, base_price, _ = CITIES[city]
+    km_per_lng_degree = 111.32 * math.cos(math.radians(lat0))
+    type_names = [name for name, _, _ in TYPES]
+    type_weights = [weight for _, weight, _ in TYPES]
+    type_factors = {name: factor for name, _, factor in TYPES}
+    for _ in range(count):
+        # Normally distributed around the centre, clipped to the city radius
+        distance = min(abs(rng.gauss(0, radius_km / 2)), radius_km)
+        bearing = rng.uniform(0, 2 * math.pi)
+        lat = lat0 + distance * math.cos(bearing) / 110.57
+        lng = lng0 + distance * math.sin(bearing) / km_per_lng_degree
+        centrality = 1 - distance / radius_km
+        spot_type = rng.choices(type_names, type_weights)[0]
+        price = round(base_price * type_factors[spot_type] * (0.5 + centrality) * rng.uniform(0.8, 1.2), 2)
+        location = f"{rng.choice(STREETS)} {rng.randint(1, 200)}, {city.capitalize()}"
+        yield location, spot_type, max(price, 0.5), lat, lng, centrality
+
+
+def spot_bookings(rng, occupancy, window_start, window_end):
+    """
+    Yield non-overlapping (start_ts, end_ts) bookings of one spot inside the window; end_ts is
+    inclusive, like the bookings made through the app.
+    """
+    occupancy = min(max(occupancy, 0.0), 0.95)
+    if occupancy <= 0:
+        return
+    mean_gap = MEAN_BOOKING_SECONDS * (1 - occupancy) / occupancy
+    weights = [kind[0] for kind in BOOKING_KINDS]
+    t = window_start - int(rng.uniform(0, mean_gap))  # Do not start every spot on a booking boundary
+    while True:
+        t += int(rng.expovariate(1 / mean_gap))
+        _, hours, (shortest, longest), weekdays_only = rng.choices(BOOKING_KINDS, weights)[0]
+        # Move to the kind's next start hour, skipping weekends for commuters
+        day = t - t % DAY
+        start = day + rng.choice(hours) * HOUR + rng.randrange(0, HOUR, 15 * 60)
+        if start < t:
+            start += DAY
+        while weekdays_only and (start // DAY + 3) % 7 >= 5:  # 1970-01-01 was a Thursday
+            start += DAY
+        if start > window_end:
+            return
+        # Durations are skewed towards the short end of each kind's range
+        duration = shortest + int((longest - shortest) * rng.random() ** 2)
+        duration -= duration % (15 * 60)
+        end = start + duration - 1
+        if end >= window_start:
+            yield max(start, window_start), end
+        t = end + 1
+
+
+def generate_database(path, spot_count=10000, cities=('dusseldorf',), occupancy=0.2,
+                      history_days=7, horizon_days=21, seed=None):
+    """
+    Migrate the database at path and add the generated spots and bookings in one transaction.
+    :param occupancy: Average share of the window during which a spot is booked.
+    :param history_days: Days before today covered by bookings.
+    :param horizon_days: Days after today covered by bookings.
+    :return: A dictionary describing what was generated.
+    """
+    rng = random.Random(seed)
+    today = calendar.timegm(datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timetuple())
+    window_start, window_end = today - history_days * DAY, today + horizon_days * DAY - 1
+
+    # Split the spots over the cities by size
+    sizes = [CITIES[city][4] for city in cities]
+    counts = [int(spot_count * size / sum(sizes)) for size in sizes]
+    counts[0] += spot_count - sum(counts)
+
+    migrate_db(path)
+    conn = sqlite3.connect(path, timeout=60)
+    c = conn.cursor()
+    c.execute('PRAGMA synchronous = OFF')
+    c.execute('PRAGMA cache_size = -262144')  # 256 MiB
+    c.execute('PRAGMA temp_store = MEMORY')
+
+    started = time.perf_counter()
+    booking_count = booked_seconds = 0
+    try:
+        c.execute('BEGIN IMMEDIATE')
+        previous_max_id = c.execute('SELECT COALESCE(MAX(id), 0) FROM parking_spots').fetchone()[0]
+        centralities = []
+
+        def spots():
+            for city, count in zip(cities, counts):
+                for location, spot_type, price, lat, lng, centrality in city_spots(rng, city, count):
+                    centralities.append(centrality)
+                    yield location, spot_type, price, lat, lng, city
+
+        c.executemany('INSERT INTO parking_spots (location, type, price, lat, lng, city) VALUES (?, ?, ?, ?, ?, ?)',
+                      spots())
+        spot_ids = [row[0] for row in c.execute(
+            'SELECT id FROM parking_spots WHERE id > ? ORDER BY id', (previous_max_id,))]
+
+        def bookings():
+            nonlocal booking_count, booked_seconds
+            for spot_id, centrality in zip(spot_ids, centralities):
+                # Central spots are in higher demand; the factor averages to about 1
+                for start_ts, end_ts in spot_bookings(rng, occupancy * (0.4 + 1.2 * centrality),
+                                                      window_start, window_end):
+                    booking_count += 1
+                    booked_seconds += min(end_ts, window_end) - start_ts + 1
+                    yield (spot_id, from_epoch(start_ts).strftime('%Y-%m-%d %H:%M:%S'),
+                           from_epoch(end_ts).strftime('%Y-%m-%d %H:%M:%S'), start_ts, end_ts)
+
+        c.executemany('''
+            INSERT INTO bookings (spot_id, start_date, end_date, start_ts, end_ts) VALUES (?, ?, ?, ?, ?)
+        ''', bookings())
+
+        bump_data_version(c)
+        sync_clusters(c)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    return {
+        'spots': len(spot_ids),
+        'bookings': booking_count,
+        'cities': dict(zip(cities, counts)),
+        'occupancy': booked_seconds / (len(spot_ids) * (window_end - window_start + 1)) if spot_ids else 0.0,
+        'seconds': elapsed,
+        'rows_per_s': (len(spot_ids) + booking_count) / elapsed if elapsed else None,
+    }
+
+
+def parse_cities(text):
+    cities = tuple(city.strip().lower() for city in text.split(',') if city.strip())
+    unknown = [city for city in cities if city not in CITIES]
+    if not cities or unknown:
+        raise argparse.ArgumentTypeError(f"choose cities from {', '.join(CITIES)}")
+    return cities
+
+
+def add_arguments(parser):
+    parser.add_argument('--spots', type=int, default=10000, help='number of spots (default: %(default)s)')
+    parser.add_argument('--cities', type=parse_cities, default=('dusseldorf',),
+                        help=f"comma-separated cities out of {', '.join(CITIES)} (default: dusseldorf)")
+    parser.add_argument('--occupancy', type=float, default=0.2,
+                        help='average share of the time a spot is booked (default: %(default)s)')
+    parser.add_argument('--history-days', type=int, default=7, help='days of past bookings (default: %(default)s)')
+    parser.add_argument('--horizon-days', type=int, default=21, help='days of future bookings (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (default: %(default)s)')
+
+
+def generate_from_arguments(path, args):
+    return generate_database(path, args.spots, args.cities, args.occupancy, args.history_days,
+                             args.horizon_days, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('db', help='SQLite database file to create or extend')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    summary = generate_from_arguments(args.db, args)
+    print(f"Generated {summary['spots']} spots and {summary['bookings']} bookings in {summary['seconds']:.1f}s "
+          f"({summary['rows_per_s']:.0f} rows/s), occupancy {summary['occupancy']:.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+"""
+Load test of the Flask routes: /map, /api/filter_parking_spots, /api/clusters, /book/<id> and
+/confirm_booking, in a fixed mix.
+
+By default the requests go through Flask's test client in this process, one client per thread.
+--gunicorn N starts a local gunicorn with N workers on the same database and sends real HTTP
+requests instead; --url targets a server that is already running, in which case --db must name
+the database that server uses. Without --db a database is generated first, see
+benchmarks.generate for the options. Results are written as JSON.
+
+    python -m benchmarks.load_test --spots 50000 --threads 8 --duration 30 --output before.json
+    python -m benchmarks.load_test --spots 50000 --gunicorn 4 --threads 16
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timedelta
+
+from benchmarks.common import database_stats, quiet_slow_query_log, summarize, write_results
+
+# name: share of the requests
+REQUEST_MIX = {
+    'map': 0.10,
+    'filter_viewport': 0.35,
+    'filter_all': 0.05,
+    'clusters': 0.20,
+    'book': 0.20,
+    'confirm_booking': 0.10,
+}
+
+
+class Scenario:
+    """
+    Builds random requests as (name, method, path, body, headers) from the contents of the database.
+    """
+
+    def __init__(self, path, seed):
+        conn = sqlite3.connect(path)
+        try:
+            self.max_id = conn.execute('SELECT MAX(id) FROM parking_spots').fetchone()[0]
+            # A pool of real coordinates to centre the viewports on
+            self.centres = conn.execute(
+                'SELECT lat, lng FROM parking_spots ORDER BY random() LIMIT 200').fetchall()
+        finally:
+            conn.close()
+        self.seed = seed
+
+    def requests(self, worker):
+        rng = random.Random(self.seed * 1000 + worker)
+        names = list(REQUEST_MIX)
+        weights = [REQUEST_MIX[name] for name in names]
+        while True:
+            name = rng.choices(names, weights)[0]
+            yield getattr(self, name)(rng)
+
+    def _window(self, rng, max_days_ahead=3):
+        start = datetime.now() + timedelta(days=rng.randint(0, max_days_ahead))
+        end = start + timedelta(days=rng.randint(0, 2))
+        return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+
+    def _viewport(self, rng, lat_span, lng_span):
+        lat, lng = rng.choice(self.centres)
+        return {'south': lat - lat_span / 2, 'west': lng - lng_span / 2,
+                'north': lat + lat_span / 2, 'east': lng + lng_span / 2}
+
+    def map(self, rng):
+        return 'map', 'GET', '/map', None, {}
+
+    def filter_viewport(self, rng):
+        start_date, end_date = self._window(rng)
+        query = dict(self._viewport(rng, 0.02, 0.03), zoom=15, startDate=start_date, endDate=end_date,
+                     format='columnar', onlyAvailable=rng.choice(['true', 'false']))
+        return ('filter_viewport', 'GET', '/api/filter_parking_spots?' + urllib.parse.urlencode(query), None,
+                {'Accept-Encoding': 'gzip'})
+
+    def filter_all(self, rng):
+        start_date, end_date = self._window(rng)
+        body = json.dumps({'type': 'All', 'price': 'No Max', 'startDate': start_date, 'endDate': end_date})
+        return 'filter_all', 'POST', '/api/filter_parking_spots', body, {'Content-Type': 'application/json'}
+
+    def clusters(self, rng):
+        query = dict(self._viewport(rng, 0.3, 0.45), zoom=rng.choice([10, 11, 12, 13]))
+        return 'clusters', 'GET', '/api/clusters?' + urllib.parse.urlencode(query), None, {}
+
+    def book(self, rng):
+        return 'book', 'GET', f'/book/{rng.randint(1, self.max_id)}', None, {}
+
+    def confirm_booking(self, rng):
+        start_date, end_date = self._window(rng, max_days_ahead=60)
+        body = urllib.parse.urlencode({'spot_id': rng.randint(1, self.max_id), 'start_date': start_date,
+                                       'end_date': end_date})
+        return ('confirm_booking', 'POST', '/confirm_booking', body,
+                {'Content-Type': 'application/x-www-form-urlencoded', 'Accept': 'application/json'})
+
+
+class TestClientTransport:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def send(self, method, path, body, headers):
+        response = self.client.open(path, method=method, data=body, headers=headers)
+        response.get_data()
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class HTTPTransport:
+    def __init__(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.conn = None
+
+    def send(self, method, path, body, headers):
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                response.read()
+                if response.getheader('Connection', '').lower() == 'close':
+                    self.close()
+                return response.status
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed an idle keep-alive connection; retry once on a new one
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def worker(transport, requests, deadline, remaining, samples, lock):
+    local = []
+    try:
+        for name, method, path, body, headers in requests:
+            if time.perf_counter() >= deadline:
+                break
+            with lock:
+                if remaining[0] is not None:
+                    if remaining[0] <= 0:
+                        break
+                    remaining[0] -= 1
+            started = time.perf_counter()
+            try:
+                status = transport.send(method, path, body, headers)
+            except OSError:
+                status = 'error'
+            local.append((name, time.perf_counter() - started, status))
+    finally:
+        transport.close()
+        with lock:
+            samples.extend(local)
+
+
+def run(make_transport, scenario, threads, duration, max_requests):
+    samples, lock = [], threading.Lock()
+    remaining = [max_requests]
+    started = time.perf_counter()
+    deadline = started + duration
+    pool = [
+        threading.Thread(target=worker, args=(make_transport(), scenario.requests(i), deadline, remaining, samples, lock))
+        for i in range(threads)
+    ]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for name in REQUEST_MIX:
+        timings = [elapsed_s for sample_name, elapsed_s, _ in samples if sample_name == name]
+        if not timings:
+            continue
+        statuses = {}
+        for sample_name, _, status in samples:
+            if sample_name == name:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+        results[name] = dict(summarize(timings), statuses=statuses)
+
+    # 409 is the expected answer to a booking of a taken spot, 304 to a revalidated filter
+    errors = sum(1 for _, _, status in samples if status == 'error' or status >= 500)
+    results['total'] = dict(summarize([elapsed_s for _, elapsed_s, _ in samples]),
+                            requests_per_s=len(samples) / elapsed, errors=errors, seconds=elapsed)
+    return results
+
+
+def start_gunicorn(path, workers, port):
+    env = dict(os.environ, CARSPOT_DATABASE=path, CARSPOT_LOG_LEVEL='WARNING')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', '4',
+         '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app'],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=env
+    )
+    # Wait until a worker answers
+    for _ in range(300):
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            conn.close()
+            return server
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError('gunicorn exited during startup')
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+
+def main():
+    # The app reads CARSPOT_DATABASE when init_db is first imported, so settle the path before that.
+    # This parser has no --help, which must wait until all options are known.
+    db_parser = argparse.ArgumentParser(add_help=False)
+    db_parser.add_argument('--db', help='use an existing database instead of generating one')
+    tmp = tempfile.TemporaryDirectory()
+    path = os.path.abspath(db_parser.parse_known_args()[0].db or os.path.join(tmp.name, 'load.db'))
+    os.environ['CARSPOT_DATABASE'] = path
+    from benchmarks.generate import add_arguments, generate_from_arguments
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     parents=[db_parser])
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--gunicorn', type=int, metavar='WORKERS', help='start a local gunicorn with this many workers')
+    target.add_argument('--url', help='send HTTP requests to a running server, e.g. http://127.0.0.1:8000')
+    parser.add_argument('--port', type=int, default=8765, help='port of the local gunicorn (default: %(default)s)')
+    parser.add_argument('--threads', type=int, default=4, help='concurrent clients (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to run (default: %(default)s)')
+    parser.add_argument('--requests', type=int, help='stop after this many requests')
+    parser.add_argument('--output', help='JSON result file (default: stdout)')
+    add_arguments(parser)
+    args = parser.parse_args()
+    if args.url and not args.db:
+        parser.error('--url needs --db, the database the server uses')
+
+    with tmp:
+        parameters = {'threads': args.threads, 'duration': args.duration, 'requests': args.requests,
+                      'mix': REQUEST_MIX}
+        if args.db is None:
+            parameters['generated'] = generate_from_arguments(path, args)
+        parameters['database'] = database_stats(path)
+        scenario = Scenario(path, args.seed)
+
+        server = None
+        try:
+            if args.gunicorn or args.url:
+                url = args.url or f'http://127.0.0.1:{args.port}'
+                if args.gunicorn:
+                    server = start_gunicorn(path, args.gunicorn, args.port)
+                parameters['target'] = url if args.url else f'gunicorn, {args.gunicorn} workers'
+                make_transport = lambda: HTTPTransport(url)
+            else:
+                quiet_slow_query_log()
+                from app import app
+                parameters['target'] = 'flask test client'
+                make_transport = lambda: TestClientTransport(app)
+            results = run(make_transport, scenario, args.threads, args.duration, args.requests)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+        for name, stats in results.items():
+            print(f"{name:16} {stats['samples']:7d} requests   median {stats['median_ms']:8.2f} ms   "
+                  f"p95 {stats['p95_ms']:8.2f} ms", file=sys.stderr)
+        print(f"{results['total']['requests_per_s']:.0f} requests/s, {results['total']['errors']} errors",
+              file=sys.stderr)
+        write_results('load_test', parameters, results, args.output)
+
+
+if __name__ == '__main__':
+    main()
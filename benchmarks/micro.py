@@ -0,0 +1,127 @@
+"""
+Micro-benchmarks of the hot read paths, run directly against a database.
+
+Covers get_filtered_parking_spots (whole map, only available spots, type and price filters,
+viewports), the in-memory availability index answering the same viewports, the map clusters,
+the nearest available spots, the free-interval timelines of one and of 200 spots, and the
+min/max price queries. Without --db a database is generated first, see benchmarks.generate for
+the options. Results are written as JSON.
+
+    python -m benchmarks.micro --spots 100000 --output before.json
+    python -m benchmarks.micro --db parking.db --repeat 50
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+from datetime import datetime
+
+import availability
+from benchmarks.common import database_stats, measure, quiet_slow_query_log, write_results
+from benchmarks.generate import add_arguments, generate_from_arguments
+from clusters import get_clusters
+from db import connect
+from init_db import get_filtered_parking_spots, get_maximum_price, get_minimum_price, to_epoch
+from nearby import nearest_available_spots
+from timeline import DAY, HORIZON_DAYS, free_intervals
+
+# Roughly the area a phone shows at zoom 15
+VIEWPORT_LAT_SPAN = 0.02
+VIEWPORT_LNG_SPAN = 0.03
+
+
+def sample_viewports(conn, count, rng):
+    """
+    Viewports centred on random spots, so they land where the spots are.
+    """
+    max_id = conn.execute('SELECT MAX(id) FROM parking_spots').fetchone()[0]
+    viewports = []
+    while len(viewports) < count:
+        row = conn.execute('SELECT lat, lng FROM parking_spots WHERE id >= ? LIMIT 1',
+                           (rng.randint(1, max_id),)).fetchone()
+        lat, lng = row[0], row[1]
+        viewports.append((lat - VIEWPORT_LAT_SPAN / 2, lng - VIEWPORT_LNG_SPAN / 2,
+                          lat + VIEWPORT_LAT_SPAN / 2, lng + VIEWPORT_LNG_SPAN / 2))
+    return viewports
+
+
+def viewport_centre(viewport):
+    south, west, north, east = viewport
+    return (south + north) / 2, (west + east) / 2
+
+
+def run(path, repeat, seed):
+    rng = random.Random(seed)
+    conn = connect(path)
+    today = datetime.now().strftime('%Y-%m-%d')
+    start_date, end_date = f"{today} 00:00:00", f"{today} 23:59:59"
+    median_price = statistics.median(row[0] for row in conn.execute('SELECT price FROM parking_spots'))
+
+    viewports = itertools.cycle(sample_viewports(conn, 50, rng))
+    max_id = conn.execute('SELECT MAX(id) FROM parking_spots').fetchone()[0]
+    spot_ids = itertools.cycle([rng.randint(1, max_id) for _ in range(1000)])
+    # A zoomed-in map shows a few hundred spots at most
+    spot_batches = itertools.cycle([[rng.randint(1, max_id) for _ in range(200)] for _ in range(20)])
+    horizon = (to_epoch(today), to_epoch(today) + HORIZON_DAYS * DAY - 1)
+
+    benchmarks = {
+        'filter_all': lambda: get_filtered_parking_spots(conn, 'All', 'No Max', start_date, end_date),
+        'filter_only_available': lambda: get_filtered_parking_spots(
+            conn, 'All', 'No Max', start_date, end_date, only_available=True),
+        'filter_type_price': lambda: get_filtered_parking_spots(
+            conn, 'Electric', median_price, start_date, end_date),
+        'filter_viewport': lambda: get_filtered_parking_spots(
+            conn, 'All', 'No Max', start_date, end_date, bounds=next(viewports)),
+        'clusters_zoom_12': lambda: get_clusters(conn, 12, next(viewports), today),
+        'nearest_available': lambda: nearest_available_spots(
+            conn, *viewport_centre(next(viewports)), start_date, end_date, 10),
+        'timeline_one_spot': lambda: free_intervals(conn, [next(spot_ids)], *horizon),
+        'timeline_200_spots': lambda: free_intervals(conn, next(spot_batches), *horizon),
+        'min_price': lambda: get_minimum_price(conn),
+        'max_price': lambda: get_maximum_price(conn),
+    }
+    if availability.ENABLED:
+        availability.get_index(conn)  # Build it outside the timings
+        benchmarks['index_filter_all'] = lambda: availability.filter_spots(
+            conn, 'All', 'No Max', start_date, end_date)
+        benchmarks['index_filter_viewport'] = lambda: availability.filter_spots(
+            conn, 'All', 'No Max', start_date, end_date, bounds=next(viewports))
+
+    results = {}
+    for name, fn in benchmarks.items():
+        # The whole-map queries are slow on big databases; fewer rounds still give stable numbers
+        rounds = max(3, repeat // 10) if name in ('filter_all', 'filter_only_available', 'filter_type_price') else repeat
+        stats, result = measure(fn, rounds)
+        if isinstance(result, list):
+            stats['rows'] = len(result)
+        results[name] = stats
+        print(f"{name:24} median {stats['median_ms']:9.3f} ms   p95 {stats['p95_ms']:9.3f} ms", file=sys.stderr)
+    conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', help='benchmark an existing database instead of generating one')
+    parser.add_argument('--repeat', type=int, default=100, help='timed calls per benchmark (default: %(default)s)')
+    parser.add_argument('--output', help='JSON result file (default: stdout)')
+    add_arguments(parser)
+    args = parser.parse_args()
+    quiet_slow_query_log()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        parameters = {'repeat': args.repeat}
+        path = args.db
+        if path is None:
+            path = os.path.join(tmp, 'micro.db')
+            parameters['generated'] = generate_from_arguments(path, args)
+        parameters['database'] = database_stats(path)
+        results = run(path, args.repeat, args.seed)
+        write_results('micro', parameters, results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Concurrency stress test of the booking write path.
+
+Several processes, each running several threads, keep booking random overlapping windows on a
+small set of spots through create_booking. Afterwards the bookings table must not contain two
+overlapping bookings of the same spot, and replayed idempotency keys must not have created
+duplicates. Exits with status 1 if either check fails.
+
+    python -m benchmarks.stress_booking --processes 4 --threads 8 --attempts 200
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from bookings import BookingConflict, create_booking
+from db import connect
+from init_db import migrate_db, seed_db
+
+
+def worker_thread(path, spot_ids, attempts, seed, counts, lock):
+    rng = random.Random(seed)
+    conn = connect(path)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    local = {'created': 0, 'replayed': 0, 'conflicts': 0, 'locked': 0}
+    try:
+        for attempt in range(attempts):
+            spot_id = rng.choice(spot_ids)
+            start = today + timedelta(hours=rng.randint(0, 24 * 30))
+            end = start + timedelta(hours=rng.randint(1, 12))
+            key = f"{seed}-{attempt}"
+            # Every few attempts send the same request twice, like a client retrying after a timeout
+            for _ in range(2 if attempt % 5 == 0 else 1):
+                try:
+                    _, created = create_booking(
+                        conn, spot_id, start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S'), key
+                    )
+                    local['created' if created else 'replayed'] += 1
+                except BookingConflict:
+                    local['conflicts'] += 1
+                except sqlite3.OperationalError:
+                    local['locked'] += 1
+    finally:
+        conn.close()
+    with lock:
+        for name, value in local.items():
+            counts[name] = counts.get(name, 0) + value
+
+
+def worker_process(path, spot_ids, threads, attempts, seed):
+    counts, lock = {}, threading.Lock()
+    pool = [
+        threading.Thread(target=worker_thread, args=(path, spot_ids, attempts, seed * 1000 + i, counts, lock))
+        for i in range(threads)
+    ]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return counts
+
+
+def count_double_bookings(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('''
+            SELECT COUNT(*)
+            FROM bookings a JOIN bookings b
+              ON a.spot_id = b.spot_id AND a.id < b.id
+             AND a.end_ts >= b.start_ts AND a.start_ts <= b.end_ts
+        ''').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--attempts', type=int, default=200, help='booking attempts per thread')
+    parser.add_argument('--spots', type=int, default=50, help='number of contended spots')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'stress.db')
+        migrate_db(path)
+        seed_db(path, spot_count=args.spots, booked_ratio=0, seed=1)
+        spot_ids = list(range(1, args.spots + 1))
+
+        started = time.perf_counter()
+        with multiprocessing.Pool(args.processes) as pool:
+            results = pool.starmap(worker_process, [
+                (path, spot_ids, args.threads, args.attempts, seed) for seed in range(1, args.processes + 1)
+            ])
+        elapsed = time.perf_counter() - started
+
+        totals = {}
+        for counts in results:
+            for name, value in counts.items():
+                totals[name] = totals.get(name, 0) + value
+
+        double_bookings = count_double_bookings(path)
+        conn = sqlite3.connect(path)
+        stored = conn.execute('SELECT COUNT(*) FROM bookings').fetchone()[0]
+        conn.close()
+
+        requests = sum(totals.values())
+        print(f"{args.processes} processes x {args.threads} threads, {requests} requests in {elapsed:.2f}s")
+        print(f"created={totals.get('created', 0)} replayed={totals.get('replayed', 0)} "
+              f"conflicts={totals.get('conflicts', 0)} lock_timeouts={totals.get('locked', 0)}")
+        print(f"{requests / elapsed:.0f} requests/s, {totals.get('created', 0) / elapsed:.0f} bookings/s")
+        print(f"double bookings: {double_bookings}, stored bookings: {stored}")
+
+        if double_bookings or stored != totals.get('created', 0):
+            print("FAILED: the write path let overlapping or duplicate bookings through")
+            sys.exit(1)
+        print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+from clusters import sync_clusters
+from init_db import get_data_version, to_epoch
+
+
+class BookingConflict(Exception):
+    """
+    Raised when the requested window overlaps an existing booking of the spot.
+    """
+
+
+def booking_window(start_date, end_date):
+    """
+    Expand the dates of the booking form to full days: a booking made for 'YYYY-MM-DD' to
+    'YYYY-MM-DD' holds the spot from the start of the first day to the end of the last one.
+    :return: A (start_date, end_date) tuple of 'YYYY-MM-DD HH:MM:SS' strings.
+    """
+    if len(start_date) == 10:
+        start_date = f"{start_date} 00:00:00"
+    if len(end_date) == 10:
+        end_date = f"{end_date} 23:59:59"
+    return start_date, end_date
+
+
+def find_conflict(conn, spot_id, start_ts, end_ts):
+    """
+    Look for a booking of the spot overlapping an epoch window. Run it in the writing
+    transaction, so that the answer still holds when the booking is inserted.
+    :return: The (start_date, end_date) of an overlapping booking, or None if the spot is free.
+    :raises LookupError: If the spot does not exist.
+    """
+    if conn.execute('SELECT 1 FROM parking_spots WHERE id = ?', (spot_id,)).fetchone() is None:
+        raise LookupError(f"Parking spot {spot_id} does not exist")
+    return conn.execute(
+        '-- name: booking_conflict\n'
+        'SELECT start_date, end_date FROM bookings WHERE spot_id = ? AND end_ts >= ? AND start_ts <= ? LIMIT 1',
+        (spot_id, start_ts, end_ts)
+    ).fetchone()
+
+
+def create_booking(conn, spot_id, start_date, end_date, idempotency_key=None):
+    """
+    Book a spot for a window, atomically.
+    The overlap check and the insert run in one BEGIN IMMEDIATE transaction, which takes the
+    database write lock up front, so two requests racing for the same spot cannot both pass the check.
+    :param idempotency_key: Optional client-chosen key. Repeating a request with the same key
+                            returns the booking created by the first one.
+    :return: A (booking, created) tuple; booking is a dictionary, created is False for a replayed request.
+             A new booking also carries the data version its insert produced.
+    :raises BookingConflict: If the window overlaps an existing booking of the spot.
+    :raises LookupError: If the spot does not exist.
+    :raises ValueError: If the window is invalid or the key was used for a different booking.
+    """
+    start_date, end_date = booking_window(start_date, end_date)
+    try:
+        start_ts, end_ts = to_epoch(start_date), to_epoch(end_date)
+    except ValueError:
+        raise ValueError("The dates must be 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS' dates")
+    if end_ts < start_ts:
+        raise ValueError("The end date must not be before the start date")
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if idempotency_key:
+            existing = conn.execute(
+                'SELECT id, spot_id, start_date, end_date FROM bookings WHERE idempotency_key = ?',
+                (idempotency_key,)
+            ).fetchone()
+            if existing:
+                conn.rollback()
+                booking = dict(zip(('id', 'spot_id', 'start_date', 'end_date'), existing))
+                if (booking['spot_id'], booking['start_date'], booking['end_date']) != (spot_id, start_date, end_date):
+                    raise ValueError("The idempotency key was already used for a different booking")
+                return booking, False
+
+        conflict = find_conflict(conn, spot_id, start_ts, end_ts)
+        if conflict:
+            raise BookingConflict(
+                f"Spot {spot_id} is already booked from {conflict[0]} to {conflict[1]}"
+            )
+
+        cursor = conn.execute('''
+            INSERT INTO bookings (spot_id, start_date, end_date, start_ts, end_ts, idempotency_key)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (spot_id, start_date, end_date, start_ts, end_ts, idempotency_key or None))
+        booking = {
+            'id': cursor.lastrowid, 'spot_id': spot_id, 'start_date': start_date, 'end_date': end_date,
+            'start_ts': start_ts, 'end_ts': end_ts
+        }
+
+        sync_clusters(conn)
+        # The insert bumped the data version through its trigger
+        booking['data_version'] = get_data_version(conn)
+        conn.commit()
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+
+    return booking, True
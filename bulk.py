@@ -0,0 +1,404 @@
+"""
+Streaming bulk import and export of parking spots and bookings, as NDJSON or CSV.
+
+Imports parse their input line by line, validate each row and insert the valid ones in batched
+transactions, one batch per shard at a time, so memory stays flat however long the input is.
+Rejected rows are reported with their line number and do not stop the import. Exports page
+through the tables by id and yield the output a page at a time.
+
+    python bulk.py import spots garages.csv
+    python bulk.py import bookings partner.ndjson --errors rejected.ndjson
+    python bulk.py export spots --city cologne --output cologne.csv
+
+Spots take location, type, price, lat, lng and optionally city and id; without an id the shard
+assigns one. Bookings take spot_id, start_date and end_date, dates without a time covering whole
+days as in the booking form, and optionally an idempotency_key: a row whose key is already
+booked is skipped, so an import can be repeated safely.
+"""
+import argparse
+import codecs
+import csv
+import io
+import json
+import logging
+import math
+import sys
+import time
+
+from bookings import booking_window, find_conflict
+from clusters import sync_clusters
+from init_db import DATABASE, migrate_shards, to_epoch
+
+# Rows per transaction; big enough to amortize the commit, small enough to hold the write lock briefly
+BATCH_SIZE = 5000
+# Rows per page of an export
+EXPORT_PAGE_SIZE = 10000
+# Rejected rows kept for the report; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+FORMATS = ('ndjson', 'csv')
+MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+COLUMNS = {
+    'spots': ('id', 'location', 'type', 'price', 'lat', 'lng', 'city'),
+    'bookings': ('id', 'spot_id', 'start_date', 'end_date', 'idempotency_key'),
+}
+
+
+class ImportReport:
+    """
+    Running counts of an import, reported after every batch and at the end.
+    """
+
+    def __init__(self, kind, on_reject=None):
+        self.kind = kind
+        self.on_reject = on_reject
+        self.rows = 0
+        self.imported = 0
+        self.skipped = 0
+        self.rejected = 0
+        self.errors = []
+        self.started = time.perf_counter()
+
+    def reject(self, line, message):
+        self.rejected += 1
+        if self.on_reject is not None:
+            self.on_reject(line, message)
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def as_dict(self, done=False):
+        seconds = time.perf_counter() - self.started
+        return {
+            'kind': self.kind, 'done': done, 'rows': self.rows, 'imported': self.imported,
+            'skipped': self.skipped, 'rejected': self.rejected, 'errors': self.errors,
+            'seconds': round(seconds, 3), 'rows_per_s': round(self.rows / seconds) if seconds else None,
+        }
+
+
+def text_lines(stream):
+    """
+    Decode a binary stream, e.g. a request body, into lines as it is read.
+    """
+    return codecs.getreader('utf-8-sig')(stream)
+
+
+def read_records(lines, fmt):
+    """
+    Parse NDJSON or CSV incrementally.
+    :return: A generator of (line number, record) pairs; record is a dictionary, or a ValueError
+             for a line that could not be parsed.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        try:
+            for record in reader:
+                if None in record:
+                    yield reader.line_num, ValueError("more fields than the header names")
+                else:
+                    yield reader.line_num, record
+        except csv.Error as e:
+            yield reader.line_num, ValueError(str(e))
+        return
+
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, ValueError(f"invalid JSON: {e}")
+            continue
+        yield line_number, record if isinstance(record, dict) else ValueError("expected a JSON object")
+
+
+def _field(record, key, convert=str, required=True):
+    value = record.get(key)
+    if value is None or value == '':
+        if required:
+            raise ValueError(f"{key} is required")
+        return None
+    try:
+        return convert(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{key} has an invalid value: {value!r}")
+
+
+def _integer(value):
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(value)
+    return int(value)
+
+
+def _number(value):
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(value)
+    return number
+
+
+def parse_spot(record):
+    """
+    :return: An (id, location, type, price, lat, lng, city) tuple, id being None when the
+             shard assigns it.
+    :raises ValueError: If the row is invalid.
+    """
+    spot_id = _field(record, 'id', _integer, required=False)
+    location = _field(record, 'location')
+    spot_type = _field(record, 'type')
+    price = _field(record, 'price', _number)
+    lat = _field(record, 'lat', _number)
+    lng = _field(record, 'lng', _number)
+    city = _field(record, 'city', required=False)
+    if price < 0:
+        raise ValueError("price must not be negative")
+    if not -90 <= lat <= 90 or not -180 <= lng <= 180:
+        raise ValueError("lat or lng out of range")
+    return spot_id, location, spot_type, price, lat, lng, city.lower() if city else None
+
+
+def parse_booking(record):
+    """
+    :return: A (spot_id, start_date, end_date, start_ts, end_ts, idempotency_key) tuple.
+    :raises ValueError: If the row is invalid.
+    """
+    spot_id = _field(record, 'spot_id', _integer)
+    start_date, end_date = booking_window(_field(record, 'start_date'), _field(record, 'end_date'))
+    try:
+        start_ts, end_ts = to_epoch(start_date), to_epoch(end_date)
+    except ValueError:
+        raise ValueError("start_date and end_date must be dates")
+    if end_ts < start_ts:
+        raise ValueError("end_date must not be before start_date")
+    return spot_id, start_date, end_date, start_ts, end_ts, _field(record, 'idempotency_key', required=False)
+
+
+def _write_spots(conn, batch, report):
+    """
+    Insert a batch of (line, spot) pairs into one shard, in one transaction.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        spots, taken = [], set()
+        for line, spot in batch:
+            spot_id = spot[0]
+            if spot_id is not None and (spot_id in taken or conn.execute(
+                    'SELECT 1 FROM parking_spots WHERE id = ?', (spot_id,)).fetchone() is not None):
+                report.reject(line, f"spot {spot_id} already exists")
+                continue
+            taken.add(spot_id)
+            spots.append(spot)
+
+        conn.executemany('''-- name: import_spots
+            INSERT INTO parking_spots (id, location, type, price, lat, lng, city) VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', spots)
+        sync_clusters(conn)
+        conn.commit()
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    report.imported += len(spots)
+
+
+def _write_bookings(conn, batch, report):
+    """
+    Insert a batch of (line, booking) pairs into one shard, in one transaction. Each row is
+    checked against the bookings already stored, those of this batch included.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        inserted = []
+        for line, (spot_id, start_date, end_date, start_ts, end_ts, idempotency_key) in batch:
+            if idempotency_key and conn.execute(
+                    'SELECT 1 FROM bookings WHERE idempotency_key = ?', (idempotency_key,)).fetchone() is not None:
+                report.skipped += 1
+                continue
+            try:
+                conflict = find_conflict(conn, spot_id, start_ts, end_ts)
+            except LookupError:
+                report.reject(line, f"spot {spot_id} does not exist")
+                continue
+            if conflict:
+                report.reject(line, f"spot {spot_id} is already booked from {conflict[0]} to {conflict[1]}")
+                continue
+            conn.execute('''-- name: import_booking
+                INSERT INTO bookings (spot_id, start_date, end_date, start_ts, end_ts, idempotency_key)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (spot_id, start_date, end_date, start_ts, end_ts, idempotency_key))
+            inserted.append((spot_id, start_date, end_date))
+
+        sync_clusters(conn)
+        conn.commit()
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    report.imported += len(inserted)
+
+
+def import_records(router, get_conn, kind, records, batch_size=BATCH_SIZE, on_reject=None):
+    """
+    Validate and insert records into the shards that store them.
+    :param get_conn: Returns the connection to a shard database, given its path.
+    :param records: Iterable of (line number, record) pairs, see read_records.
+    :param on_reject: Called with the line number and the message of every rejected row.
+    :return: A generator yielding the report as a dictionary after each batch, the last one
+             with done set.
+    """
+    parse, write = (parse_spot, _write_spots) if kind == 'spots' else (parse_booking, _write_bookings)
+    report = ImportReport(kind, on_reject)
+    pending = {}
+
+    for line, record in records:
+        report.rows += 1
+        try:
+            if isinstance(record, ValueError):
+                raise record
+            row = parse(record)
+            if kind == 'spots':
+                shard = router.for_point(row[4], row[5], row[6])
+                if row[0] is not None and router.for_spot(row[0]) is not shard:
+                    raise ValueError(f"id {row[0]} is outside the id range of shard {shard.name}")
+            else:
+                shard = router.for_spot(row[0])
+        except (LookupError, ValueError) as e:
+            report.reject(line, str(e))
+            continue
+
+        batch = pending.setdefault(shard, [])
+        batch.append((line, row))
+        if len(batch) >= batch_size:
+            write(get_conn(shard.path), pending.pop(shard), report)
+            yield report.as_dict()
+
+    for shard, batch in pending.items():
+        write(get_conn(shard.path), batch, report)
+    yield report.as_dict(done=True)
+
+
+def _pages(conn, kind, city, page_size):
+    """
+    Yield the rows of one shard a page at a time, walking the ids so each page is an index seek.
+    """
+    if kind == 'spots':
+        query = 'SELECT id, location, type, price, lat, lng, city FROM parking_spots ps WHERE ps.id > ?'
+    else:
+        query = '''SELECT b.id, b.spot_id, b.start_date, b.end_date, b.idempotency_key
+            FROM bookings b JOIN parking_spots ps ON ps.id = b.spot_id WHERE b.id > ?'''
+    params = []
+    if city:
+        query += ' AND ps.city = ?'
+        params.append(city.lower())
+    query = f'-- name: export_{kind}\n{query} ORDER BY 1 LIMIT ?'
+
+    last_id = 0
+    while True:
+        rows = conn.execute(query, [last_id] + params + [page_size]).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def export_records(conns, kind, fmt, city=None, page_size=EXPORT_PAGE_SIZE):
+    """
+    Export spots or bookings of the given shard connections.
+    :return: A generator of text chunks, one per page, starting with the header for CSV.
+    """
+    columns = COLUMNS[kind]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if fmt == 'csv':
+        writer.writerow(columns)
+        yield buffer.getvalue()
+
+    for conn in conns:
+        for rows in _pages(conn, kind, city, page_size):
+            if fmt == 'csv':
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows(rows)
+                yield buffer.getvalue()
+            else:
+                yield ''.join(json.dumps(dict(zip(columns, row)), separators=(',', ':')) + '\n' for row in rows)
+
+
+def format_for(path, fmt=None):
+    if fmt:
+        return fmt
+    return 'csv' if path and path.lower().endswith('.csv') else 'ndjson'
+
+
+def main(argv=None):
+    from db import connect
+    from shards import load_router
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=DATABASE, help='SQLite database file without CARSPOT_SHARDS (default: %(default)s)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import', help='import spots or bookings')
+    import_parser.add_argument('kind', choices=COLUMNS)
+    import_parser.add_argument('input', help="file to read, '-' for stdin")
+    import_parser.add_argument('--format', choices=FORMATS, help='default: csv for .csv files, else ndjson')
+    import_parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='rows per transaction (default: %(default)s)')
+    import_parser.add_argument('--errors', help='write every rejected row to this NDJSON file')
+    export_parser = subparsers.add_parser('export', help='export spots or bookings')
+    export_parser.add_argument('kind', choices=COLUMNS)
+    export_parser.add_argument('--format', choices=FORMATS, help='default: csv for a .csv output, else ndjson')
+    export_parser.add_argument('--city', help='only this city')
+    export_parser.add_argument('--output', help='file to write (default: stdout)')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    # Batches of thousands of rows are slow queries by design
+    logging.getLogger('db').setLevel(logging.ERROR)
+
+    router = load_router(args.db)
+    migrate_shards(router)
+    conns = {}
+
+    def get_conn(path):
+        if path not in conns:
+            conns[path] = connect(path)
+        return conns[path]
+
+    if args.command == 'export':
+        fmt = format_for(args.output, args.format)
+        output = open(args.output, 'w', newline='') if args.output else sys.stdout
+        try:
+            shards = router.for_region(city=args.city)
+            for chunk in export_records([get_conn(shard.path) for shard in shards], args.kind, fmt, args.city):
+                output.write(chunk)
+        finally:
+            if args.output:
+                output.close()
+        return
+
+    fmt = format_for(args.input, args.format)
+    source = sys.stdin if args.input == '-' else open(args.input, newline='', encoding='utf-8-sig')
+    errors = open(args.errors, 'w') if args.errors else None
+
+    def write_error(line, message):
+        errors.write(json.dumps({'line': line, 'error': message}) + '\n')
+
+    try:
+        records = read_records(source, fmt)
+        for report in import_records(router, get_conn, args.kind, records, args.batch_size,
+                                     write_error if errors is not None else None):
+            print(f"{report['rows']} rows, {report['imported']} imported, {report['skipped']} skipped, "
+                  f"{report['rejected']} rejected, {report['rows_per_s'] or 0} rows/s", file=sys.stderr)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if errors is not None:
+            errors.close()
+
+    for error in report['errors'][:20]:
+        print(f"line {error['line']}: {error['error']}", file=sys.stderr)
+    if report['rejected'] > 20:
+        print(f"... and {report['rejected'] - 20} more rejected rows", file=sys.stderr)
+    sys.exit(1 if report['rejected'] else 0)
+
+
+if __name__ == '__main__':
+    main()
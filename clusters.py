@@ -0,0 +1,486 @@
+import math
+import calendar
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, tiles are then computed one by one
+    np = None
+
+# Above this zoom level the map shows individual spots instead of clusters
+CLUSTER_MAX_ZOOM = 14
+
+# Web Mercator cannot represent the poles; clamp like the map tiles do
+MAX_LATITUDE = 85.05112878
+
+
+def tile_for(lat, lng, zoom):
+    """
+    Return the (x, y) Web Mercator map tile containing a point at the given zoom level.
+    """
+    n = 2 ** zoom
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tiles_for(lats, lngs, zoom):
+    """
+    Return the x and y tiles of many points at once, as two lists. The aggregates are written
+    through this function only, so they agree on points lying on a tile border even where NumPy
+    rounds differently from tile_for.
+    """
+    if np is None:
+        tiles = [tile_for(lat, lng, zoom) for lat, lng in zip(lats, lngs)]
+        return [tile[0] for tile in tiles], [tile[1] for tile in tiles]
+    n = 2 ** zoom
+    lats = np.clip(np.asarray(lats, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE)
+    x = ((np.asarray(lngs, dtype=np.float64) + 180.0) / 360.0 * n).astype(np.int64)
+    y = ((1.0 - np.arcsinh(np.tan(np.radians(lats))) / math.pi) / 2.0 * n).astype(np.int64)
+    return np.clip(x, 0, n - 1).tolist(), np.clip(y, 0, n - 1).tolist()
+
+
+def tile_bounds(x, y, zoom):
+    """
+    Return the (south, west, north, east) bounds of a map tile.
+    """
+    n = 2 ** zoom
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return south, west, north, east
+
+
+def tile_range(bounds, zoom):
+    """
+    Return the (min_x, max_x, min_y, max_y) tiles covering a (south, west, north, east) viewport.
+    """
+    south, west, north, east = bounds
+    min_x, min_y = tile_for(north, west, zoom)
+    max_x, max_y = tile_for(south, east, zoom)
+    return min_x, max_x, min_y, max_y
+
+
+def booking_days(start_date, end_date):
+    """
+    Return the 'YYYY-MM-DD' days a booking overlaps, both ends included.
+    """
+    day = date.fromisoformat(start_date[:10])
+    last_day = date.fromisoformat(end_date[:10])
+    days = []
+    while day <= last_day:
+        days.append(day.isoformat())
+        day += timedelta(days=1)
+    return days
+
+
+def day_window(day):
+    """
+    Return the (start, end) epoch seconds of a 'YYYY-MM-DD' day, encoded like bookings.start_ts/end_ts.
+    """
+    start = calendar.timegm(date.fromisoformat(day).timetuple())
+    return start, start + 86399
+
+
+def create_cluster_tables(c):
+    # Static aggregates of the spots in each map tile, one row per zoom level, tile and spot type.
+    # Coordinates are kept as sums so the centroid can be updated by addition.
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS spot_clusters (
+        zoom INTEGER,
+        tile_x INTEGER,
+        tile_y INTEGER,
+        type TEXT,
+        spot_count INTEGER,
+        lat_sum REAL,
+        lng_sum REAL,
+        min_price REAL,
+        PRIMARY KEY (zoom, tile_x, tile_y, type)
+    ) WITHOUT ROWID
+    ''')
+
+    # Number of distinct spots in each map tile that are booked at some point of a given day
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS spot_cluster_bookings (
+        zoom INTEGER,
+        day TEXT,
+        tile_x INTEGER,
+        tile_y INTEGER,
+        booked_count INTEGER,
+        PRIMARY KEY (zoom, day, tile_x, tile_y)
+    ) WITHOUT ROWID
+    ''')
+
+
+def _roll_up(aggregates, merge):
+    """
+    Derive the aggregates of every lower zoom level from those at CLUSTER_MAX_ZOOM.
+    Map tiles nest: the parent of tile (x, y) is (x // 2, y // 2) one zoom level up, so each level
+    is built from the one below it instead of recomputing a tile for every spot and zoom.
+    :param aggregates: Values keyed by (CLUSTER_MAX_ZOOM, tile_x, tile_y, key).
+    :param merge: Function combining two values of the same parent tile.
+    """
+    result = dict(aggregates)
+    level = aggregates
+    for zoom in range(CLUSTER_MAX_ZOOM - 1, -1, -1):
+        parent_level = {}
+        for (_, tile_x, tile_y, key), value in level.items():
+            parent_key = (zoom, tile_x >> 1, tile_y >> 1, key)
+            parent_level[parent_key] = merge(parent_level[parent_key], value) if parent_key in parent_level else value
+        result.update(parent_level)
+        level = parent_level
+    return result
+
+
+def _merge_spot_aggregates(a, b):
+    prices = [price for price in (a[3], b[3]) if price is not None]
+    return a[0] + b[0], a[1] + b[1], a[2] + b[2], min(prices, default=None)
+
+
+def _write_spot_aggregates(c, aggregates):
+    c.executemany('''
+    INSERT INTO spot_clusters (zoom, tile_x, tile_y, type, spot_count, lat_sum, lng_sum, min_price)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (zoom, tile_x, tile_y, type) DO UPDATE SET
+        spot_count = spot_count + excluded.spot_count,
+        lat_sum = lat_sum + excluded.lat_sum,
+        lng_sum = lng_sum + excluded.lng_sum,
+        min_price = MIN(min_price, excluded.min_price)
+    ''', [key + tuple(values) for key, values in _roll_up(aggregates, _merge_spot_aggregates).items()])
+
+
+def _write_booked_counts(c, booked_counts):
+    c.executemany('''
+    INSERT INTO spot_cluster_bookings (zoom, day, tile_x, tile_y, booked_count)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (zoom, day, tile_x, tile_y) DO UPDATE SET
+        booked_count = booked_count + excluded.booked_count
+    ''', [(zoom, day, tile_x, tile_y, count)
+          for (zoom, tile_x, tile_y, day), count in _roll_up(booked_counts, lambda a, b: a + b).items()])
+
+
+def _count_booked_spot_days(spot_days):
+    """
+    Turn (lat, lng, days) entries, one per booked spot with the distinct days it is booked on,
+    into booked counts keyed by CLUSTER_MAX_ZOOM tile.
+    """
+    spot_days = [(lat, lng, days) for lat, lng, days in spot_days if lat is not None and lng is not None]
+    tile_xs, tile_ys = tiles_for([entry[0] for entry in spot_days], [entry[1] for entry in spot_days], CLUSTER_MAX_ZOOM)
+    booked_counts = defaultdict(int)
+    for (_, _, days), tile_x, tile_y in zip(spot_days, tile_xs, tile_ys):
+        for day in days:
+            booked_counts[(CLUSTER_MAX_ZOOM, tile_x, tile_y, day)] += 1
+    return booked_counts
+
+
+def _spot_aggregates(spots):
+    """
+    Group (type, price, lat, lng) spots by CLUSTER_MAX_ZOOM tile and type, into
+    (count, lat_sum, lng_sum, min_price) values. Vectorized when NumPy is available.
+    """
+    spots = [spot for spot in spots if spot[2] is not None and spot[3] is not None]
+    tile_xs, tile_ys = tiles_for([spot[2] for spot in spots], [spot[3] for spot in spots], CLUSTER_MAX_ZOOM)
+    if np is None or not spots:
+        aggregates = {}
+        for (spot_type, price, lat, lng), tile_x, tile_y in zip(spots, tile_xs, tile_ys):
+            key = (CLUSTER_MAX_ZOOM, tile_x, tile_y, spot_type)
+            value = (1, lat, lng, price)
+            aggregates[key] = _merge_spot_aggregates(aggregates[key], value) if key in aggregates else value
+        return aggregates
+
+    types = sorted({spot[0] for spot in spots}, key=lambda spot_type: (spot_type is None, spot_type or ''))
+    type_codes = {spot_type: code for code, spot_type in enumerate(types)}
+    codes = np.array([type_codes[spot[0]] for spot in spots], dtype=np.int64)
+    prices = np.array([spot[1] for spot in spots], dtype=np.float64)  # None becomes NaN
+    lats = np.array([spot[2] for spot in spots], dtype=np.float64)
+    lngs = np.array([spot[3] for spot in spots], dtype=np.float64)
+
+    keys = ((np.array(tile_xs, dtype=np.int64) << CLUSTER_MAX_ZOOM) + np.array(tile_ys, dtype=np.int64)) \
+        * len(types) + codes
+    groups, inverse = np.unique(keys, return_inverse=True)
+    min_prices = np.full(len(groups), np.nan)
+    np.fmin.at(min_prices, inverse, prices)
+    return {
+        (CLUSTER_MAX_ZOOM, (key // len(types)) >> CLUSTER_MAX_ZOOM,
+         (key // len(types)) & ((1 << CLUSTER_MAX_ZOOM) - 1), types[key % len(types)]):
+            (count, lat_sum, lng_sum, None if math.isnan(min_price) else min_price)
+        for key, count, lat_sum, lng_sum, min_price in zip(
+            groups.tolist(), np.bincount(inverse).tolist(), np.bincount(inverse, weights=lats).tolist(),
+            np.bincount(inverse, weights=lngs).tolist(), min_prices.tolist())
+    }
+
+
+def add_spots_to_clusters(c, spots):
+    """
+    Add newly inserted spots to the cluster aggregates.
+    :param spots: Iterable of (type, price, lat, lng) tuples.
+    """
+    _write_spot_aggregates(c, _spot_aggregates(spots))
+
+
+def add_bookings_to_clusters(c, bookings):
+    """
+    Update the per-day booked counts after bookings have been inserted.
+    Call this once the bookings are in the table: a spot only counts as newly booked on a day
+    when every booking covering that day belongs to this batch.
+    :param bookings: Iterable of (spot_id, start_date, end_date) tuples.
+    """
+    # Like rebuild_clusters, skip the days in the past: they are never queried
+    today = datetime.now().strftime('%Y-%m-%d')
+    new_bookings = defaultdict(int)
+    for spot_id, start_date, end_date in bookings:
+        if end_date[:10] < today:
+            continue
+        for day in booking_days(max(start_date[:10], today), end_date):
+            new_bookings[(spot_id, day)] += 1
+
+    newly_booked = []
+    for (spot_id, day), count in new_bookings.items():
+        day_start, day_end = day_window(day)
+        total = c.execute(
+            'SELECT COUNT(*) FROM bookings WHERE spot_id = ? AND end_ts >= ? AND start_ts <= ?',
+            (spot_id, day_start, day_end)
+        ).fetchone()[0]
+        if total <= count:
+            lat, lng = c.execute('SELECT lat, lng FROM parking_spots WHERE id = ?', (spot_id,)).fetchone() or (None, None)
+            newly_booked.append((lat, lng, [day]))
+
+    _write_booked_counts(c, _count_booked_spot_days(newly_booked))
+
+
+def _booked_spot_day_counts(bookings, today):
+    """
+    Count the distinct spots booked on each day from today on, per CLUSTER_MAX_ZOOM tile.
+    :param bookings: (spot_id, lat, lng, start_ts, end_ts) rows of the bookings ending today or later.
+    """
+    if np is None or not bookings:
+        spot_days = {}
+        for spot_id, lat, lng, start_ts, end_ts in bookings:
+            if spot_id not in spot_days:
+                spot_days[spot_id] = (lat, lng, set())
+            spot_days[spot_id][2].update(
+                day for day in booking_days(_epoch_day(start_ts), _epoch_day(end_ts)) if day >= today)
+        return _count_booked_spot_days(spot_days.values())
+
+    # start_ts and end_ts encode the dates as UTC, so whole epoch days are the calendar days
+    bookings = [booking for booking in bookings if booking[1] is not None and booking[2] is not None]
+    tile_xs, tile_ys = tiles_for([booking[1] for booking in bookings], [booking[2] for booking in bookings],
+                                 CLUSTER_MAX_ZOOM)
+    spot_ids = np.array([booking[0] for booking in bookings], dtype=np.int64)
+    first_days = np.maximum(np.array([booking[3] for booking in bookings], dtype=np.int64) // 86400,
+                            day_window(today)[0] // 86400)
+    last_days = np.array([booking[4] for booking in bookings], dtype=np.int64) // 86400
+    lengths = np.maximum(last_days - first_days + 1, 0)
+
+    # One row per booking and day, then one per spot and day, then one count per tile and day.
+    # The pairs are packed into single int64 keys, which np.unique sorts much faster than rows.
+    rows = np.repeat(np.arange(len(bookings)), lengths)
+    days = first_days[rows] + np.arange(len(rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    if not len(rows):
+        return {}
+    first_day, day_count = int(days.min()), int(days.max() - days.min()) + 1
+    spots = np.unique(spot_ids, return_inverse=True)[1]
+    distinct = np.unique(spots[rows] * day_count + days - first_day, return_index=True)[1]
+    rows, days = rows[distinct], days[distinct]
+    tiles = (np.array(tile_xs, dtype=np.int64) << CLUSTER_MAX_ZOOM) + np.array(tile_ys, dtype=np.int64)
+    keys, counts = np.unique(tiles[rows] * day_count + days - first_day, return_counts=True)
+    return {
+        (CLUSTER_MAX_ZOOM, tile >> CLUSTER_MAX_ZOOM, tile & ((1 << CLUSTER_MAX_ZOOM) - 1),
+         _epoch_day((first_day + day) * 86400)): count
+        for tile, day, count in zip((keys // day_count).tolist(), (keys % day_count).tolist(), counts.tolist())
+    }
+
+
+def _epoch_day(timestamp):
+    """
+    Return the 'YYYY-MM-DD' day of an epoch timestamp encoded like bookings.start_ts/end_ts.
+    """
+    return (date(1970, 1, 1) + timedelta(days=timestamp // 86400)).isoformat()
+
+
+def rebuild_clusters(c):
+    """
+    Recompute all cluster aggregates from parking_spots and bookings.
+    Spots are read in chunks of ids and grouped per tile with NumPy when it is available.
+    """
+    c.execute('DELETE FROM spot_clusters')
+    c.execute('DELETE FROM spot_cluster_bookings')
+
+    aggregates = {}
+    last_id = 0
+    while True:
+        chunk = c.execute(
+            'SELECT id, type, price, lat, lng FROM parking_spots WHERE id > ? ORDER BY id LIMIT 100000', (last_id,)
+        ).fetchall()
+        if not chunk:
+            break
+        last_id = chunk[-1][0]
+        for key, value in _spot_aggregates([spot[1:] for spot in chunk]).items():
+            aggregates[key] = _merge_spot_aggregates(aggregates[key], value) if key in aggregates else value
+    _write_spot_aggregates(c, aggregates)
+
+    # Days in the past are never queried, so only keep today onwards
+    today = datetime.now().strftime('%Y-%m-%d')
+    _write_booked_counts(c, _booked_spot_day_counts(c.execute('''
+        SELECT b.spot_id, ps.lat, ps.lng, b.start_ts, b.end_ts
+        FROM bookings b JOIN parking_spots ps ON ps.id = b.spot_id
+        WHERE b.end_ts >= ?
+    ''', (day_window(today)[0],)).fetchall(), today))
+
+
+def create_cluster_state(c):
+    # The data version and the last spot and booking ids the aggregates reflect, and the day
+    # they were last pruned on; see sync_clusters
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS cluster_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL,
+        rewrites INTEGER NOT NULL,
+        spot_watermark INTEGER NOT NULL,
+        booking_watermark INTEGER NOT NULL,
+        day TEXT NOT NULL
+    )
+    ''')
+
+
+def _clusters_current(c, today):
+    return c.execute('''-- name: cluster_state
+        SELECT 1 FROM cluster_state s JOIN data_version v ON v.id = s.id
+        WHERE s.id = 1 AND s.version = v.version AND s.rewrites = v.rewrites AND s.day = ?
+    ''', (today,)).fetchone() is not None
+
+
+def sync_clusters(c):
+    """
+    Bring the cluster aggregates up to date with parking_spots and bookings, whoever wrote them.
+    Call it inside a write transaction.
+    Spots and bookings appended since the last call are added in place. The data_version
+    triggers count every insert, so when the version moved further than the appended rows
+    account for, or a row was updated or deleted, the aggregates are rebuilt. Days that have
+    passed are dropped once a day.
+    """
+    today = datetime.now().strftime('%Y-%m-%d')
+    if _clusters_current(c, today):
+        return
+    version, rewrites = c.execute('SELECT version, rewrites FROM data_version WHERE id = 1').fetchone()
+    state = c.execute(
+        'SELECT version, rewrites, spot_watermark, booking_watermark, day FROM cluster_state WHERE id = 1'
+    ).fetchone()
+
+    rebuild = state is None or state[1] != rewrites
+    if not rebuild:
+        new_spots = c.execute(
+            'SELECT type, price, lat, lng FROM parking_spots WHERE id > ?', (state[2],)).fetchall()
+        new_bookings = c.execute(
+            'SELECT spot_id, start_date, end_date FROM bookings WHERE id > ?', (state[3],)).fetchall()
+        rebuild = version - state[0] != len(new_spots) + len(new_bookings)
+
+    if rebuild:
+        rebuild_clusters(c)
+    else:
+        if state[4] != today:
+            c.execute('DELETE FROM spot_cluster_bookings WHERE day < ?', (today,))
+        add_spots_to_clusters(c, new_spots)
+        add_bookings_to_clusters(c, new_bookings)
+
+    c.execute('''
+    INSERT OR REPLACE INTO cluster_state (id, version, rewrites, spot_watermark, booking_watermark, day)
+    VALUES (1, ?, ?, (SELECT COALESCE(MAX(id), 0) FROM parking_spots), (SELECT COALESCE(MAX(id), 0) FROM bookings), ?)
+    ''', (version, rewrites, today))
+
+
+def refresh_clusters(conn):
+    """
+    Sync the cluster aggregates before they are read, in a transaction of its own when they are
+    behind: writes made through create_booking and bulk.py are synced as part of them, but
+    other writers and the passing of days are only noticed here.
+    """
+    if _clusters_current(conn, datetime.now().strftime('%Y-%m-%d')):
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        sync_clusters(conn)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def get_clusters(conn, zoom, bounds, day):
+    """
+    Return the pre-aggregated clusters of the map tiles covering a viewport.
+    :param zoom: Map zoom level, at most CLUSTER_MAX_ZOOM.
+    :param bounds: (south, west, north, east) viewport.
+    :param day: 'YYYY-MM-DD' day used for the available counts.
+    :return: A list of cluster dictionaries, one per non-empty tile.
+    """
+    refresh_clusters(conn)
+    min_x, max_x, min_y, max_y = tile_range(bounds, zoom)
+
+    clusters = {}
+    rows = conn.execute('''-- name: cluster_tiles
+        SELECT tile_x, tile_y, type, spot_count, lat_sum, lng_sum, min_price
+        FROM spot_clusters
+        WHERE zoom = ? AND tile_x BETWEEN ? AND ? AND tile_y BETWEEN ? AND ?
+    ''', (zoom, min_x, max_x, min_y, max_y)).fetchall()
+    for tile_x, tile_y, spot_type, spot_count, lat_sum, lng_sum, min_price in rows:
+        cluster = clusters.setdefault((tile_x, tile_y), {
+            'tile': [tile_x, tile_y],
+            'count': 0,
+            'lat_sum': 0.0,
+            'lng_sum': 0.0,
+            'min_price': min_price,
+            'types': {}
+        })
+        cluster['count'] += spot_count
+        cluster['lat_sum'] += lat_sum
+        cluster['lng_sum'] += lng_sum
+        cluster['min_price'] = min(cluster['min_price'], min_price)
+        cluster['types'][spot_type] = spot_count
+
+    booked = dict(((tile_x, tile_y), booked_count) for tile_x, tile_y, booked_count in conn.execute('''-- name: cluster_bookings
+        SELECT tile_x, tile_y, booked_count
+        FROM spot_cluster_bookings
+        WHERE zoom = ? AND day = ? AND tile_x BETWEEN ? AND ? AND tile_y BETWEEN ? AND ?
+    ''', (zoom, day, min_x, max_x, min_y, max_y)))
+
+    result = []
+    for key, cluster in clusters.items():
+        count = cluster['count']
+        result.append({
+            'tile': cluster['tile'],
+            'count': count,
+            'lat': cluster['lat_sum'] / count,
+            'lng': cluster['lng_sum'] / count,
+            'available': max(count - booked.get(key, 0), 0),
+            'min_price': cluster['min_price'],
+            'types': cluster['types']
+        })
+    return result
+
+
+def merge_clusters(cluster_lists):
+    """
+    Merge the clusters that several shards returned for the same viewport. A tile on the border
+    between two shards comes back from both and is combined into one cluster.
+    """
+    merged = {}
+    for clusters in cluster_lists:
+        for cluster in clusters:
+            key = tuple(cluster['tile'])
+            other = merged.get(key)
+            if other is None:
+                merged[key] = dict(cluster, types=dict(cluster['types']))
+                continue
+            count = other['count'] + cluster['count']
+            other['lat'] = (other['lat'] * other['count'] + cluster['lat'] * cluster['count']) / count
+            other['lng'] = (other['lng'] * other['count'] + cluster['lng'] * cluster['count']) / count
+            other['count'] = count
+            other['available'] += cluster['available']
+            other['min_price'] = min(other['min_price'], cluster['min_price'])
+            for spot_type, spot_count in cluster['types'].items():
+                other['types'][spot_type] = other['types'].get(spot_type, 0) + spot_count
+    return list(merged.values())
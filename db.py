@@ -0,0 +1,187 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from flask import g
+from init_db import DATABASE
+from metrics import QUERY_LATENCY, QUERY_ROWS, SLOW_QUERIES
+
+logger = logging.getLogger(__name__)
+
+# Prepared statements kept per connection; the app issues a few dozen distinct queries
+STATEMENT_CACHE_SIZE = 256
+
+# Statements taking longer than this, including fetching their rows, are logged with their parameters
+SLOW_QUERY_SECONDS = float(os.environ.get('CARSPOT_SLOW_QUERY_MS', '100')) / 1000
+
+# A statement can name itself with a leading '-- name: <name>' comment; others are named after
+# their verb and first table, e.g. 'select parking_spots'
+_NAME_COMMENT = re.compile(r'^\s*--\s*name:\s*(\w+)')
+_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE(?:\s+OR\s+\w+)?)\s+(\w+)', re.IGNORECASE)
+_query_names = {}
+
+_local = threading.local()
+
+
+def query_name(sql):
+    name = _query_names.get(sql)
+    if name is None:
+        match = _NAME_COMMENT.match(sql)
+        if match:
+            name = match.group(1)
+        else:
+            verb = sql.split(None, 1)[0].lower() if sql.strip() else 'other'
+            table = _TABLE.search(sql) if verb in ('select', 'insert', 'replace', 'update', 'delete') else None
+            name = f'{verb} {table.group(1)}' if table else verb
+        if len(_query_names) < 1000:  # Bound the cache in case something builds SQL with literals
+            _query_names[sql] = name
+    return name
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    Cursor recording how long each statement takes and how many rows it returns.
+    The time of a query includes fetching its rows, so a statement is recorded once it is
+    exhausted, replaced by the next one or the cursor goes away.
+    """
+
+    _sql = None
+
+    def _record(self):
+        sql, self._sql = self._sql, None
+        if sql is None:
+            return
+        name = query_name(sql)
+        rows = self._rows if self.description is not None else max(self.rowcount, 0)
+        QUERY_LATENCY.observe(self._elapsed, name)
+        QUERY_ROWS.inc(name, amount=rows)
+        if self._elapsed >= SLOW_QUERY_SECONDS:
+            SLOW_QUERIES.inc(name)
+            logger.warning("Slow query %s: %.1fms, %d rows\n%s\nparameters: %.200r",
+                           name, self._elapsed * 1000, rows, ' '.join(sql.split()), self._params)
+
+    def _timed(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._elapsed += time.perf_counter() - started
+
+    def execute(self, sql, parameters=()):
+        self._record()
+        self._sql, self._params, self._elapsed, self._rows = sql, parameters, 0.0, 0
+        self._timed(super().execute, sql, parameters)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._record()
+        self._sql, self._params, self._elapsed, self._rows = sql, '<many>', 0.0, 0
+        self._timed(super().executemany, sql, seq_of_parameters)
+        self._record()
+        return self
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._record()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, self.arraysize if size is None else size)
+        self._rows += len(rows)
+        if not rows:
+            self._record()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._rows += len(rows)
+        self._record()
+        return rows
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def close(self):
+        self._record()
+        super().close()
+
+    def __del__(self):
+        self._record()
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    Connection whose statements are timed by TimedCursor, commits included.
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        super().commit()
+        QUERY_LATENCY.observe(time.perf_counter() - started, 'commit')
+
+
+def connect(path=DATABASE):
+    """
+    Open a SQLite connection tuned for the web app.
+    WAL lets readers run while a booking is being written, and synchronous=NORMAL is durable
+    enough in WAL mode while avoiding an fsync on every commit.
+    Statements are timed and counted for /metrics, see TimedCursor.
+    """
+    conn = sqlite3.connect(path, timeout=10, cached_statements=STATEMENT_CACHE_SIZE, factory=TimedConnection)
+    # Per-database state, such as the availability index of each shard, is keyed by the path
+    conn.path = path
+    conn.row_factory = sqlite3.Row  # This enables column access by name: row['column_name']
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA mmap_size = 268435456')  # 256 MiB
+    conn.execute('PRAGMA cache_size = -65536')  # 64 MiB
+    conn.execute('PRAGMA temp_store = MEMORY')
+    return conn
+
+
+def get_db(path=DATABASE):
+    """
+    Return the current request's connection to a database, by default the unsharded one.
+    Each thread keeps one connection per database open across requests, so its page cache and
+    statement cache stay warm instead of being rebuilt on every hit.
+    """
+    dbs = g.setdefault('dbs', {})
+    if path not in dbs:
+        # A connection must not be shared with a forked child, e.g. a gunicorn worker
+        if getattr(_local, 'pid', None) != os.getpid():
+            _local.conns = {}
+            _local.pid = os.getpid()
+        if path not in _local.conns:
+            _local.conns[path] = connect(path)
+        dbs[path] = _local.conns[path]
+    return dbs[path]
+
+
+def release_db(exception=None):
+    """
+    Hand the request's connections back to its thread, discarding any transaction left open.
+    """
+    for conn in g.pop('dbs', {}).values():
+        if conn.in_transaction:
+            conn.rollback()
+
+
+def init_app(app):
+    app.teardown_appcontext(release_db)
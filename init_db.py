@@ -1,50 +1,111 @@
+import argparse
+import logging
+import os
 import sqlite3
 import random
+import calendar
+import time
 from datetime import datetime, timedelta
+from clusters import create_cluster_state, create_cluster_tables, rebuild_clusters, sync_clusters
+import shards
+
+DATABASE = os.environ.get('CARSPOT_DATABASE', 'parking.db')
+
+logger = logging.getLogger(__name__)
 
 def get_minimum_price(conn):
+    # Read from the per-type summary kept by the spot_price_stats triggers, not from parking_spots
     cursor = conn.cursor()
-    cursor.execute('SELECT MIN(price) FROM parking_spots')
+    cursor.execute('-- name: min_price\nSELECT MIN(min_price) FROM spot_price_stats')
     min_price = cursor.fetchone()[0]
     return float(min_price) if min_price is not None else 0.00
 
 def get_maximum_price(conn):
     cursor = conn.cursor()
-    cursor.execute('SELECT MAX(price) FROM parking_spots')
+    cursor.execute('-- name: max_price\nSELECT MAX(max_price) FROM spot_price_stats')
     max_price = cursor.fetchone()[0]
     return float(max_price) if max_price is not None else 0.00
 
-def random_coordinates():
-    # Coordinates for Dsseldorf  some offset
-    lat = 51.2277 + random.uniform(-0.1, 0.1)
-    lng = 6.7735 + random.uniform(-0.1, 0.1)
+def get_price_stats(conn):
+    """
+    :return: A dictionary mapping each spot type to its spot count and price range.
+    """
+    return {
+        row[0]: {'count': row[1], 'min_price': row[2], 'max_price': row[3]}
+        for row in conn.execute(
+            '-- name: price_stats\nSELECT type, spot_count, min_price, max_price FROM spot_price_stats ORDER BY type')
+    }
+
+def to_epoch(date_text):
+    """
+    Convert a 'YYYY-MM-DD HH:MM:SS' or 'YYYY-MM-DD' string to epoch seconds.
+    Dates are stored without a timezone, so they are encoded as if they were UTC; this matches
+    SQLite's strftime('%s', ...) used by the bookings triggers.
+    """
+    return calendar.timegm(datetime.fromisoformat(date_text).timetuple())
+
+def from_epoch(timestamp):
+    return datetime(1970, 1, 1) + timedelta(seconds=timestamp)
+
+def random_coordinates(rng=random, bounds=None):
+    if bounds is not None:
+        south, west, north, east = bounds
+        return rng.uniform(south, north), rng.uniform(west, east)
+    # Coordinates for Düsseldorf ± some offset
+    lat = 51.2277 + rng.uniform(-0.1, 0.1)
+    lng = 6.7735 + rng.uniform(-0.1, 0.1)
     return lat, lng
 
-def get_filtered_parking_spots(conn, spot_type, max_price, start_date, end_date, only_available=False):
+# Probe for a booking of spot ps.id overlapping a (start, end) epoch window. Served by
+# idx_bookings_spot_time, which seeks straight past bookings that ended before the window,
+# so the cost does not grow with the booking history.
+BOOKING_OVERLAP_QUERY = '''
+            SELECT 1 FROM bookings b
+            WHERE b.spot_id = ps.id AND b.end_ts >= ? AND b.start_ts <= ?
+        '''
+
+def get_filtered_parking_spots(conn, spot_type, max_price, start_date, end_date, only_available=False, bounds=None,
+                               city=None):
+    """
+    Return the parking spots matching the filters, with their availability for the given window.
+    :param bounds: Optional (south, west, north, east) viewport. When given, only the spots inside it
+                   are returned, looked up through the parking_spots_rtree spatial index.
+    :param city: Optional city, as stored in parking_spots.city.
+    """
     cursor = conn.cursor()
     try:
         # Build the SELECT clause
-        select_clause = '''
+        select_clause = '''-- name: filter_spots
         SELECT ps.id, ps.location, ps.lat, ps.lng, ps.type, ps.price,
-        CASE WHEN b.spot_id IS NULL THEN 1 ELSE 0 END AS available
-        FROM parking_spots ps
+        CASE WHEN EXISTS (''' + BOOKING_OVERLAP_QUERY + ''') THEN 0 ELSE 1 END AS available
         '''
 
-        # Build the LEFT JOIN clause on bookings to determine availability
-        left_join_clause = '''
-        LEFT JOIN (
-            SELECT spot_id
-            FROM bookings
-            WHERE end_date >= ? AND start_date <= ?
-            GROUP BY spot_id
-        ) b ON ps.id = b.spot_id
+        # In viewport mode drive the query from the R*Tree so only on-screen rows are visited.
+        # CROSS JOIN pins that order: given a type or city filter, the planner would otherwise
+        # read every spot of that type through its index and probe the R*Tree once per spot.
+        if bounds is not None:
+            select_clause += '''
+        FROM parking_spots_rtree r CROSS JOIN parking_spots ps
         '''
-        
+        else:
+            select_clause += '''
+        FROM parking_spots ps
+        '''
+
         # Initialize parameters for the booking overlap condition
-        params = [start_date, end_date]
+        window = [to_epoch(start_date), to_epoch(end_date)]
+        params = list(window)
 
         conditions = []
 
+        # Restrict to the viewport; the R*Tree stores 32-bit floats, so recheck the exact coordinates too
+        if bounds is not None:
+            south, west, north, east = bounds
+            conditions.append('r.max_lat >= ? AND r.min_lat <= ? AND r.max_lng >= ? AND r.min_lng <= ?')
+            conditions.append('ps.id = r.id')
+            conditions.append('ps.lat BETWEEN ? AND ? AND ps.lng BETWEEN ? AND ?')
+            params.extend([south, north, west, east, south, north, west, east])
+
         # Filter by spot type if specified
         if spot_type and spot_type != 'All':
             conditions.append('ps.type = ?')
@@ -55,9 +116,14 @@ def get_filtered_parking_spots(conn, spot_type, max_price, start_date, end_date,
             conditions.append('ps.price <= ?')
             params.append(max_price)
 
+        if city:
+            conditions.append('ps.city = ?')
+            params.append(city.lower())
+
         # Ensure we include only available spots if requested
         if only_available:
-            conditions.append('b.spot_id IS NULL')
+            conditions.append('NOT EXISTS (' + BOOKING_OVERLAP_QUERY + ')')
+            params.extend(window)
 
         # Build the WHERE clause if there are any conditions
         where_clause = ''
@@ -65,7 +131,9 @@ def get_filtered_parking_spots(conn, spot_type, max_price, start_date, end_date,
             where_clause = ' WHERE ' + ' AND '.join(conditions)
 
         # Form the full query with all clauses
-        query = select_clause + left_join_clause + where_clause
+        query = select_clause + where_clause
+
+        logger.debug("Filtering parking spots: %s\nparameters: %r", query, params)
 
         # Execute the query with the parameters
         cursor.execute(query, params)
@@ -73,36 +141,107 @@ def get_filtered_parking_spots(conn, spot_type, max_price, start_date, end_date,
         
         # Construct a list of spot dictionaries
         spots = [dict(zip([column[0] for column in cursor.description], row)) for row in rows]
-       
-        print(f"Executing query: {query}")
-        print(f"With parameters: {params}")
 
-        # Optional: Print each spot's availability for debugging
-        for spot in spots:
-            print(f"ID: {spot['id']}, Available: {spot['available']}")
-
-    except Exception as e:
-        print(f"An error occurred: {e}")
+    except Exception:
+        logger.exception("Filtering parking spots failed")
         return []
 
     return spots
 
 
 
-def get_next_available_date(conn, spot_id):
-    # Fetch the latest booking's end date
-    booking_row = conn.execute('SELECT end_date FROM bookings WHERE spot_id = ? ORDER BY end_date DESC LIMIT 1', (spot_id,)).fetchone()
-    if booking_row:
-        last_end_date = datetime.strptime(booking_row['end_date'], '%Y-%m-%d %H:%M:%S')
-        if datetime.now() < last_end_date:
-            return False, (last_end_date + timedelta(days=1)).strftime('%Y-%m-%d')
-    return True, None
+def migrate_booking_times(c):
+    # Bookings used to be compared as TEXT without any index. Add epoch-second copies of the
+    # dates, backfill them, and index them for the overlap and next-available queries.
+    columns = [row[1] for row in c.execute('PRAGMA table_info(bookings)')]
+    if 'start_ts' not in columns:
+        c.execute('ALTER TABLE bookings ADD COLUMN start_ts INTEGER')
+    if 'end_ts' not in columns:
+        c.execute('ALTER TABLE bookings ADD COLUMN end_ts INTEGER')
 
-def initialize_db():
-    conn = sqlite3.connect('parking.db')
-    c = conn.cursor()
+    c.execute('''
+    UPDATE bookings
+    SET start_ts = CAST(strftime('%s', start_date) AS INTEGER),
+        end_ts = CAST(strftime('%s', end_date) AS INTEGER)
+    WHERE start_ts IS NULL OR end_ts IS NULL
+    ''')
+
+    # Keep the epoch columns filled for writers that only set the TEXT dates
+    c.execute('''
+    CREATE TRIGGER IF NOT EXISTS bookings_fill_times_insert
+    AFTER INSERT ON bookings
+    WHEN NEW.start_ts IS NULL OR NEW.end_ts IS NULL
+    BEGIN
+        UPDATE bookings
+        SET start_ts = CAST(strftime('%s', NEW.start_date) AS INTEGER),
+            end_ts = CAST(strftime('%s', NEW.end_date) AS INTEGER)
+        WHERE id = NEW.id;
+    END
+    ''')
+
+    c.execute('''
+    CREATE TRIGGER IF NOT EXISTS bookings_fill_times_update
+    AFTER UPDATE OF start_date, end_date ON bookings
+    BEGIN
+        UPDATE bookings
+        SET start_ts = CAST(strftime('%s', NEW.start_date) AS INTEGER),
+            end_ts = CAST(strftime('%s', NEW.end_date) AS INTEGER)
+        WHERE id = NEW.id;
+    END
+    ''')
+
+    # End before start: bookings that ended before the queried window are skipped by the seek
+    c.execute('CREATE INDEX IF NOT EXISTS idx_bookings_spot_time ON bookings (spot_id, end_ts, start_ts)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_bookings_time ON bookings (end_ts, start_ts)')
+
+def create_spatial_index(c):
+    # R*Tree over the spot coordinates, used by the viewport queries. Points are stored as
+    # zero-size boxes and kept in sync with parking_spots.lat/lng by the triggers below.
+    c.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS parking_spots_rtree USING rtree(
+        id,
+        min_lat, max_lat,
+        min_lng, max_lng
+    )
+    ''')
+
+    c.execute('''
+    CREATE TRIGGER IF NOT EXISTS parking_spots_rtree_insert
+    AFTER INSERT ON parking_spots
+    WHEN NEW.lat IS NOT NULL AND NEW.lng IS NOT NULL
+    BEGIN
+        INSERT INTO parking_spots_rtree VALUES (NEW.id, NEW.lat, NEW.lat, NEW.lng, NEW.lng);
+    END
+    ''')
+
+    c.execute('''
+    CREATE TRIGGER IF NOT EXISTS parking_spots_rtree_update
+    AFTER UPDATE OF lat, lng ON parking_spots
+    BEGIN
+        DELETE FROM parking_spots_rtree WHERE id = OLD.id;
+        INSERT INTO parking_spots_rtree
+        SELECT NEW.id, NEW.lat, NEW.lat, NEW.lng, NEW.lng
+        WHERE NEW.lat IS NOT NULL AND NEW.lng IS NOT NULL;
+    END
+    ''')
 
-    # Create tables if not exists
+    c.execute('''
+    CREATE TRIGGER IF NOT EXISTS parking_spots_rtree_delete
+    AFTER DELETE ON parking_spots
+    BEGIN
+        DELETE FROM parking_spots_rtree WHERE id = OLD.id;
+    END
+    ''')
+
+    # Backfill spots created before the index existed
+    c.execute('''
+    INSERT INTO parking_spots_rtree
+    SELECT id, lat, lat, lng, lng FROM parking_spots
+    WHERE lat IS NOT NULL AND lng IS NOT NULL
+      AND id NOT IN (SELECT id FROM parking_spots_rtree)
+    ''')
+
+def create_tables(c):
     c.execute('''
     CREATE TABLE IF NOT EXISTS parking_spots (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -120,45 +259,391 @@ def initialize_db():
         spot_id INTEGER,
         start_date TEXT,
         end_date TEXT,
+        start_ts INTEGER,
+        end_ts INTEGER,
         FOREIGN KEY (spot_id) REFERENCES parking_spots(id)
     )
     ''')
-    conn.commit()
 
+def add_booking_idempotency_key(c):
+    # Client-chosen key that makes retried booking requests return the first booking instead of
+    # creating a second one
+    columns = [row[1] for row in c.execute('PRAGMA table_info(bookings)')]
+    if 'idempotency_key' not in columns:
+        c.execute('ALTER TABLE bookings ADD COLUMN idempotency_key TEXT')
+    c.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_bookings_idempotency_key
+    ON bookings (idempotency_key) WHERE idempotency_key IS NOT NULL
+    ''')
+
+def create_data_version(c):
+    # Counter bumped by every write to parking_spots or bookings. Workers compare it with the
+    # version their in-memory caches were built from to notice writes made by other processes.
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS data_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+    ''')
+    c.execute('INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)')
+
+def create_price_stats(c):
+    # Spot count and price range per type, maintained by triggers so that the map page does not
+    # aggregate parking_spots on every hit. Removing the cheapest or dearest spot of a type
+    # re-reads that type's range through idx_parking_spots_type_price, which is a single seek.
+    c.execute('CREATE INDEX IF NOT EXISTS idx_parking_spots_type_price ON parking_spots (type, price)')
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS spot_price_stats (
+        type TEXT PRIMARY KEY,
+        spot_count INTEGER NOT NULL,
+        min_price REAL,
+        max_price REAL
+    )
+    ''')
+
+    c.execute('''
+    CREATE TRIGGER IF NOT EXISTS parking_spots_price_stats_insert
+    AFTER INSERT ON parking_spots
+    WHEN NEW.type IS NOT NULL AND NEW.price IS NOT NULL
+    BEGIN
+        INSERT INTO spot_price_stats (type, spot_count, min_price, max_price)
+        VALUES (NEW.type, 1, NEW.price, NEW.price)
+        ON CONFLICT (type) DO UPDATE SET
+            spot_count = spot_count + 1,
+            min_price = MIN(min_price, excluded.min_price),
+            max_price = MAX(max_price, excluded.max_price);
+    END
+    ''')
+
+    remove_old_spot = '''
+        UPDATE spot_price_stats SET
+            spot_count = spot_count - 1,
+            min_price = CASE WHEN OLD.price <= min_price
+                THEN (SELECT MIN(price) FROM parking_spots WHERE type = OLD.type) ELSE min_price END,
+            max_price = CASE WHEN OLD.price >= max_price
+                THEN (SELECT MAX(price) FROM parking_spots WHERE type = OLD.type) ELSE max_price END
+        WHERE type = OLD.type AND OLD.price IS NOT NULL;
+        DELETE FROM spot_price_stats WHERE type = OLD.type AND spot_count <= 0;
+    '''
+
+    c.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS parking_spots_price_stats_delete
+    AFTER DELETE ON parking_spots
+    BEGIN
+        {remove_old_spot}
+    END
+    ''')
+
+    c.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS parking_spots_price_stats_update
+    AFTER UPDATE OF type, price ON parking_spots
+    BEGIN
+        {remove_old_spot}
+        INSERT INTO spot_price_stats (type, spot_count, min_price, max_price)
+        SELECT NEW.type, 1, NEW.price, NEW.price
+        WHERE NEW.type IS NOT NULL AND NEW.price IS NOT NULL
+        ON CONFLICT (type) DO UPDATE SET
+            spot_count = spot_count + 1,
+            min_price = MIN(min_price, excluded.min_price),
+            max_price = MAX(max_price, excluded.max_price);
+    END
+    ''')
+
+    # Backfill the spots created before the summary existed
+    c.execute('DELETE FROM spot_price_stats')
+    c.execute('''
+    INSERT INTO spot_price_stats (type, spot_count, min_price, max_price)
+    SELECT type, COUNT(*), MIN(price), MAX(price) FROM parking_spots
+    WHERE type IS NOT NULL AND price IS NOT NULL
+    GROUP BY type
+    ''')
+
+def add_spot_city(c):
+    # The city a spot belongs to decides its shard, see shards.py. Cities are stored lower case.
+    columns = [row[1] for row in c.execute('PRAGMA table_info(parking_spots)')]
+    if 'city' not in columns:
+        c.execute('ALTER TABLE parking_spots ADD COLUMN city TEXT')
+    c.execute("UPDATE parking_spots SET city = 'dusseldorf' WHERE city IS NULL AND location = 'Random Dusseldorf Location'")
+    c.execute('CREATE INDEX IF NOT EXISTS idx_parking_spots_city ON parking_spots (city)')
+
+def reserve_ids(c, first_id):
+    """
+    Make AUTOINCREMENT hand out spot and booking ids from first_id on, the id range of a shard.
+    :raises ValueError: If the database already holds rows below that range.
+    """
+    for table in ('parking_spots', 'bookings'):
+        row = c.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+        if row is not None and row[0] >= first_id - 1:
+            continue
+        if c.execute(f'SELECT 1 FROM {table} WHERE id < ? LIMIT 1', (first_id,)).fetchone() is not None:
+            raise ValueError(f"{table} holds ids below {first_id}, the database cannot become this shard")
+        if row is None:
+            c.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, first_id - 1))
+        else:
+            c.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (first_id - 1, table))
+
+def ids_reserved(conn, first_id):
+    row = conn.execute("SELECT MIN(seq) FROM sqlite_sequence WHERE name IN ('parking_spots', 'bookings')").fetchone()
+    return first_id <= 1 or (row[0] is not None and row[0] >= first_id - 1)
+
+def add_data_version_triggers(c):
+    # Bump data_version from triggers, so writers that do not go through this code, e.g. the
+    # TEXT-only ones the bookings_fill_times triggers exist for, are noticed too. Updates and
+    # deletes also bump rewrites: caches can apply appended rows in place, but have to be
+    # rebuilt once an existing row changed.
+    columns = [row[1] for row in c.execute('PRAGMA table_info(data_version)')]
+    if 'rewrites' not in columns:
+        c.execute('ALTER TABLE data_version ADD COLUMN rewrites INTEGER NOT NULL DEFAULT 0')
+    for table in ('parking_spots', 'bookings'):
+        c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_version_insert
+        AFTER INSERT ON {table}
+        BEGIN
+            UPDATE data_version SET version = version + 1 WHERE id = 1;
+        END
+        ''')
+        for event in ('UPDATE', 'DELETE'):
+            # bookings_fill_times_insert completes a new booking with an UPDATE; that is still
+            # the insert, which was counted already
+            condition = 'WHEN OLD.start_ts IS NOT NULL AND OLD.end_ts IS NOT NULL' \
+                if (table, event) == ('bookings', 'UPDATE') else ''
+            c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()}
+            AFTER {event} ON {table}
+            {condition}
+            BEGIN
+                UPDATE data_version SET version = version + 1, rewrites = rewrites + 1 WHERE id = 1;
+            END
+            ''')
+
+def skip_filled_times_in_rewrites(c):
+    # The first version of bookings_version_update also counted the fill-in UPDATE of
+    # bookings_fill_times_insert, so every TEXT-only booking looked like a rewrite
+    c.execute('DROP TRIGGER IF EXISTS bookings_version_update')
+    add_data_version_triggers(c)
+
+def get_data_version(conn):
+    return conn.execute('SELECT version FROM data_version WHERE id = 1').fetchone()[0]
+
+def get_rewrite_count(conn):
+    """
+    :return: How many times rows of parking_spots or bookings were updated or deleted.
+    """
+    return conn.execute('SELECT rewrites FROM data_version WHERE id = 1').fetchone()[0]
+
+def bump_data_version(c):
+    """
+    Record a write to parking_spots or bookings made while the data_version triggers were
+    suspended, e.g. by seed_db. Call it inside the writing transaction.
+    :return: The new data version.
+    """
+    c.execute('UPDATE data_version SET version = version + 1 WHERE id = 1')
+    return get_data_version(c)
+
+def create_cluster_aggregates(c):
+    create_cluster_tables(c)
+    rebuild_clusters(c)
+
+def add_cluster_state(c):
+    # The aggregates were only updated by this code's own writers; sync_clusters also follows
+    # the others, through the data version
+    create_cluster_state(c)
+    sync_clusters(c)
+
+# Schema migrations, applied in order; the version reached is stored in PRAGMA user_version.
+# Each step also has to work on databases created before the schema was versioned.
+MIGRATIONS = [
+    create_tables,
+    migrate_booking_times,
+    create_spatial_index,
+    create_cluster_aggregates,
+    add_booking_idempotency_key,
+    create_data_version,
+    create_price_stats,
+    add_spot_city,
+    add_data_version_triggers,
+    skip_filled_times_in_rewrites,
+    add_cluster_state,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate_db(path=DATABASE, first_id=1):
+    """
+    Bring the database schema up to SCHEMA_VERSION.
+    Does not write anything when the schema is already current, so it is cheap to call on every boot.
+    :param first_id: First spot and booking id of the database when it is a shard, see reserve_ids.
+    :return: True if migrations were applied.
+    """
+    conn = sqlite3.connect(path, timeout=60)
+    try:
+        if get_schema_version(conn) >= SCHEMA_VERSION and ids_reserved(conn, first_id):
+            return False
+
+        # Take the write lock first so concurrent workers migrate one after the other
+        conn.execute('BEGIN IMMEDIATE')
+        version = get_schema_version(conn)
+        if version >= SCHEMA_VERSION and ids_reserved(conn, first_id):
+            conn.rollback()
+            return False
+
+        c = conn.cursor()
+        for migration in MIGRATIONS[version:]:
+            migration(c)
+        reserve_ids(c, first_id)
+        c.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.commit()
+        if version < SCHEMA_VERSION:
+            logger.info("Database schema of %s migrated from version %d to %d.", path, version, SCHEMA_VERSION)
+        return version < SCHEMA_VERSION
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def migrate_shards(router):
+    """
+    Create or migrate the database of every shard the router serves.
+    """
+    for shard in router.shards:
+        migrate_db(shard.path, shard.first_id)
+
+# Insert triggers that seed_db suspends, and the migrations that restore them
+SEED_SUSPENDED_TRIGGERS = [
+    'parking_spots_rtree_insert',         # create_spatial_index
+    'parking_spots_price_stats_insert',   # create_price_stats
+    'parking_spots_version_insert',       # add_data_version_triggers
+    'bookings_version_insert',
+]
+
+def seed_db(path=DATABASE, spot_count=2000, booked_ratio=0.20, seed=None, cities=('dusseldorf',), bounds=None):
+    """
+    Insert random parking spots and book a share of them; by default around Dusseldorf.
+    Everything is inserted in bulk in a single transaction.
+    :param spot_count: Number of spots to create, shared evenly between the cities.
+    :param booked_ratio: Share of the new spots that get a booking.
+    :param seed: Seed for the random generator; the same seed gives the same spots.
+    :param cities: Cities recorded for the new spots, e.g. all cities of a shard.
+    :param bounds: Spread the spots over this (south, west, north, east) box instead of Dusseldorf.
+    :return: A (spot_count, booking_count) tuple.
+    """
+    rng = random.Random(seed)
     types = ['Standard', 'Electric', 'Handicap']
 
-    # Insert random parking spots data
-    spot_ids = []  # List to keep track of the spot IDs
-    for _ in range(2000):
-        lat, lng = random_coordinates()
-        spot_type = random.choice(types)
-        c.execute('''
-            INSERT INTO parking_spots (location, type, price, lat, lng) VALUES (?, ?, ?, ?, ?)
-        ''', (
-            'Random Dusseldorf Location', spot_type, random.uniform(1, 10), lat, lng
-        ))
-        spot_ids.append(c.lastrowid)  # Append the ID of the newly created spot
+    conn = sqlite3.connect(path, timeout=60)
+    c = conn.cursor()
+
+    # Bulk-load tuning; these settings only last for this connection
+    c.execute('PRAGMA synchronous = OFF')
+    c.execute('PRAGMA cache_size = -262144')  # 256 MiB
+    c.execute('PRAGMA temp_store = MEMORY')
+
+    try:
+        c.execute('BEGIN IMMEDIATE')
+        previous_max_id = c.execute('SELECT COALESCE(MAX(id), 0) FROM parking_spots').fetchone()[0]
+
+        # The per-row insert triggers cost more than the inserts themselves. Drop them for this
+        # transaction only; the migrations below backfill what they would have written in one
+        # statement each and create them again.
+        for trigger in SEED_SUSPENDED_TRIGGERS:
+            c.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+
+        # Insert random parking spots data
+        def spots():
+            for i, city in enumerate(sorted(cities)):
+                location = f'Random {city.capitalize()} Location'
+                for _ in range(spot_count // len(cities) + (i < spot_count % len(cities))):
+                    lat, lng = random_coordinates(rng, bounds)
+                    yield location, rng.choice(types), rng.uniform(1, 10), lat, lng, city.lower()
+
+        c.executemany('''
+            INSERT INTO parking_spots (location, type, price, lat, lng, city) VALUES (?, ?, ?, ?, ?, ?)
+        ''', spots())
+        spot_ids = [row[0] for row in c.execute('SELECT id FROM parking_spots WHERE id > ?', (previous_max_id,))]
+
+        # Randomly select a share of the spot IDs to make them unavailable
+        unavailable_spot_ids = rng.sample(spot_ids, k=int(len(spot_ids) * booked_ratio))
+        now = datetime.now().replace(microsecond=0)
+
+        def bookings():
+            for spot_id in unavailable_spot_ids:
+                start_date = now + timedelta(days=rng.randint(0, 3))
+                end_date = start_date + timedelta(hours=24) if rng.choice([True, False]) else start_date + timedelta(days=rng.randint(1, 14))
+                yield (spot_id, start_date.strftime('%Y-%m-%d %H:%M:%S'), end_date.strftime('%Y-%m-%d %H:%M:%S'),
+                       calendar.timegm(start_date.timetuple()), calendar.timegm(end_date.timetuple()))
+
+        c.executemany('''
+            INSERT INTO bookings (spot_id, start_date, end_date, start_ts, end_ts) VALUES (?, ?, ?, ?, ?)
+        ''', bookings())
+
+        # One pass over the tables is cheaper than updating the aggregates row by row
+        create_spatial_index(c)
+        create_price_stats(c)
+        add_data_version_triggers(c)
+        # The version moved less than the rows inserted, so sync_clusters rebuilds in one pass too
+        bump_data_version(c)
+        sync_clusters(c)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return len(spot_ids), len(unavailable_spot_ids)
+
+def is_empty(path=DATABASE):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT 1 FROM parking_spots LIMIT 1').fetchone() is None
+    finally:
+        conn.close()
 
-    conn.commit()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create, migrate and seed the CarSpot database.')
+    parser.add_argument('--db', default=DATABASE, help='SQLite database file (default: %(default)s)')
+    parser.add_argument('--shard', action='append', metavar='NAME',
+                        help='with CARSPOT_SHARDS set, only this shard; may be repeated (default: all shards)')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('migrate', help='apply pending schema migrations')
+    seed_parser = subparsers.add_parser('seed', help='migrate, then insert random spots and bookings')
+    seed_parser.add_argument('--spots', type=int, default=2000, help='number of spots to create per shard, shared between its cities (default: %(default)s)')
+    seed_parser.add_argument('--booked-ratio', type=float, default=0.20, help='share of new spots to book (default: %(default)s)')
+    seed_parser.add_argument('--seed', type=int, default=None, help='random seed, for reproducible data')
+    seed_parser.add_argument('--if-empty', action='store_true', help='only seed shards without spots')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
 
-    # Randomly select 20% of the spot IDs to make them unavailable
-    unavailable_spot_ids = random.sample(spot_ids, k=int(len(spot_ids) * 0.20))
+    # Without a command keep the historical behaviour: create the tables and add random data
+    if args.command is None:
+        args = parser.parse_args(['--db', args.db] +
+                                 [option for name in args.shard or () for option in ('--shard', name)] + ['seed'])
 
-    # Insert random bookings data for the selected spots to make them unavailable
-    for spot_id in unavailable_spot_ids:
-        start_date = datetime.now() + timedelta(days=random.randint(0, 3))
-        end_date = start_date + timedelta(hours=24) if random.choice([True, False]) else start_date + timedelta(days=random.randint(1, 14))
-        c.execute('''
-            INSERT INTO bookings (spot_id, start_date, end_date) VALUES (?, ?, ?)
-        ''', (
-            spot_id, start_date.strftime('%Y-%m-%d %H:%M:%S'), end_date.strftime('%Y-%m-%d %H:%M:%S')
-        ))
+    # Each shard is migrated and seeded on its own, in its own transactions, so a node can
+    # bootstrap just the shards it serves
+    router = shards.load_router(args.db, local_names=args.shard)
+    for shard in router.shards:
+        migrate_db(shard.path, shard.first_id)
+        if args.command == 'migrate':
+            continue
 
-    conn.commit()
-    conn.close()
+        if args.if_empty and not is_empty(shard.path):
+            print(f"Shard {shard.name} already has parking spots, not seeding.")
+            continue
 
-    print("Database initialized and random data added.")
+        started = time.perf_counter()
+        spot_count, booking_count = seed_db(
+            shard.path, args.spots, args.booked_ratio,
+            None if args.seed is None else args.seed + shard.number,
+            cities=shard.cities or ('dusseldorf',), bounds=shard.bounds
+        )
+        print(f"Shard {shard.name} seeded with {spot_count} spots and {booking_count} bookings "
+              f"in {time.perf_counter() - started:.1f}s.")
 
 
 if __name__ == '__main__':
-    initialize_db()
+    main()
@@ -0,0 +1,137 @@
+import logging
+import threading
+import time
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds; the app answers most requests in a few milliseconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """
+    A monotonically increasing value per label combination.
+    """
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield f'{self.name}{_format_labels(self.labels, label_values)} {value}'
+
+
+class Histogram:
+    """
+    Observations counted into cumulative buckets per label combination, as Prometheus expects them.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Per-bucket counts, then the sum and the total count
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            series = sorted((label_values, list(values)) for label_values, values in self._series.items())
+        for label_values, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, [('le', repr(bound))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labels, label_values)
+            yield f'{self.name}_bucket{_format_labels(self.labels, label_values, [("le", "+Inf")])} {values[-1]}'
+            yield f'{self.name}_sum{labels} {values[-2]!r}'
+            yield f'{self.name}_count{labels} {values[-1]}'
+
+
+REQUEST_LATENCY = Histogram(
+    'carspot_request_duration_seconds', 'Time spent handling HTTP requests.', ('route', 'method', 'status')
+)
+QUERY_LATENCY = Histogram(
+    'carspot_query_duration_seconds', 'Time spent executing SQL statements and fetching their rows.', ('query',)
+)
+QUERY_ROWS = Counter('carspot_query_rows_total', 'Rows returned or changed by SQL statements.', ('query',))
+SLOW_QUERIES = Counter('carspot_slow_queries_total', 'SQL statements slower than the slow query threshold.', ('query',))
+
+REGISTRY = [REQUEST_LATENCY, QUERY_LATENCY, QUERY_ROWS, SLOW_QUERIES]
+
+
+def render():
+    """
+    Render every metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.description}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+def _record_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        # Label by route pattern rather than path, so /book/<int:spot_id> is one series
+        route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+        REQUEST_LATENCY.observe(elapsed, route, request.method, response.status_code)
+        logger.debug("%s %s %s %.1fms", request.method, request.full_path.rstrip('?'),
+                     response.status_code, elapsed * 1000)
+    return response
+
+
+def init_app(app):
+    """
+    Time every request and serve the metrics of this process at /metrics.
+    Each gunicorn worker keeps its own metrics, so a scraper sees the worker that answered it.
+    """
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+
+    @app.route('/metrics')
+    def metrics():
+        return app.response_class(render(), mimetype='text/plain; version=0.0.4')
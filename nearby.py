@@ -0,0 +1,120 @@
+import math
+
+from init_db import BOOKING_OVERLAP_QUERY, to_epoch
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, distances are then computed one by one
+    np = None
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_LAT_DEGREE = 110.574
+
+# The search starts with a box about a block wide and doubles it until enough spots are found.
+# Starting small matters in dense city centres, where a 500 m box already holds thousands of spots.
+INITIAL_RADIUS_KM = 0.1
+MAX_RADIUS_KM = 25.0
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """
+    Great-circle distances in km from (lat, lng) to each of the points (lats[i], lngs[i]).
+    """
+    if np is not None:
+        lat1, lng1 = math.radians(lat), math.radians(lng)
+        lat2, lng2 = np.radians(np.asarray(lats, dtype=np.float64)), np.radians(np.asarray(lngs, dtype=np.float64))
+        a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    lat1, lng1 = math.radians(lat), math.radians(lng)
+    distances = []
+    for other_lat, other_lng in zip(lats, lngs):
+        lat2, lng2 = math.radians(other_lat), math.radians(other_lng)
+        a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+        distances.append(2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0))))
+    return distances
+
+
+def bounding_box(lat, lng, radius_km):
+    """
+    A (south, west, north, east) box containing the circle of radius_km around (lat, lng).
+    """
+    lat_delta = radius_km / KM_PER_LAT_DEGREE
+    # Near the poles a degree of longitude shrinks to nothing; search all longitudes there
+    cos_lat = math.cos(math.radians(min(abs(lat) + lat_delta, 90.0)))
+    lng_delta = radius_km / (111.320 * cos_lat) if cos_lat > 1e-6 else 360.0
+    return (max(lat - lat_delta, -90.0), max(lng - lng_delta, -180.0),
+            min(lat + lat_delta, 90.0), min(lng + lng_delta, 180.0))
+
+
+def _available_in_box(conn, box, spot_type, max_price, window):
+    """
+    The spots inside the box matching the filters and free for the whole window, found through
+    the R*Tree with the booking overlap check probing idx_bookings_spot_time per candidate.
+    CROSS JOIN keeps the R*Tree first even when idx_parking_spots_type_price could serve the filters.
+    """
+    south, west, north, east = box
+    conditions = ['r.max_lat >= ? AND r.min_lat <= ? AND r.max_lng >= ? AND r.min_lng <= ?', 'ps.id = r.id']
+    params = [south, north, west, east]
+    if spot_type and spot_type != 'All':
+        conditions.append('ps.type = ?')
+        params.append(spot_type)
+    if max_price and max_price != 'No Max':
+        conditions.append('ps.price <= ?')
+        params.append(max_price)
+    conditions.append('NOT EXISTS (' + BOOKING_OVERLAP_QUERY + ')')
+    params.extend(window)
+    return conn.execute('''-- name: nearest_candidates
+        SELECT ps.id, ps.location, ps.lat, ps.lng, ps.type, ps.price
+        FROM parking_spots_rtree r CROSS JOIN parking_spots ps
+        WHERE ''' + ' AND '.join(conditions), params).fetchall()
+
+
+def _nearest_within(lat, lng, rows, radius, k):
+    """
+    The k rows nearest to (lat, lng) within radius km, as (distance, row) pairs sorted by distance.
+    """
+    if not rows:
+        return []
+    distances = haversine_km(lat, lng, [row[2] for row in rows], [row[3] for row in rows])
+    if np is not None:
+        candidates = np.flatnonzero(distances <= radius)
+        if len(candidates) > k:
+            # Only the k smallest need sorting
+            candidates = candidates[np.argpartition(distances[candidates], k - 1)[:k]]
+        ids = np.array([rows[i][0] for i in candidates.tolist()], dtype=np.int64)
+        order = candidates[np.lexsort((ids, distances[candidates]))]
+        return [(float(distances[i]), rows[i]) for i in order.tolist()]
+
+    within = sorted(((distance, row) for distance, row in zip(distances, rows) if distance <= radius),
+                    key=lambda item: (item[0], item[1][0]))
+    return within[:k]
+
+
+def nearest_available_spots(conn, lat, lng, start_date, end_date, k=10, spot_type='All', max_price='No Max',
+                            max_radius_km=MAX_RADIUS_KM):
+    """
+    Return the k spots nearest to (lat, lng) that are free for the whole window.
+    The search box doubles from INITIAL_RADIUS_KM until it holds k free spots within its radius,
+    so only nearby candidates are read even when there are millions of spots.
+    :param start_date: Window start, 'YYYY-MM-DD HH:MM:SS'.
+    :param end_date: Window end, 'YYYY-MM-DD HH:MM:SS', inclusive.
+    :param max_radius_km: Spots farther away than this are never returned.
+    :return: A list of spot dictionaries with a 'distance_km' key, nearest first.
+    """
+    window = (to_epoch(start_date), to_epoch(end_date))
+    radius = min(INITIAL_RADIUS_KM, max_radius_km)
+    while True:
+        rows = _available_in_box(conn, bounding_box(lat, lng, radius), spot_type, max_price, window)
+        nearest = _nearest_within(lat, lng, rows, radius, k)
+        # Spots in the corners of the box may be farther than the radius, and closer spots may lie
+        # just outside the box; only the spots within the radius are certainly the nearest
+        if len(nearest) >= k or radius >= max_radius_km:
+            break
+        radius = min(radius * 2, max_radius_km)
+
+    return [
+        {'id': row[0], 'location': row[1], 'lat': row[2], 'lng': row[3], 'type': row[4], 'price': row[5],
+         'distance_km': round(distance, 3)}
+        for distance, row in nearest
+    ]
@@ -0,0 +1,133 @@
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional, gzip is always available
+    brotli = None
+
+# Bodies smaller than this are sent as they are; compressing them saves less than it costs
+COMPRESSION_THRESHOLD = 1024
+
+
+def columnar_spots(spots):
+    """
+    Encode a list of spot dictionaries as parallel column arrays.
+    Types and locations repeat a lot, so they are sent once in a lookup list and referenced by index;
+    prices are sent in integer cents and coordinates rounded.
+    """
+    types, type_codes = [], {}
+    locations, location_codes = [], {}
+    columns = {'ids': [], 'lat': [], 'lng': [], 'type': [], 'location': [], 'price_cents': [], 'available': []}
+    for spot in spots:
+        if spot['type'] not in type_codes:
+            type_codes[spot['type']] = len(types)
+            types.append(spot['type'])
+        if spot['location'] not in location_codes:
+            location_codes[spot['location']] = len(locations)
+            locations.append(spot['location'])
+        columns['ids'].append(spot['id'])
+        # Six decimals are about 10 cm, plenty for a map marker
+        columns['lat'].append(round(spot['lat'], 6) if spot['lat'] is not None else None)
+        columns['lng'].append(round(spot['lng'], 6) if spot['lng'] is not None else None)
+        columns['type'].append(type_codes[spot['type']])
+        columns['location'].append(location_codes[spot['location']])
+        columns['price_cents'].append(round(spot['price'] * 100) if spot['price'] is not None else None)
+        columns['available'].append(spot['available'])
+    return {'count': len(spots), 'types': types, 'locations': locations, 'columns': columns}
+
+
+class RenderCache:
+    """
+    A small LRU cache of rendered response bodies.
+    Concurrent misses on the same key wait for a single render instead of each rendering
+    the page, so a burst of visitors after a write costs one render.
+    """
+
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.key_locks = {}
+
+    def get(self, key, render):
+        """
+        :param key: Hashable key, e.g. the date and the data version the page was rendered for.
+        :param render: Called without arguments on a miss, returns the body as str or bytes.
+        :return: An (etag, body) tuple with the body as bytes.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self.lock:
+                if key in self.entries:
+                    return self.entries[key]
+            body = render()
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            entry = (hashlib.sha1(body).hexdigest()[:32], body)
+            with self.lock:
+                self.entries[key] = entry
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                self.key_locks.pop(key, None)
+            return entry
+
+
+def make_etag(*parts):
+    """
+    Derive a weak ETag from JSON-serializable parts, e.g. the data version and the request parameters.
+    Weak, because the same payload is sent with different content encodings.
+    """
+    digest = hashlib.sha1(json.dumps(parts, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+    return digest[:32]
+
+
+def not_modified(etag):
+    """
+    Return a 304 response if the client already has the representation with this ETag, else None.
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    return None
+
+
+def cacheable_json(payload, etag):
+    """
+    Build a compact JSON response with an ETag, see cacheable.
+    """
+    return cacheable(json.dumps(payload, separators=(',', ':')).encode('utf-8'), 'application/json', etag)
+
+
+def cacheable(body, mimetype, etag):
+    """
+    Build a response with an ETag, compressed with brotli or gzip when the client accepts it.
+    Caches may store it but have to revalidate it, which is cheap thanks to the ETag.
+    """
+    response = current_app.response_class(mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    response.set_etag(etag, weak=True)
+
+    if len(body) >= COMPRESSION_THRESHOLD:
+        encodings = request.accept_encodings
+        if brotli is not None and encodings['br']:
+            body = brotli.compress(body, quality=5)
+            response.content_encoding = 'br'
+        elif encodings['gzip']:
+            body = gzip.compress(body, compresslevel=6)
+            response.content_encoding = 'gzip'
+
+    response.set_data(body)
+    return response
@@ -0,0 +1,166 @@
+# Region sharding: each shard is a SQLite database holding the spots of some cities together with
+# their bookings and aggregates. A query only opens the shards of the area it covers, each shard's
+# working set stays small enough for the page cache, and a booking in one city never waits for
+# the write lock of another. A node can serve a subset of the shards, see CARSPOT_LOCAL_SHARDS.
+#
+# The shards are listed in the JSON file named by CARSPOT_SHARDS:
+#
+#     {"shards": [
+#         {"name": "rhine", "number": 1, "database": "rhine.db",
+#          "cities": ["dusseldorf", "cologne"], "bounds": [50.6, 6.4, 51.6, 7.4]},
+#         {"name": "berlin", "number": 2, "database": "berlin.db",
+#          "cities": ["berlin"], "bounds": [52.3, 13.0, 52.7, 13.8]}
+#     ]}
+#
+# Relative database paths are resolved against the directory of the file. bounds is the
+# (south, west, north, east) box holding all spots of the shard; a shard without bounds is
+# searched for every viewport, and a shard without cities takes the spots of any city no other
+# shard claims. Without CARSPOT_SHARDS there is a single such shard, the CARSPOT_DATABASE file.
+import json
+import os
+
+# Spot and booking ids carry the number of their shard in the bits above ID_BITS, so a spot is
+# routed by its id alone. Shard 0 hands out ids from 1, as an unsharded database does.
+# JavaScript numbers are exact up to 2 ** 53, which leaves room for 2 ** 21 shards.
+ID_BITS = 32
+MAX_SHARDS = 2 ** (53 - ID_BITS)
+
+
+class Shard:
+    def __init__(self, name, number, path, cities=(), bounds=None):
+        if not 0 <= number < MAX_SHARDS:
+            raise ValueError(f"Shard {name}: number must be between 0 and {MAX_SHARDS - 1}")
+        if bounds is not None:
+            bounds = tuple(float(value) for value in bounds)
+            if len(bounds) != 4 or bounds[0] > bounds[2]:
+                raise ValueError(f"Shard {name}: bounds must be [south, west, north, east]")
+        self.name = name
+        self.number = number
+        self.path = path
+        self.cities = frozenset(city.lower() for city in cities)
+        self.bounds = bounds
+
+    def __repr__(self):
+        return f'Shard({self.name!r}, {self.number}, {self.path!r})'
+
+    @property
+    def first_id(self):
+        return (self.number << ID_BITS) + 1
+
+    def intersects(self, bounds):
+        if self.bounds is None or bounds is None:
+            return True
+        south, west, north, east = bounds
+        return (self.bounds[0] <= north and south <= self.bounds[2]
+                and self.bounds[1] <= east and west <= self.bounds[3])
+
+    def contains(self, lat, lng):
+        return self.intersects((lat, lng, lat, lng))
+
+
+class ShardRouter:
+    """
+    Maps spot ids, cities, points and viewports to the shards holding them.
+    """
+
+    def __init__(self, shards, local_names=None):
+        """
+        :param shards: All shards of the deployment.
+        :param local_names: Names of the shards this node serves, or None for all of them.
+        """
+        self.by_number = {}
+        for shard in shards:
+            if shard.number in self.by_number or any(shard.name == other.name for other in self.by_number.values()):
+                raise ValueError(f"Shard names and numbers must be unique, {shard.name} is not")
+            self.by_number[shard.number] = shard
+        if local_names is not None:
+            unknown = set(local_names) - {shard.name for shard in shards}
+            if unknown:
+                raise ValueError(f"Unknown shards: {', '.join(sorted(unknown))}")
+        self.shards = [shard for shard in shards if local_names is None or shard.name in local_names]
+
+    def _local(self, shard):
+        if shard not in self.shards:
+            raise LookupError(f"Shard {shard.name} is served by another node")
+        return shard
+
+    def for_spot(self, spot_id):
+        """
+        :raises LookupError: If no shard hands out this id, or this node does not serve it.
+        """
+        shard = self.by_number.get(int(spot_id) >> ID_BITS)
+        if shard is None:
+            raise LookupError(f"Parking spot {spot_id} does not exist")
+        return self._local(shard)
+
+    def for_city(self, city):
+        """
+        The shard that stores the spots of a city: the one listing it, else the catch-all shard.
+        :raises LookupError: If no shard takes the city, or this node does not serve it.
+        """
+        city = city.lower()
+        candidates = ([shard for shard in self.by_number.values() if city in shard.cities]
+                      or [shard for shard in self.by_number.values() if not shard.cities])
+        if not candidates:
+            raise LookupError(f"No shard stores the spots of {city}")
+        return self._local(candidates[0])
+
+    def for_point(self, lat, lng, city=None):
+        """
+        The shard that stores a new spot: the shard of its city when known, else the first
+        shard whose bounds contain it.
+        """
+        if city:
+            return self.for_city(city)
+        for shard in self.by_number.values():
+            if shard.bounds is not None and shard.contains(lat, lng):
+                return self._local(shard)
+        return self.for_city('')
+
+    def for_region(self, bounds=None, city=None):
+        """
+        The local shards that may hold spots inside a (south, west, north, east) viewport, or
+        of a city. Without either, all local shards.
+        """
+        if city:
+            try:
+                return [self.for_city(city)]
+            except LookupError:
+                return []
+        return [shard for shard in self.shards if shard.intersects(bounds)]
+
+    def group_ids(self, spot_ids):
+        """
+        :return: A {shard: [spot_id, ...]} dictionary and the list of ids no local shard holds.
+        """
+        groups, unknown = {}, []
+        for spot_id in spot_ids:
+            try:
+                groups.setdefault(self.for_spot(spot_id), []).append(spot_id)
+            except LookupError:
+                unknown.append(spot_id)
+        return groups, unknown
+
+
+def read_config(config_path):
+    with open(config_path) as f:
+        config = json.load(f)
+    base = os.path.dirname(os.path.abspath(config_path))
+    return [
+        Shard(entry['name'], int(entry['number']), os.path.join(base, entry['database']),
+              entry.get('cities', ()), entry.get('bounds'))
+        for entry in config['shards']
+    ]
+
+
+def load_router(default_path, config_path=None, local_names=None):
+    """
+    Build the router from CARSPOT_SHARDS and CARSPOT_LOCAL_SHARDS, a comma-separated list of
+    the shard names this node serves. Without a shard file, default_path is the only shard.
+    """
+    config_path = config_path or os.environ.get('CARSPOT_SHARDS')
+    if not config_path:
+        return ShardRouter([Shard('default', 0, default_path)])
+    if local_names is None and os.environ.get('CARSPOT_LOCAL_SHARDS'):
+        local_names = [name.strip() for name in os.environ['CARSPOT_LOCAL_SHARDS'].split(',') if name.strip()]
+    return ShardRouter(read_config(config_path), local_names)
@@ -1,4 +1,142 @@
-async function applyFilters() {
+// Latest viewport request; responses for an older view are ignored
+var viewportRequestId = 0;
+
+function getViewportCriteria() {
+    var bounds = mymap.getBounds();
+    return {
+        bounds: {
+            south: bounds.getSouth(),
+            west: bounds.getWest(),
+            north: bounds.getNorth(),
+            east: bounds.getEast()
+        },
+        zoom: mymap.getZoom()
+    };
+}
+
+// Set once the user applies filters; until then the map shows the server-side clusters
+var filtersActive = false;
+
+// Called on 'moveend': reload only the spots inside the visible part of the map
+function refreshViewport() {
+    if (filtersActive) {
+        applyFilters({ silent: true });
+    } else {
+        loadClusters();
+    }
+}
+
+// Build the cluster icon: a marker image sized by spot count with the count underneath
+function createClusterIcon(childCount) {
+    var size, className;
+
+    if (childCount <= 20) {
+        size = L.point(40, 41); // Small size
+        className = 'small';
+    } else if (childCount > 20 && childCount <= 50) {
+        size = L.point(60, 62); // Medium size
+        className = 'medium';
+    } else {
+        size = L.point(75, 77); // Large size
+        className = 'large';
+    }
+
+    return L.divIcon({
+        html: `<div class="cluster-marker">
+            <img src="../static/images/map_clusters/marker-cluster-${className}.png" />
+            <span class="marker-number">${childCount}<span class="spots-text"> spots</span></span>
+        </div>`,
+        className: 'cluster-custom', // Custom class for styling
+        iconSize: size,
+        iconAnchor: [size.x / 2, size.y]
+    });
+}
+
+// Load the pre-aggregated clusters of the visible tiles, or the individual spots when zoomed in
+async function loadClusters() {
+    var viewport = getViewportCriteria();
+    var startDate = document.getElementById('filterStartDate').value || new Date().toISOString().split('T')[0];
+    var queryParams = new URLSearchParams({
+        zoom: viewport.zoom,
+        south: viewport.bounds.south,
+        west: viewport.bounds.west,
+        north: viewport.bounds.north,
+        east: viewport.bounds.east,
+        date: startDate.split(' ')[0]
+    });
+    var requestId = ++viewportRequestId;
+
+    try {
+        let response = await fetch('/api/clusters?' + queryParams.toString());
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        let data = await response.json();
+
+        if (requestId !== viewportRequestId || filtersActive) {
+            return; // The map moved or filters were applied while this request was in flight
+        }
+
+        if (data.spots) {
+            updateMap(data.spots, false);
+            return;
+        }
+
+        clusterGroup.clearLayers();
+        serverClusterLayer.clearLayers();
+        data.clusters.forEach(function (cluster) {
+            var marker = L.marker([cluster.lat, cluster.lng], { icon: createClusterIcon(cluster.count) });
+            marker.bindTooltip(`${cluster.available} of ${cluster.count} available, from $${parseFloat(cluster.min_price).toFixed(2)}`);
+            marker.on('click', function () {
+                mymap.setView([cluster.lat, cluster.lng], Math.min(data.zoom + 2, CLUSTER_MAX_ZOOM + 1));
+            });
+            serverClusterLayer.addLayer(marker);
+        });
+        mymap.addLayer(serverClusterLayer);
+    } catch (error) {
+        console.error('Error while loading clusters:', error);
+    }
+}
+
+function filterQueryString(filterCriteria) {
+    var params = new URLSearchParams({
+        type: filterCriteria.type,
+        price: filterCriteria.price,
+        startDate: filterCriteria.startDate,
+        endDate: filterCriteria.endDate,
+        onlyAvailable: filterCriteria.onlyAvailable,
+        zoom: filterCriteria.zoom,
+        format: 'columnar'
+    });
+    if (filterCriteria.bounds) {
+        ['south', 'west', 'north', 'east'].forEach(function (key) {
+            params.set(key, filterCriteria.bounds[key]);
+        });
+    }
+    return params.toString();
+}
+
+// Turn the columnar filter response back into one object per spot
+function spotsFromColumns(data) {
+    var columns = data.columns;
+    var spots = new Array(data.count);
+    for (var i = 0; i < data.count; i++) {
+        spots[i] = {
+            id: columns.ids[i],
+            lat: columns.lat[i],
+            lng: columns.lng[i],
+            type: data.types[columns.type[i]],
+            location: data.locations[columns.location[i]],
+            price: columns.price_cents[i] / 100,
+            available: columns.available[i]
+        };
+    }
+    return spots;
+}
+
+async function applyFilters(options) {
+    var silent = options && options.silent;
+    filtersActive = true;
     var onlyAvailable = document.getElementById('availableSpotsCheckbox').checked;
     var selectedType = document.getElementById('type').value;
     var maxPrice = document.getElementById('price').value;
@@ -17,6 +155,12 @@ async function applyFilters() {
         onlyAvailable: onlyAvailable // Add this line to include the checkbox state
     };
 
+    // Only ask for the spots currently on screen
+    var viewport = getViewportCriteria();
+    filterCriteria.bounds = viewport.bounds;
+    filterCriteria.zoom = viewport.zoom;
+    var requestId = ++viewportRequestId;
+
     // Use the browser's URL API to update the query parameters without reloading the page
     var queryParams = new URLSearchParams(window.location.search);
     queryParams.set('start_date', startDate);
@@ -24,13 +168,8 @@ async function applyFilters() {
     history.replaceState(null, null, "?" + queryParams.toString());
 
     try {
-        let response = await fetch('/api/filter_parking_spots', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify(filterCriteria),
-        });
+        // GET with the compact columnar format, so the browser can revalidate its cached copy
+        let response = await fetch('/api/filter_parking_spots?' + filterQueryString(filterCriteria));
 
         console.log(response);
         if (!response.ok) {
@@ -41,6 +180,12 @@ async function applyFilters() {
         console.log('Response:', response);
         let data = await response.json();
 
+        if (requestId !== viewportRequestId) {
+            return; // The map moved again while this request was in flight
+        }
+
+        data.filteredSpots = spotsFromColumns(data);
+
 
         console.log(data.filteredSpots);
 
@@ -49,7 +194,9 @@ async function applyFilters() {
 
 
         if (data.filteredSpots && data.filteredSpots.length > 0) {
-            updateMap(data.filteredSpots);
+            updateMap(data.filteredSpots, false);
+        } else if (silent) {
+            updateMap([], false);
         } else {
             console.log('No spots found with the selected filters.');
             // If no spots are found, it might be useful to indicate this to the user
@@ -61,16 +208,37 @@ async function applyFilters() {
     }
 
 }
+// The filter window as 'YYYY-MM-DD' days, read from the URL so it follows the filters applied since
+function currentFilterDates() {
+    var queryParams = new URLSearchParams(window.location.search);
+    var today = new Date().toISOString().split('T')[0];
+    return {
+        start: (queryParams.get('start_date') || today).split(' ')[0],
+        end: (queryParams.get('end_date') || today).split(' ')[0]
+    };
+}
+
 function createPopupContent(spot, currentStartDate, currentEndDate) {
-    // Assume currentStartDate and currentEndDate are available in the scope
     var availableColor = spot.available ? 'green' : 'red';
     var spotTypeIconClass = getSpotTypeIcon(spot.type);
     var priceFormatted = parseFloat(spot.price).toFixed(2);
     var availableText = spot.available ? 'Available' : 'Unavailable';
 
-    // Adjust dates based on availability
-    var popupStartDate = spot.available ? currentStartDate : spot.next_available_date;
-    var popupEndDate = spot.available ? currentEndDate : spot.next_available_date;
+    // Adjust dates based on availability; nextFree is loaded when the popup of a booked spot opens
+    var popupStartDate = currentStartDate.split(' ')[0];
+    var popupEndDate = currentEndDate.split(' ')[0];
+    var nextFreeText = '';
+    if (!spot.available) {
+        if (spot.nextFree === undefined) {
+            nextFreeText = 'Looking for the next free days...';
+        } else if (spot.nextFree === null) {
+            nextFreeText = 'No free window of this length in the next weeks';
+        } else {
+            popupStartDate = spot.nextFree.start.split(' ')[0];
+            popupEndDate = spot.nextFree.end.split(' ')[0];
+            nextFreeText = `Next free: ${popupStartDate} to ${popupEndDate}`;
+        }
+    }
 
     // Create popup content
     var popupContent = `
@@ -84,6 +252,7 @@ function createPopupContent(spot, currentStartDate, currentEndDate) {
             </div>
             <div style="color: ${availableColor};"> ${availableText}
             </div>
+            <div class="next-free mb-2">${nextFreeText}</div>
             <button class="btn btn-danger btn-block" data-id="${spot.id}" data-start-date="${popupStartDate}" data-end-date="${popupEndDate}">Book now</button>
         </div>
     `;
@@ -91,13 +260,12 @@ function createPopupContent(spot, currentStartDate, currentEndDate) {
 }
 
 
-function updateMap(filteredSpots) {
+function updateMap(filteredSpots, fitToSpots) {
     clusterGroup.clearLayers();  // Clear existing markers
+    serverClusterLayer.clearLayers();
 
     // Get current filter dates from the URL
-    var queryParams = new URLSearchParams(window.location.search);
-    var currentStartDate = queryParams.get('start_date') || new Date().toISOString().split('T')[0];
-    var currentEndDate = queryParams.get('end_date') || new Date().toISOString().split('T')[0];
+    var dates = currentFilterDates();
 
     filteredSpots.forEach(function (spot) {
         if (!spot.lat || !spot.lng) {
@@ -106,8 +274,14 @@ function updateMap(filteredSpots) {
         }
 
         var isAvailable = spot.hasOwnProperty('isAvailable') ? spot.isAvailable : spot.available;
-        var marker = L.marker([spot.lat, spot.lng], { icon: parkingSpotIcon })
-            .bindPopup(createPopupContent(spot, currentStartDate, currentEndDate), { maxWidth: "300" });
+        var marker = L.marker([spot.lat, spot.lng], { icon: parkingSpotIcon, spotData: spot })
+            .bindPopup(createPopupContent(spot, dates.start, dates.end), { maxWidth: "300" });
+        if (!isAvailable) {
+            marker.on('popupopen', function () {
+                var dates = currentFilterDates();
+                loadNextFree([marker], dates.start, dates.end);
+            });
+        }
         clusterGroup.addLayer(marker);
     });
 
@@ -120,6 +294,10 @@ function updateMap(filteredSpots) {
 
     mymap.addLayer(clusterGroup);
 
+    if (fitToSpots === false) {
+        return; // Viewport results: keep the user's current view
+    }
+
     if (filteredSpots.length > 0) {
         var group = new L.featureGroup(filteredSpots.map(spot => L.marker([spot.lat, spot.lng])));
         mymap.fitBounds(group.getBounds());
@@ -128,6 +306,42 @@ function updateMap(filteredSpots) {
     }
 }
 
+// Ask the availability API for the first free window of each booked spot, as many whole days
+// long as the filtered window, and show it in the spots' popups. All markers share one request.
+async function loadNextFree(markers, currentStartDate, currentEndDate) {
+    markers = markers.filter(function (marker) {
+        var spot = marker.options.spotData;
+        return spot && !spot.available && spot.nextFree === undefined;
+    });
+    if (markers.length === 0) {
+        return;
+    }
+    var startDay = currentStartDate.split(' ')[0];
+    var days = Math.round((new Date(currentEndDate.split(' ')[0]) - new Date(startDay)) / 86400000) + 1;
+    var queryParams = new URLSearchParams({
+        ids: markers.map(marker => marker.options.spotData.id).join(','),
+        from: startDay,
+        minHours: Math.max(days, 1) * 24,
+        wholeDays: true
+    });
+
+    try {
+        let response = await fetch('/api/availability?' + queryParams.toString());
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        let data = await response.json();
+        markers.forEach(function (marker) {
+            var spot = marker.options.spotData;
+            var timeline = data.spots[spot.id];
+            spot.nextFree = timeline ? timeline.next_free : null;
+            marker.setPopupContent(createPopupContent(spot, currentStartDate, currentEndDate));
+        });
+    } catch (error) {
+        console.error('Error while loading the next free windows:', error);
+    }
+}
+
 function attachClickEventToButtons() {
     console.log
     document.querySelectorAll('.btn-danger.btn-block').forEach(function (button) {
@@ -162,11 +376,24 @@ function updatePriceValue(value) {
     // This will ensure two decimal places are shown in the displayed price
     document.getElementById('priceValue').textContent = '$' + parseFloat(value).toFixed(2);
 }
+
+function updatePriceRange() {
+    // Limit the price slider to the price range of the selected type
+    var option = document.getElementById('type').selectedOptions[0];
+    var priceSlider = document.getElementById('price');
+    priceSlider.min = option.dataset.minPrice;
+    priceSlider.max = option.dataset.maxPrice;
+    priceSlider.value = Math.min(Math.max(parseFloat(priceSlider.value), priceSlider.min), priceSlider.max);
+    updatePriceValue(priceSlider.value);
+}
 // This function will send a POST request to perform the booking and handle the response.
 function bookSpot(spotId, startDate, endDate) {
     // Add a fallback for startDate and endDate if they are null or undefined
-    var startDate = document.getElementById('filterStartDate').value || new Date().toISOString().split('T')[0];
-    var endDate = document.getElementById('filterEndDate').value || new Date().toISOString().split('T')[0];
+    startDate = startDate || document.getElementById('filterStartDate').value || new Date().toISOString().split('T')[0];
+    endDate = endDate || document.getElementById('filterEndDate').value || new Date().toISOString().split('T')[0];
+    // The booking form has date inputs, which stay empty when given a time as well
+    startDate = startDate.split(' ')[0];
+    endDate = endDate.split(' ')[0];
     window.location.href = `/book/${spotId}?start_date=${startDate}&end_date=${endDate}`;
 }
 // This is the redirect function
@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# app.py opens its database when it is imported, so point it at a scratch file first
+os.environ.setdefault('CARSPOT_DATABASE', os.path.join(tempfile.mkdtemp(prefix='carspot-tests-'), 'parking.db'))
+os.environ.pop('CARSPOT_SHARDS', None)
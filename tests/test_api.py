@@ -0,0 +1,52 @@
+import pytest
+
+from app import app
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+@pytest.mark.parametrize('price', ['abc', 'nan', 'inf', '-1'])
+def test_filter_rejects_bad_price(client, price):
+    response = client.get('/api/filter_parking_spots', query_string={
+        'startDate': '2026-10-18 00:00:00', 'endDate': '2026-10-19 23:59:59', 'price': price})
+    assert response.status_code == 400
+    assert 'price' in response.json['error']
+
+
+@pytest.mark.parametrize('price', ['No Max', '', '4.5'])
+def test_filter_accepts_price(client, price):
+    response = client.get('/api/filter_parking_spots', query_string={
+        'startDate': '2026-10-18 00:00:00', 'endDate': '2026-10-19 23:59:59', 'price': price})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('min_hours', ['abc', 'nan', 'inf', '1e400'])
+def test_availability_rejects_bad_min_hours(client, min_hours):
+    response = client.get('/api/availability', query_string={'ids': '1', 'minHours': min_hours})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('start_date, end_date', [
+    ('tomorrow', '2026-10-19'), ('2026-10-18', '2026-13-01'), ('2026-10-19', '2026-10-18')])
+def test_filter_rejects_bad_dates(client, start_date, end_date):
+    response = client.get('/api/filter_parking_spots', query_string={'startDate': start_date, 'endDate': end_date})
+    assert response.status_code == 400
+    assert 'ETag' not in response.headers
+
+
+@pytest.mark.parametrize('params', [
+    {'price': 'abc'}, {'price': '-2'}, {'k': 'ten'}, {'k': '0'}, {'maxDistance': 'far'},
+    {'startDate': '2026-11-03', 'endDate': '2026-11-02'}, {'startDate': 'soon'}])
+def test_nearest_spots_rejects_bad_parameters(client, params):
+    response = client.get('/api/nearest_spots', query_string={'lat': 51.2277, 'lng': 6.7735, **params})
+    assert response.status_code == 400
+
+
+def test_nearest_spots_accepts_whole_days(client):
+    response = client.get('/api/nearest_spots', query_string={
+        'lat': 51.2277, 'lng': 6.7735, 'startDate': '2026-11-02', 'endDate': '2026-11-02', 'price': '5'})
+    assert response.status_code == 200
+    assert (response.json['startDate'], response.json['endDate']) == ('2026-11-02 00:00:00', '2026-11-02 23:59:59')
@@ -0,0 +1,130 @@
+import calendar
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import availability
+from db import connect
+from init_db import get_filtered_parking_spots, migrate_db, seed_db
+
+if not availability.ENABLED:
+    pytest.skip('the availability index needs numpy', allow_module_level=True)
+
+DUSSELDORF = (51.17, 6.70, 51.28, 6.85)
+
+
+def date_text(timestamp):
+    return datetime(1970, 1, 1) + timedelta(seconds=timestamp)
+
+
+@pytest.fixture(scope='module')
+def conn(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('availability') / 'parking.db')
+    migrate_db(path)
+    seed_db(path, spot_count=400, booked_ratio=0.3, seed=7)
+
+    # Bookings starting and ending at arbitrary seconds, so windows often cut a slot in two
+    rng = random.Random(7)
+    today = calendar.timegm(datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timetuple())
+    conn = connect(path)
+    with conn:
+        for _ in range(600):
+            start_ts = today + rng.randint(-86400, 20 * 86400)
+            end_ts = start_ts + rng.randint(0, 3 * 86400)
+            conn.execute('INSERT INTO bookings (spot_id, start_date, end_date) VALUES (?, ?, ?)',
+                         (rng.randint(1, 400), str(date_text(start_ts)), str(date_text(end_ts))))
+    yield conn
+    conn.close()
+
+
+def sql_result(conn, *args, **kwargs):
+    return sorted(get_filtered_parking_spots(conn, *args, **kwargs), key=lambda spot: spot['id'])
+
+
+@pytest.mark.parametrize('only_available', [False, True])
+@pytest.mark.parametrize('bounds', [None, (51.20, 6.74, 51.25, 6.80)])
+def test_index_matches_sql(conn, only_available, bounds):
+    index = availability.get_index(conn)
+    rng = random.Random(f'{only_available}-{bounds}')
+    for _ in range(60):
+        start_ts = rng.randint(index.horizon_start, index.horizon_end)
+        # Mostly short windows, where the edge slots decide, and a few spanning days
+        end_ts = min(start_ts + rng.choice([0, rng.randint(1, 7200), rng.randint(1, 10 * 86400)]), index.horizon_end)
+        spot_type = rng.choice(['All', 'Standard', 'Electric', 'Handicap'])
+        max_price = rng.choice(['No Max', 2.5, 7.0])
+        expected = sql_result(conn, spot_type, max_price, str(date_text(start_ts)), str(date_text(end_ts)),
+                              only_available, bounds)
+        assert index.query(conn, spot_type, max_price, start_ts, end_ts, only_available, bounds) == expected
+
+
+def test_filter_spots_matches_sql_for_whole_days(conn):
+    start = datetime.now().strftime('%Y-%m-%d')
+    end = (datetime.now() + timedelta(days=2)).strftime('%Y-%m-%d')
+    for only_available in (False, True):
+        expected = sql_result(conn, 'All', 'No Max', f'{start} 00:00:00', f'{end} 23:59:59', only_available)
+        assert availability.filter_spots(conn, 'All', 'No Max', f'{start} 00:00:00', f'{end} 23:59:59',
+                                         only_available) == expected
+
+
+@pytest.fixture
+def fresh_db(tmp_path):
+    path = str(tmp_path / 'parking.db')
+    migrate_db(path)
+    seed_db(path, spot_count=100, booked_ratio=0.2, seed=11)
+    conn, other = connect(path), connect(path)
+    yield conn, other
+    conn.close()
+    other.close()
+
+
+def book(conn, spot_id, day, booking_id=None):
+    with conn:
+        conn.execute('INSERT INTO bookings (id, spot_id, start_date, end_date) VALUES (?, ?, ?, ?)',
+                     (booking_id, spot_id, f'{day} 10:00:00', f'{day} 12:00:00'))
+
+
+def test_catch_up_applies_appended_bookings_without_counting(fresh_db):
+    conn, other = fresh_db
+    index = availability.get_index(conn)
+    day = datetime.now().strftime('%Y-%m-%d')
+    book(other, 1, day)
+
+    statements = []
+    conn.set_trace_callback(statements.append)
+    assert availability.get_index(conn) is index
+    conn.set_trace_callback(None)
+    assert not any('COUNT(' in sql for sql in statements)
+    spots = {spot['id']: spot['available'] for spot in availability.filter_spots(
+        conn, 'All', 'No Max', f'{day} 10:30:00', f'{day} 11:00:00')}
+    assert spots[1] == 0
+
+
+@pytest.mark.parametrize('write', [
+    lambda conn: conn.execute('UPDATE parking_spots SET price = 99 WHERE id = 3'),
+    lambda conn: conn.execute('DELETE FROM bookings WHERE id = (SELECT MIN(id) FROM bookings)'),
+    lambda conn: conn.execute("INSERT INTO parking_spots (location, type, price, lat, lng, city) "
+                              "VALUES ('New', 'Standard', 2, 51.2, 6.7, 'dusseldorf')"),
+])
+def test_catch_up_rebuilds_after_other_writes(fresh_db, write):
+    conn, other = fresh_db
+    index = availability.get_index(conn)
+    with other:
+        write(other)
+    assert availability.get_index(conn) is not index
+
+
+def test_catch_up_rebuilds_after_booking_below_the_watermark(fresh_db):
+    conn, other = fresh_db
+    day = datetime.now().strftime('%Y-%m-%d')
+    first_id = other.execute('SELECT MIN(id) FROM bookings').fetchone()[0]
+    with other:
+        other.execute('DELETE FROM bookings WHERE id = ?', (first_id,))
+    index = availability.get_index(conn)
+
+    # Reuses the id of the deleted booking, so it is not above the index's booking watermark
+    book(other, 2, day, booking_id=first_id)
+    assert availability.get_index(conn) is not index
+    spots = {spot['id']: spot['available'] for spot in availability.filter_spots(
+        conn, 'All', 'No Max', f'{day} 10:30:00', f'{day} 11:00:00')}
+    assert spots[2] == 0
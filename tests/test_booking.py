@@ -0,0 +1,64 @@
+import pytest
+
+from app import app
+from db import connect
+from init_db import DATABASE
+
+JSON = {'Accept': 'application/json'}
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+@pytest.fixture
+def spot_id():
+    conn = connect(DATABASE)
+    with conn:
+        spot_id = conn.execute(
+            "INSERT INTO parking_spots (location, type, price, lat, lng) VALUES ('Test', 'Garage', 3.5, 51.2277, 6.7735)"
+        ).lastrowid
+    conn.close()
+    return spot_id
+
+
+def book(client, spot_id, start_date, end_date, key=None, headers=JSON):
+    if key:
+        headers = {**headers, 'Idempotency-Key': key}
+    return client.post('/confirm_booking', headers=headers,
+                       data={'spot_id': spot_id, 'start_date': start_date, 'end_date': end_date})
+
+
+def test_overlapping_booking_is_a_conflict(client, spot_id):
+    assert book(client, spot_id, '2026-11-02', '2026-11-04').status_code == 201
+    response = book(client, spot_id, '2026-11-04', '2026-11-05')
+    assert response.status_code == 409
+    assert response.json['success'] is False
+
+
+def test_replayed_key_returns_the_first_booking(client, spot_id):
+    first = book(client, spot_id, '2026-11-02', '2026-11-03', key='replay')
+    assert first.status_code == 201 and first.json['created']
+
+    replay = book(client, spot_id, '2026-11-02', '2026-11-03', key='replay')
+    assert replay.status_code == 200
+    assert not replay.json['created']
+    assert replay.json['booking_id'] == first.json['booking_id']
+
+    page = book(client, spot_id, '2026-11-02', '2026-11-03', key='replay', headers={'Accept': 'text/html'})
+    assert page.status_code == 302
+
+
+def test_key_reused_for_another_window_is_rejected(client, spot_id):
+    assert book(client, spot_id, '2026-11-02', '2026-11-03', key='reused').status_code == 201
+    response = book(client, spot_id, '2026-11-06', '2026-11-07', key='reused')
+    assert response.status_code == 400
+    assert 'idempotency key' in response.json['message']
+
+
+@pytest.mark.parametrize('start_date, end_date', [('soon', '2026-11-03'), ('2026-11-02', '2026-13-01')])
+def test_unparseable_dates_get_a_fixed_message(client, spot_id, start_date, end_date):
+    response = book(client, spot_id, start_date, end_date)
+    assert response.status_code == 400
+    assert response.json['message'] == "The dates must be 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS' dates"
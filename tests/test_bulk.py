@@ -0,0 +1,64 @@
+import json
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import bulk
+from clusters import rebuild_clusters
+from db import connect
+from init_db import migrate_db, seed_db
+from shards import Shard, ShardRouter
+
+
+@pytest.fixture
+def shard(tmp_path):
+    path = str(tmp_path / 'parking.db')
+    migrate_db(path)
+    seed_db(path, spot_count=200, booked_ratio=0, seed=3)
+    conn = connect(path)
+    yield ShardRouter([Shard('default', 0, path)]), conn
+    conn.close()
+
+
+def import_bookings(router, conn, bookings):
+    lines = [json.dumps(booking) + '\n' for booking in bookings]
+    reports = list(bulk.import_records(router, lambda path: conn, 'bookings', bulk.read_records(lines, 'ndjson'),
+                                       batch_size=50))
+    return reports[-1]
+
+
+def booked_counts(conn):
+    return conn.execute('SELECT * FROM spot_cluster_bookings ORDER BY zoom, day, tile_x, tile_y').fetchall()
+
+
+def test_imported_bookings_update_clusters_like_a_rebuild(shard):
+    router, conn = shard
+    rng = random.Random(3)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    bookings = []
+    for spot_id in range(1, 201):
+        # Partner history from the last weeks, and bookings running into or starting after today
+        start = today + timedelta(days=rng.randint(-30, 10), hours=rng.randint(0, 23))
+        end = start + timedelta(hours=rng.randint(1, 72))
+        bookings.append({'spot_id': spot_id, 'start_date': start.strftime('%Y-%m-%d %H:%M:%S'),
+                         'end_date': end.strftime('%Y-%m-%d %H:%M:%S')})
+    report = import_bookings(router, conn, bookings)
+    assert report['imported'] == 200
+
+    incremental = booked_counts(conn)
+    assert all(day >= today.strftime('%Y-%m-%d') for _, day, _, _, _ in incremental)
+    with conn:
+        rebuild_clusters(conn)
+    assert incremental == booked_counts(conn)
+
+
+def test_import_rejects_conflicts_and_unknown_spots(shard):
+    router, conn = shard
+    day = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+    report = import_bookings(router, conn, [
+        {'spot_id': 1, 'start_date': day, 'end_date': day},
+        {'spot_id': 1, 'start_date': f'{day} 12:00:00', 'end_date': f'{day} 13:00:00'},
+        {'spot_id': 999, 'start_date': day, 'end_date': day},
+    ])
+    assert (report['imported'], report['rejected']) == (1, 2)
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import clusters
+from clusters import add_bookings_to_clusters, add_spots_to_clusters, get_clusters, rebuild_clusters
+from db import connect
+from init_db import migrate_db, seed_db
+
+DUSSELDORF = (51.10, 6.60, 51.35, 6.95)
+
+
+@pytest.fixture
+def conn(tmp_path):
+    path = str(tmp_path / 'parking.db')
+    migrate_db(path)
+    seed_db(path, spot_count=300, booked_ratio=0.3, seed=2)
+    conn = connect(path)
+    yield conn
+    conn.close()
+
+
+def aggregates(conn):
+    return (conn.execute('SELECT * FROM spot_clusters ORDER BY zoom, tile_x, tile_y, type').fetchall(),
+            conn.execute('SELECT * FROM spot_cluster_bookings ORDER BY zoom, day, tile_x, tile_y').fetchall())
+
+
+def rebuilt(conn):
+    conn.execute('SAVEPOINT rebuild')
+    rebuild_clusters(conn)
+    result = aggregates(conn)
+    conn.execute('ROLLBACK TO rebuild')
+    conn.execute('RELEASE rebuild')
+    return result
+
+
+def approx(tables):
+    # Sums of coordinates differ in the last bits depending on the order spots were added in
+    return [[tuple(round(value, 6) if isinstance(value, float) else value for value in row) for row in rows]
+            for rows in tables]
+
+
+TODAY = datetime.now().strftime('%Y-%m-%d')
+
+
+@pytest.mark.parametrize('write', [
+    "UPDATE parking_spots SET lat = lat + 0.05, price = 0.5 WHERE id % 7 = 0",
+    "DELETE FROM parking_spots WHERE id % 11 = 0",
+    "DELETE FROM bookings WHERE id % 2 = 0",
+    "INSERT INTO parking_spots (location, type, price, lat, lng, city) "
+    "VALUES ('Raw', 'Standard', 0.75, 51.2, 6.77, 'dusseldorf')",
+    f"INSERT INTO bookings (spot_id, start_date, end_date) VALUES (5, '{TODAY} 08:00:00', '{TODAY} 09:00:00')",
+])
+def test_writes_of_other_writers_reach_the_clusters(conn, write):
+    with conn:
+        conn.execute(write)
+    get_clusters(conn, 10, DUSSELDORF, TODAY)
+    assert approx(aggregates(conn)) == approx(rebuilt(conn))
+
+
+def test_passed_days_are_pruned(conn):
+    yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+    with conn:
+        conn.execute("INSERT INTO spot_cluster_bookings VALUES (14, ?, 1, 1, 3)", (yesterday,))
+        conn.execute('UPDATE cluster_state SET day = ?', (yesterday,))
+    get_clusters(conn, 10, DUSSELDORF, TODAY)
+    assert conn.execute('SELECT COUNT(*) FROM spot_cluster_bookings WHERE day < ?', (TODAY,)).fetchone()[0] == 0
+    assert aggregates(conn) == rebuilt(conn)
+
+
+@pytest.mark.parametrize('numpy', [True, False])
+def test_rebuild_matches_adding_everything(conn, monkeypatch, numpy):
+    if not numpy:
+        monkeypatch.setattr(clusters, 'np', None)
+    today = datetime.now()
+    with conn:
+        # Bookings from the past into the future, some of them spanning weeks
+        conn.executemany('INSERT INTO bookings (spot_id, start_date, end_date) VALUES (?, ?, ?)', [
+            (spot_id, str(today + timedelta(days=spot_id % 9 - 4, hours=spot_id % 5)),
+             str(today + timedelta(days=spot_id % 9 - 4 + spot_id % 23, hours=3))) for spot_id in range(1, 301, 4)
+        ])
+        conn.execute('DELETE FROM spot_clusters')
+        conn.execute('DELETE FROM spot_cluster_bookings')
+        add_spots_to_clusters(conn, conn.execute('SELECT type, price, lat, lng FROM parking_spots').fetchall())
+        add_bookings_to_clusters(conn, conn.execute('SELECT spot_id, start_date, end_date FROM bookings').fetchall())
+    assert approx(aggregates(conn)) == approx(rebuilt(conn))
@@ -0,0 +1,64 @@
+import random
+
+import pytest
+
+from db import connect
+from init_db import migrate_db
+from nearby import haversine_km, nearest_available_spots
+
+ORIGIN = (51.2277, 6.7735)
+WINDOW = ('2026-11-02 00:00:00', '2026-11-03 23:59:59')
+
+
+@pytest.fixture(scope='module')
+def conn(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('nearby') / 'parking.db')
+    migrate_db(path)
+    rng = random.Random(9)
+    conn = connect(path)
+    with conn:
+        conn.executemany('INSERT INTO parking_spots (location, type, price, lat, lng, city) VALUES (?, ?, ?, ?, ?, ?)', [
+            (f'Spot {i}', rng.choice(['Standard', 'Electric']), rng.uniform(1, 10),
+             ORIGIN[0] + rng.uniform(-0.3, 0.3), ORIGIN[1] + rng.uniform(-0.3, 0.3), 'dusseldorf')
+            for i in range(3000)
+        ])
+        # Every third spot is booked overlapping the window, one of them only for its last hour
+        conn.executemany('INSERT INTO bookings (spot_id, start_date, end_date) VALUES (?, ?, ?)', [
+            (spot_id, '2026-11-03 23:00:00' if spot_id % 2 else '2026-11-01 08:00:00', '2026-11-04 10:00:00')
+            for spot_id in range(3, 3001, 3)
+        ])
+    yield conn
+    conn.close()
+
+
+def brute_force(conn, k, max_radius_km, spot_type='All', max_price='No Max'):
+    rows = conn.execute('''
+        SELECT id, lat, lng, type, price FROM parking_spots ps
+        WHERE NOT EXISTS (SELECT 1 FROM bookings b WHERE b.spot_id = ps.id AND b.end_ts >= ? AND b.start_ts <= ?)
+    ''', [int(conn.execute("SELECT strftime('%s', ?)", (date,)).fetchone()[0]) for date in WINDOW]).fetchall()
+    rows = [row for row in rows if (spot_type == 'All' or row[3] == spot_type)
+            and (max_price == 'No Max' or row[4] <= max_price)]
+    distances = haversine_km(*ORIGIN, [row[1] for row in rows], [row[2] for row in rows])
+    ranked = sorted((float(distance), row[0]) for distance, row in zip(distances, rows) if distance <= max_radius_km)
+    return [spot_id for _, spot_id in ranked[:k]]
+
+
+@pytest.mark.parametrize('k, max_radius_km, spot_type, max_price', [
+    (1, 25, 'All', 'No Max'), (10, 25, 'All', 'No Max'), (50, 25, 'Electric', 4.0), (100, 1.5, 'All', 'No Max')])
+def test_matches_brute_force(conn, k, max_radius_km, spot_type, max_price):
+    spots = nearest_available_spots(conn, *ORIGIN, *WINDOW, k, spot_type, max_price, max_radius_km)
+    assert [spot['id'] for spot in spots] == brute_force(conn, k, max_radius_km, spot_type, max_price)
+    distances = [spot['distance_km'] for spot in spots]
+    assert distances == sorted(distances)
+
+
+def test_radius_cuts_off(conn):
+    spots = nearest_available_spots(conn, *ORIGIN, *WINDOW, 100, max_radius_km=0.8)
+    assert len(spots) < 100
+    assert all(spot['distance_km'] <= 0.8 for spot in spots)
+
+
+def test_booked_spots_are_excluded(conn):
+    spots = nearest_available_spots(conn, *ORIGIN, *WINDOW, 100)
+    assert len(spots) == 100
+    assert all(spot['id'] % 3 for spot in spots)
@@ -0,0 +1,51 @@
+import pytest
+
+from db import connect
+from init_db import get_filtered_parking_spots, migrate_db, seed_db
+from nearby import nearest_available_spots
+
+VIEWPORT = (51.20, 6.74, 51.25, 6.80)
+
+
+@pytest.fixture(scope='module')
+def conn(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('plans') / 'parking.db')
+    migrate_db(path)
+    seed_db(path, spot_count=2000, booked_ratio=0.2, seed=5)
+    conn = connect(path)
+    yield conn
+    conn.close()
+
+
+def query_plans(conn, name, run):
+    """
+    Run a query function and return the EXPLAIN QUERY PLAN details of its statements named name.
+    """
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        run()
+    finally:
+        conn.set_trace_callback(None)
+    return [[row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+            for sql in statements if f'-- name: {name}' in sql]
+
+
+def assert_starts_from_rtree(plans):
+    assert plans
+    for plan in plans:
+        assert plan[0].startswith('SCAN r VIRTUAL TABLE INDEX 2'), plan
+        assert plan[1] == 'SEARCH ps USING INTEGER PRIMARY KEY (rowid=?)', plan
+
+
+@pytest.mark.parametrize('spot_type, max_price, city', [
+    ('All', 'No Max', None), ('Standard', 'No Max', None), ('Electric', 5.0, None), ('Standard', 5.0, 'dusseldorf')])
+def test_viewport_filter_starts_from_rtree(conn, spot_type, max_price, city):
+    assert_starts_from_rtree(query_plans(conn, 'filter_spots', lambda: get_filtered_parking_spots(
+        conn, spot_type, max_price, '2026-10-18 00:00:00', '2026-10-19 23:59:59', True, VIEWPORT, city)))
+
+
+@pytest.mark.parametrize('spot_type, max_price', [('All', 'No Max'), ('Standard', 5.0)])
+def test_nearest_spots_start_from_rtree(conn, spot_type, max_price):
+    assert_starts_from_rtree(query_plans(conn, 'nearest_candidates', lambda: nearest_available_spots(
+        conn, 51.2277, 6.7735, '2026-10-18 00:00:00', '2026-10-19 23:59:59', 10, spot_type, max_price)))
@@ -0,0 +1,79 @@
+import json
+
+from init_db import from_epoch
+
+DAY = 86400
+# How far ahead free windows are computed when the caller does not say
+HORIZON_DAYS = 30
+
+
+def free_intervals(conn, spot_ids, start_ts, end_ts):
+    """
+    Compute the free intervals of many spots between start_ts and end_ts with one query.
+    Booking intervals are sorted and merged per spot, touching and overlapping ones included,
+    and the gaps between them are the free intervals.
+    :param spot_ids: Iterable of spot ids.
+    :return: A dictionary mapping each existing spot id to its sorted list of free
+             (start_ts, end_ts) intervals, both ends inclusive. Unknown ids are left out.
+    """
+    spot_ids = sorted({int(spot_id) for spot_id in spot_ids})
+    if not spot_ids:
+        return {}
+
+    # The ids are passed as one JSON array, so any number of spots costs a single statement;
+    # each spot is an idx_bookings_spot_time range seek past its bookings ending before start_ts
+    rows = conn.execute('''-- name: timeline_bookings
+        SELECT ps.id, b.start_ts, b.end_ts
+        FROM json_each(?) ids
+        JOIN parking_spots ps ON ps.id = ids.value
+        LEFT JOIN bookings b ON b.spot_id = ps.id AND b.end_ts >= ? AND b.start_ts <= ?
+        ORDER BY ps.id, b.start_ts
+    ''', (json.dumps(spot_ids), start_ts, end_ts)).fetchall()
+
+    result = {}
+    spot_id = free = cursor = None
+    for row_spot_id, booking_start, booking_end in rows:
+        if row_spot_id != spot_id:
+            if spot_id is not None and cursor <= end_ts:
+                free.append((cursor, end_ts))
+            spot_id, free, cursor = row_spot_id, [], start_ts
+            result[spot_id] = free
+        if booking_start is None:
+            continue  # No bookings in the window
+        if booking_start > cursor:
+            free.append((cursor, booking_start - 1))
+        cursor = max(cursor, booking_end + 1)
+    if spot_id is not None and cursor <= end_ts:
+        free.append((cursor, end_ts))
+    return result
+
+
+def next_free_window(intervals, duration, not_before=None, whole_days=False):
+    """
+    Find the earliest window of the given length inside the free intervals.
+    :param duration: Length of the window in seconds.
+    :param not_before: Earliest allowed start, in epoch seconds.
+    :param whole_days: Only windows that start at midnight and span whole days, as booked
+                       through the booking form.
+    :return: A (start_ts, end_ts) tuple with an inclusive end, or None.
+    """
+    for free_start, free_end in intervals:
+        start = free_start if not_before is None else max(free_start, not_before)
+        if whole_days:
+            start += -start % DAY
+            duration += -duration % DAY
+        if start + duration - 1 <= free_end:
+            return start, start + duration - 1
+    return None
+
+
+def is_free(intervals, start_ts, end_ts):
+    return any(free_start <= start_ts and end_ts <= free_end for free_start, free_end in intervals)
+
+
+def format_interval(interval):
+    start_ts, end_ts = interval
+    return {
+        'start': from_epoch(start_ts).strftime('%Y-%m-%d %H:%M:%S'),
+        'end': from_epoch(end_ts).strftime('%Y-%m-%d %H:%M:%S'),
+    }